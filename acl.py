@@ -0,0 +1,113 @@
+# acl.py
+"""
+What can user X do, who can access object Y: listings of the effective rights (direct
+and through groups, see rightstore.py) with keyset pagination and streaming.
+
+  rights_for_user  - one page of (object_id, object_name, [right types]), PK range scan
+  acl_for_object   - one page of (user_id, username, [right types]), covered by
+                     idx_effective_object_user
+  access_counts    - objects per user / users per object from the trigger-maintained
+  access_summary     count tables, no GROUP BY over the rights
+"""
+from db import get_db
+from metrics import instrument
+import rightstore
+
+
+def _page(sql, params, limit):
+    rightstore.flush_pending()
+    conn = get_db()
+    try:
+        cursor = conn.cursor()
+        rows = cursor.execute(sql, params).fetchall()
+        types = rightstore.right_types(cursor)
+        rows = [(key, name, [t for t, bit in types if mask & bit]) for key, name, mask in rows]
+    finally:
+        conn.close()
+    next_cursor = rows[-1][0] if len(rows) == limit else None
+    return rows, next_cursor
+
+
+@instrument
+def rights_for_user(user_id, limit=100, after_object_id=None):
+    """
+    One page of the objects a user can access and the cursor for the next page
+    (pass it as after_object_id; None on the last page).
+    """
+    return _page("""
+        SELECT e.object_id, o.name, e.mask
+        FROM effective_rights e LEFT JOIN objects o ON o.id = e.object_id
+        WHERE e.user_id = ? AND e.object_id > ?
+        ORDER BY e.object_id LIMIT ?
+    """, (user_id, after_object_id or 0, limit), limit)
+
+
+@instrument
+def acl_for_object(object_id, limit=100, after_user_id=None):
+    """One page of the users that can access an object, and the cursor for the next page."""
+    return _page("""
+        SELECT e.user_id, u.username, e.mask
+        FROM effective_rights e LEFT JOIN users u ON u.id = e.user_id
+        WHERE e.object_id = ? AND e.user_id > ?
+        ORDER BY e.user_id LIMIT ?
+    """, (object_id, after_user_id or 0, limit), limit)
+
+
+def _iterate(query, key, page_size):
+    after = None
+    while True:
+        rows, after = query(key, page_size, after)
+        yield from rows
+        if after is None:
+            return
+
+
+def iter_rights_for_user(user_id, page_size=1000):
+    """Yield every (object_id, object_name, rights) of a user, page by page."""
+    return _iterate(rights_for_user, user_id, page_size)
+
+
+def iter_acl_for_object(object_id, page_size=1000):
+    """Yield every (user_id, username, rights) of an object, page by page."""
+    return _iterate(acl_for_object, object_id, page_size)
+
+
+@instrument
+def access_counts(user_id=None, object_id=None):
+    """{"objects": n} for a user and / or {"users": n} for an object."""
+    rightstore.flush_pending()
+    conn = get_db()
+    try:
+        result = {}
+        if user_id is not None:
+            row = conn.execute("SELECT objects FROM user_access_counts WHERE user_id = ?", (user_id,)).fetchone()
+            result["objects"] = row[0] if row else 0
+        if object_id is not None:
+            row = conn.execute("SELECT users FROM object_access_counts WHERE object_id = ?", (object_id,)).fetchone()
+            result["users"] = row[0] if row else 0
+        return result
+    finally:
+        conn.close()
+
+
+@instrument
+def access_summary(top=10):
+    """Totals and the users / objects with the most access, read from the count tables."""
+    rightstore.flush_pending()
+    conn = get_db()
+    try:
+        users, user_pairs = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(objects), 0) FROM user_access_counts").fetchone()
+        objects = conn.execute("SELECT COUNT(*) FROM object_access_counts").fetchone()[0]
+        top_users = conn.execute("""
+            SELECT c.user_id, u.username, c.objects FROM user_access_counts c LEFT JOIN users u ON u.id = c.user_id
+            ORDER BY c.objects DESC LIMIT ?
+        """, (top,)).fetchall()
+        top_objects = conn.execute("""
+            SELECT c.object_id, o.name, c.users FROM object_access_counts c LEFT JOIN objects o ON o.id = c.object_id
+            ORDER BY c.users DESC LIMIT ?
+        """, (top,)).fetchall()
+    finally:
+        conn.close()
+    return {"users_with_access": users, "objects_with_access": objects, "access_pairs": user_pairs,
+            "top_users": top_users, "top_objects": top_objects}
@@ -0,0 +1,123 @@
+# analysis.py
+"""
+can_share / can_steal predicates over the protection graph.
+
+The rules in rights.py work on a single object at a time:
+  grant: any holder of a right on an object can pass it to any user,
+  take:  a holder of 'take' on an object can copy any right on it from another holder.
+So the island/bridge/span structure of the classic Take-Grant analysis collapses to the
+star of subjects around each object: every question about object y is answered by one
+pass over the holders of y (O(holders), no rule application, no global search).
+
+Only direct rights count. A right held through a group (groups.py) gives its members
+access, but grant and take check direct rights only, so it can be neither passed on nor
+taken: group rights never make can_share or can_steal true, and "x holds the right"
+means x holds it directly.
+
+Witness paths are lists of steps that can be replayed with rights.py:
+  ("grant", from_user_id, to_user_id, object_id, right_type)  -> grant_right(*step[1:])
+  ("take", taker_user_id, target_user_id, object_id, right_type) -> take_right(*step[1:])
+"""
+from graph import RIGHT_BITS, analysis_graph
+
+
+def _graph(graph):
+    if graph is not None:
+        return graph
+    return analysis_graph()
+
+
+def _holders(graph, object_id, bit):
+    """User ids holding the rights in bit on the object, read under the graph's lock."""
+    if not bit:
+        return []
+    with graph._lock:
+        o = graph.object_index.get(object_id)
+        if o is None:
+            return []
+        return [graph.subjects[s] for s, mask in graph.in_edges[o].items() if mask & bit]
+
+
+def _first(iterable, skip=None):
+    for item in iterable:
+        if item != skip:
+            return item
+    return None
+
+
+def can_share(right_type, x, y, graph=None):
+    """
+    Can user x obtain right_type over object y if every subject cooperates?
+    Returns (bool, witness_path).
+    """
+    graph = _graph(graph)
+    if graph.has_right(x, y, right_type):
+        return True, []
+
+    holder = _first(_holders(graph, y, RIGHT_BITS.get(right_type, 0)), skip=x)
+    if holder is None:
+        # nobody holds the right, no rule can create it
+        return False, []
+
+    if graph.has_right(x, y, "take"):
+        return True, [("take", x, holder, y, right_type)]
+    return True, [("grant", holder, x, y, right_type)]
+
+
+def can_steal(right_type, x, y, graph=None):
+    """
+    Can user x obtain right_type over object y without any current holder of that
+    right granting it? Other rights may still be granted by anyone.
+    Returns (bool, witness_path).
+    """
+    graph = _graph(graph)
+    if graph.has_right(x, y, right_type):
+        # stealing requires that x does not already own the right
+        return False, []
+
+    holder = _first(_holders(graph, y, RIGHT_BITS.get(right_type, 0)), skip=x)
+    if holder is None:
+        return False, []
+
+    if graph.has_right(x, y, "take"):
+        return True, [("take", x, holder, y, right_type)]
+
+    if right_type == "take":
+        # 'take' holders are the owners here and may not grant it, take needs 'take' itself
+        return False, []
+
+    # Any 'take' holder (owners included) may grant 'take' to x, then x takes the right
+    taker = _first(_holders(graph, y, RIGHT_BITS["take"]), skip=x)
+    if taker is None:
+        return False, []
+    return True, [
+        ("grant", taker, x, y, "take"),
+        ("take", x, holder, y, right_type),
+    ]
+
+
+def stealable_objects(right_type, x, graph=None):
+    """
+    Object ids on which x could steal right_type. One pass over all objects: O(edges).
+    """
+    graph = _graph(graph)
+    bit = RIGHT_BITS.get(right_type, 0)
+    take_bit = RIGHT_BITS["take"]
+    s = graph.subject_index.get(x)
+    own = graph.out_edges[s] if s is not None else {}
+    result = []
+    with graph._lock:
+        for o, holders in enumerate(graph.in_edges):
+            if not holders or own.get(o, 0) & bit:
+                continue
+            has_right = has_take = False
+            for mask in holders.values():
+                has_right = has_right or bool(mask & bit)
+                has_take = has_take or bool(mask & take_bit)
+                if has_right and has_take:
+                    break
+            if not has_right:
+                continue
+            if own.get(o, 0) & take_bit or (has_take and right_type != "take"):
+                result.append(graph.objects[o])
+    return result
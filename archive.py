@@ -0,0 +1,142 @@
+# archive.py
+"""
+Audit retention: old audit rows are moved out of the hot audit table into gzip JSON Lines
+segments (one file per id range, listed in the audit_segments table).
+search_audit() reads archived segments and the hot table as one stream.
+
+  python archive.py [max_age_days] [max_hot_rows]
+"""
+import gzip
+import json
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+import db
+from audit import AUDIT_COLUMNS, flush, iter_audit
+
+# Retention settings
+HOT_MAX_AGE_DAYS = 30      # rows older than this are archived
+HOT_MAX_ROWS = 100000      # the hot table never keeps more rows than this
+SEGMENT_ROWS = 50000       # rows per archive file
+
+
+def archive_dir():
+    return os.path.join(os.path.dirname(os.path.abspath(db.DB_NAME)), "audit_archive")
+
+
+def _cutoff_id(cursor, max_age_days, max_rows):
+    """Highest audit id that has to leave the hot table, or None."""
+    cutoff = None
+    if max_age_days is not None:
+        oldest_kept = (datetime.now(timezone.utc) - timedelta(days=max_age_days)).strftime("%Y-%m-%d %H:%M:%S")
+        cursor.execute("SELECT MAX(id) FROM audit WHERE timestamp < ?", (oldest_kept,))
+        cutoff = cursor.fetchone()[0]
+    if max_rows is not None:
+        cursor.execute("SELECT id FROM audit ORDER BY id DESC LIMIT 1 OFFSET ?", (max_rows,))
+        row = cursor.fetchone()
+        if row and (cutoff is None or row[0] > cutoff):
+            cutoff = row[0]
+    return cutoff
+
+
+def _write_segment(rows):
+    """Write rows to a new segment file and return its path. The file is synced before returning."""
+    directory = archive_dir()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"audit_{rows[0][0]:012d}_{rows[-1][0]:012d}.jsonl.gz")
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+            for row in rows:
+                f.write((json.dumps(dict(zip(AUDIT_COLUMNS, row))) + "\n").encode("utf-8"))
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp, path)
+    return path
+
+
+def rotate_audit(max_age_days=HOT_MAX_AGE_DAYS, max_rows=HOT_MAX_ROWS, segment_rows=SEGMENT_ROWS):
+    """
+    Move audit rows older than max_age_days, and everything beyond the newest max_rows,
+    into archive segments. Each segment is written to disk first and then removed from
+    the hot table in one transaction. Returns the number of archived rows.
+    """
+    flush()
+    conn = db.get_db()
+    cursor = conn.cursor()
+    archived = 0
+    try:
+        cutoff = _cutoff_id(cursor, max_age_days, max_rows)
+        if cutoff is None:
+            return 0
+        while True:
+            cursor.execute(f"SELECT {', '.join(AUDIT_COLUMNS)} FROM audit WHERE id <= ? ORDER BY id LIMIT ?",
+                           (cutoff, segment_rows))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            path = _write_segment(rows)
+            first, last = rows[0], rows[-1]
+            cursor.execute("""
+                INSERT INTO audit_segments (path, first_id, last_id, first_ts, last_ts, rows)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (os.path.basename(path), first[0], last[0],
+                  min(r[1] for r in rows), max(r[1] for r in rows), len(rows)))
+            cursor.execute("DELETE FROM audit WHERE id BETWEEN ? AND ?", (first[0], last[0]))
+            conn.commit()
+            archived += len(rows)
+    finally:
+        conn.close()
+    return archived
+
+
+def _matches(record, since=None, until=None, **equal):
+    # same semantics as audit.query_audit filters
+    if since is not None and (record["timestamp"] or "") < since:
+        return False
+    if until is not None and (record["timestamp"] or "") >= until:
+        return False
+    return all(value is None or record.get(column) == value for column, value in equal.items())
+
+
+def _segments(since=None, until=None):
+    conn = db.get_db()
+    try:
+        sql = "SELECT path FROM audit_segments WHERE 1 = 1"
+        params = []
+        # skip segments whose time range can't match
+        if since is not None:
+            sql += " AND last_ts >= ?"
+            params.append(since)
+        if until is not None:
+            sql += " AND first_ts < ?"
+            params.append(until)
+        return [row[0] for row in conn.execute(sql + " ORDER BY first_id", params)]
+    finally:
+        conn.close()
+
+
+def iter_segment(name):
+    with gzip.open(os.path.join(archive_dir(), name), "rt", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def search_audit(page_size=1000, **filters):
+    """
+    Yield matching audit rows (tuples in AUDIT_COLUMNS order), oldest first,
+    from the archive segments and then from the hot table.
+    """
+    for name in _segments(filters.get("since"), filters.get("until")):
+        for record in iter_segment(name):
+            if _matches(record, **filters):
+                yield tuple(record.get(c) for c in AUDIT_COLUMNS)
+    yield from iter_audit(page_size=page_size, **filters)
+
+
+if __name__ == "__main__":
+    db.init_db()
+    days = float(sys.argv[1]) if len(sys.argv) > 1 else HOT_MAX_AGE_DAYS
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else HOT_MAX_ROWS
+    print(f"Archived {rotate_audit(days, rows)} audit records to {archive_dir()}.")
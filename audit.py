@@ -1,6 +1,121 @@
-from db import get_db
+import atexit
+import csv
+import json
+import os
+import queue
+import re
+import sys
+import threading
+import time
 
-def log_event(actor, action, result, target_user_id=None, object_name=None):
+from db import before_commit, get_db, in_group, run_before_commit
+from metrics import instrument, timed
+
+# Structured fields stored next to the free-text action
+OPERATIONS = (
+    "register", "login", "logout", "create_object", "list_objects", "read", "write", "delete_object",
+    "grant", "take", "revoke", "group", "check", "list_users", "delete_user", "make_admin",
+    "show_audit", "export_audit", "rotate_audit", "metrics", "trojan_grant", "trojan_take", "other",
+)
+EVENT_COLUMNS = ("user", "action", "result", "target_user_id", "object_name",
+                 "operation", "right_type", "object_id", "actor_id", "source_user_id")
+AUDIT_COLUMNS = ("id", "timestamp") + EVENT_COLUMNS
+
+AUDIT_INSERT = f"INSERT INTO audit ({', '.join(EVENT_COLUMNS)}) VALUES ({', '.join('?' * len(EVENT_COLUMNS))})"
+AUDIT_INSERT_TS = (f"INSERT INTO audit (timestamp, {', '.join(EVENT_COLUMNS)}) "
+                   f"VALUES ({', '.join('?' * (len(EVENT_COLUMNS) + 1))})")
+
+# Audit sink settings (see configure_audit)
+AUDIT_MODE = os.environ.get("TAKE_GRANT_AUDIT_MODE", "async")  # "async" or "sync"
+BATCH_SIZE = 200          # flush after this many records...
+FLUSH_INTERVAL = 0.5      # ...or after this many seconds
+MAX_QUEUE = 10000         # bound on records waiting in memory
+OVERFLOW = "sync"         # when the queue is full: "block", "drop" or "sync" (write inline)
+
+_queue = None
+_writer = None
+_writer_lock = threading.Lock()
+_stop = threading.Event()
+dropped = 0
+
+
+def configure_audit(mode=None, batch_size=None, flush_interval=None, max_queue=None, overflow=None):
+    """Change the audit sink settings. Pending records are flushed first."""
+    global AUDIT_MODE, BATCH_SIZE, FLUSH_INTERVAL, MAX_QUEUE, OVERFLOW
+    shutdown()
+    if mode is not None:
+        AUDIT_MODE = mode
+    if batch_size is not None:
+        BATCH_SIZE = batch_size
+    if flush_interval is not None:
+        FLUSH_INTERVAL = flush_interval
+    if max_queue is not None:
+        MAX_QUEUE = max_queue
+    if overflow is not None:
+        OVERFLOW = overflow
+
+
+_stamp = (None, None)  # (second, formatted): formatted once per second
+
+
+def _now():
+    # same format as SQLite CURRENT_TIMESTAMP, taken when the event happens, not when it is written
+    global _stamp
+    second = int(time.time())
+    if _stamp[0] != second:
+        _stamp = (second, time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(second)))
+    return _stamp[1]
+
+
+def _write(records):
+    with timed("audit.write"):
+        conn = get_db()
+        try:
+            conn.executemany(AUDIT_INSERT_TS, records)
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def _run_writer(q):
+    while not _stop.is_set() or not q.empty():
+        try:
+            batch = [q.get(timeout=FLUSH_INTERVAL)]
+        except queue.Empty:
+            continue
+        deadline = time.monotonic() + FLUSH_INTERVAL
+        while len(batch) < BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(q.get(timeout=remaining))
+            except queue.Empty:
+                break
+        try:
+            _write(batch)
+        except Exception as e:
+            print(f"Audit writer failed to store {len(batch)} records: {e}", file=sys.stderr)
+        finally:
+            for _ in batch:
+                q.task_done()
+
+
+def _ensure_writer():
+    global _queue, _writer
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _stop.clear()
+            _queue = queue.Queue(MAX_QUEUE)
+            _writer = threading.Thread(target=_run_writer, args=(_queue,), name="audit-writer", daemon=True)
+            _writer.start()
+        return _queue
+
+
+@instrument
+def log_event(actor, action, result, target_user_id=None, object_name=None,
+              operation=None, right_type=None, object_id=None, actor_id=None, source_user_id=None,
+              cursor=None):
     """
     Write an audit record.
     actor: string (username or 'anonymous')
@@ -8,12 +123,233 @@ def log_event(actor, action, result, target_user_id=None, object_name=None):
     result: string ('success', 'fail', 'denied', etc.)
     target_user_id: integer or None
     object_name: string or None
+    operation: one of OPERATIONS or None
+    right_type, object_id, actor_id, source_user_id: structured details, None if not relevant
+    In async mode the record is queued and written in batches by a background thread.
+    In sync mode a given cursor writes it inside the caller's transaction. Inside a
+    transaction_group() it is always written in the group's transaction (the background
+    thread would only wait for the group's lock): the group's records are inserted together
+    just before it commits.
+    """
+    global dropped
+    if operation is not None and operation not in OPERATIONS:
+        raise ValueError(f"Unknown audit operation: {operation}")
+    record = (_now(), actor, action, result, target_user_id, object_name,
+              operation, right_type, object_id, actor_id, source_user_id)
+    if in_group():
+        before_commit(_write, record)
+        return
+    if AUDIT_MODE == "sync":
+        if cursor is not None:
+            cursor.execute(AUDIT_INSERT_TS, record)
+        else:
+            _write([record])
+        return
+
+    q = _ensure_writer()
+    try:
+        q.put(record, block=OVERFLOW == "block")
+    except queue.Full:
+        if OVERFLOW == "drop":
+            dropped += 1
+        else:
+            _write([record])
+
+
+@instrument
+def log_events(cursor, events):
     """
+    Write many audit records with the caller's cursor, inside the caller's transaction.
+    events: iterable of tuples in EVENT_COLUMNS order
+    """
+    cursor.executemany(AUDIT_INSERT, events)
+
+
+def flush():
+    """Block until every queued record has been written, the records of this thread's group included."""
+    run_before_commit(_write)
+    if _queue is not None and _writer is not None and _writer.is_alive():
+        _queue.join()
+
+
+def shutdown():
+    """Flush pending records and stop the writer thread."""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None and writer.is_alive():
+        _stop.set()
+        writer.join()
+
+
+atexit.register(shutdown)
+
+
+# --- Querying and export ---
+
+def _audit_filters(since=None, until=None, **equal):
+    where, params = [], []
+    for column, value in equal.items():
+        if column not in EVENT_COLUMNS:
+            raise ValueError(f"Unknown audit filter: {column}")
+        if value is not None:
+            where.append(f"{column} = ?")
+            params.append(value)
+    # timestamps are 'YYYY-MM-DD HH:MM:SS' strings, so they compare correctly as text
+    if since is not None:
+        where.append("timestamp >= ?")
+        params.append(since)
+    if until is not None:
+        where.append("timestamp < ?")
+        params.append(until)
+    return where, params
+
+
+@instrument
+def query_audit(limit=50, after_id=None, newest_first=True, **filters):
+    """
+    One page of audit rows (tuples in AUDIT_COLUMNS order) and the cursor for the next page.
+    Keyset pagination: pass the returned cursor as after_id; it is None on the last page.
+    filters: since, until and any of EVENT_COLUMNS (user, result, operation, object_id, ...)
+    """
+    where, params = _audit_filters(**filters)
+    if after_id is not None:
+        where.append("id < ?" if newest_first else "id > ?")
+        params.append(after_id)
+    sql = f"SELECT {', '.join(AUDIT_COLUMNS)} FROM audit"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY id {'DESC' if newest_first else 'ASC'} LIMIT ?"
+    params.append(limit)
+
+    conn = get_db()
+    try:
+        rows = conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+    next_cursor = rows[-1][0] if len(rows) == limit else None
+    return rows, next_cursor
+
+
+@instrument
+def iter_audit(page_size=1000, newest_first=False, **filters):
+    """
+    Yield matching audit rows one by one, page by page.
+    Memory use is bounded by page_size and no read transaction is held between pages.
+    """
+    after_id = None
+    while True:
+        rows, after_id = query_audit(page_size, after_id, newest_first, **filters)
+        yield from rows
+        if after_id is None:
+            return
+
+
+@instrument
+def export_audit(fp, fmt="jsonl", **filters):
+    """Stream matching audit rows to an open text file as CSV or JSON Lines. Returns the row count."""
+    if fmt not in ("csv", "jsonl"):
+        raise ValueError(f"Unknown export format: {fmt}")
+    flush()
+    count = 0
+    if fmt == "csv":
+        out = csv.writer(fp)
+        out.writerow(AUDIT_COLUMNS)
+        for row in iter_audit(**filters):
+            out.writerow(row)
+            count += 1
+    else:
+        for row in iter_audit(**filters):
+            fp.write(json.dumps(dict(zip(AUDIT_COLUMNS, row))) + "\n")
+            count += 1
+    return count
+
+
+# --- Backfill of structured columns from historical action strings ---
+
+_ACTION_PATTERNS = [
+    (re.compile(r"^(register|login|logout|list_users)$"), lambda m: {"operation": m.group(1)}),
+    (re.compile(r"^list_objects$"), lambda m: {"operation": "list_objects"}),
+    (re.compile(r"^create object "), lambda m: {"operation": "create_object"}),
+    (re.compile(r"^create_obj_attempt$"), lambda m: {"operation": "create_object"}),
+    (re.compile(r"^(read|write) object (\d+)$"),
+     lambda m: {"operation": m.group(1), "object_id": int(m.group(2))}),
+    (re.compile(r"^delete object (\d+)$"), lambda m: {"operation": "delete_object", "object_id": int(m.group(1))}),
+    (re.compile(r"^grant (\S+) obj (\d+) to user (\d+)$"),
+     lambda m: {"operation": "grant", "right_type": m.group(1), "object_id": int(m.group(2))}),
+    (re.compile(r"^take (\S+) obj (\d+) from user (\d+)$"),
+     lambda m: {"operation": "take", "right_type": m.group(1), "object_id": int(m.group(2)),
+                "source_user_id": int(m.group(3))}),
+    (re.compile(r"^(grant|take|revoke|check)_(attempt|invalid_ids?)$"), lambda m: {"operation": m.group(1)}),
+    (re.compile(r"^check (\S+) on object (\d+)$"),
+     lambda m: {"operation": "check", "right_type": m.group(1), "object_id": int(m.group(2))}),
+    (re.compile(r"^(delete_user|make_admin)( \d+)?$"), lambda m: {"operation": m.group(1)}),
+    (re.compile(r"^(show_audit|export_audit|rotate_audit)\b"), lambda m: {"operation": m.group(1)}),
+    (re.compile(r"^trojan_grant (?:granted|attempted grant) (\S+) obj (\d+) to user (\d+)$"),
+     lambda m: {"operation": "trojan_grant", "right_type": m.group(1), "object_id": int(m.group(2))}),
+    (re.compile(r"^trojan_take allowed user (\d+) to take (\S+) from (\d+) on obj (\d+)$"),
+     lambda m: {"operation": "trojan_take", "right_type": m.group(2), "object_id": int(m.group(4)),
+                "source_user_id": int(m.group(3))}),
+    (re.compile(r"^trojan_take attempted take (\S+) by user (\d+)$"),
+     lambda m: {"operation": "trojan_take", "right_type": m.group(1)}),
+]
+
+
+def parse_action(action):
+    """Structured fields recovered from an action string, {'operation': 'other'} if unknown."""
+    for pattern, fields in _ACTION_PATTERNS:
+        m = pattern.match(action or "")
+        if m:
+            return fields(m)
+    return {"operation": "other"}
+
+
+@instrument
+def backfill_structured_audit(batch_size=5000, cursor=None):
+    """
+    Fill operation/right_type/object_id/source_user_id/actor_id of audit rows written before
+    those columns existed. Works in id order, one transaction per batch, and can be re-run.
+    With a cursor (schema migrations) it runs inside the caller's transaction instead.
+    Returns the number of updated rows.
+    """
+    if cursor is not None:
+        return _backfill_structured(cursor, batch_size, lambda: None)
+    flush()
     conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO audit (user, action, result, target_user_id, object_name) VALUES (?, ?, ?, ?, ?)",
-        (actor, action, result, target_user_id, object_name)
-    )
-    conn.commit()
-    conn.close()
+    try:
+        return _backfill_structured(conn.cursor(), batch_size, conn.commit)
+    finally:
+        conn.close()
+
+
+def _backfill_structured(cursor, batch_size, commit):
+    updated = 0
+    last_id = 0
+    while True:
+        rows = cursor.execute(
+            "SELECT id, action FROM audit WHERE id > ? AND operation IS NULL ORDER BY id LIMIT ?",
+            (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        params = []
+        for audit_id, action in rows:
+            fields = parse_action(action)
+            params.append((fields["operation"], fields.get("right_type"), fields.get("object_id"),
+                           fields.get("source_user_id"), audit_id))
+        cursor.executemany("""
+            UPDATE audit SET operation = ?, right_type = ?, object_id = ?, source_user_id = ?,
+                actor_id = COALESCE(actor_id, (SELECT u.id FROM users u WHERE u.username = audit.user))
+            WHERE id = ?
+        """, params)
+        commit()
+        updated += len(rows)
+    return updated
+
+
+if __name__ == "__main__":
+    # python audit.py backfill
+    from db import init_db
+    init_db()
+    if sys.argv[1:] == ["backfill"]:
+        print(f"Backfilled {backfill_structured_audit()} audit records.")
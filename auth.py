@@ -1,7 +1,98 @@
-﻿import bcrypt
+﻿import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
 from db import get_db
+from metrics import instrument, timed
+from revoke import delete_user_cascade
+
+# Password hashing settings. bcrypt releases the GIL, so hashing runs on a thread pool
+# and several logins can use several cores at once.
+BCRYPT_ROUNDS = int(os.environ.get("TAKE_GRANT_BCRYPT_ROUNDS", "12"))
+HASH_WORKERS = os.cpu_count() or 2
+MAX_PENDING_HASHES = HASH_WORKERS * 4  # callers above this limit wait for a free slot
+CREDENTIAL_TTL = 60    # seconds a verified username/password pair skips bcrypt
+SESSION_TTL = 1800     # seconds a session token stays valid
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(MAX_PENDING_HASHES)
+
+# hmac(key, username + password) -> (user_id, stored hash, expires_at, ok, upgraded hash or None)
+# for successful checks only, so every wrong password costs a full bcrypt check;
+# the key never leaves the process
+_credential_key = secrets.token_bytes(32)
+_verified = {}
+_prehashed = {}  # hmac(key, username + password) -> hash for the register_user() that follows
+_sessions = {}  # token -> (user_id, username, is_admin, expires_at)
+_cache_lock = threading.Lock()
+
+
+def _run_hashing(fn, *args):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+    with _slots, timed("auth.bcrypt"):
+        return _executor.submit(fn, *args).result()
+
+
+@instrument
+def hash_password(password, rounds=None):
+    salt = bcrypt.gensalt(rounds or BCRYPT_ROUNDS)
+    return _run_hashing(bcrypt.hashpw, password.encode("utf-8"), salt)
+
+
+@instrument
+def verify_password(password, hashed):
+    return _run_hashing(bcrypt.checkpw, password.encode("utf-8"), hashed)
+
+
+def _cost(hashed):
+    # $2b$12$... -> 12
+    try:
+        return int(hashed[4:6])
+    except (TypeError, ValueError):
+        return None
+
+
+def _credential_key_for(username, password):
+    return hmac.new(_credential_key, f"{username}\0{password}".encode("utf-8"), hashlib.sha256).digest()
+
+
+def _forget_user(user_id):
+    with _cache_lock:
+        for key in [k for k, v in _verified.items() if v[0] == user_id]:
+            del _verified[key]
+        for token in [t for t, v in _sessions.items() if v[0] == user_id]:
+            del _sessions[token]
 
+@instrument
+def prehash_password(username, password):
+    """
+    Hash the password of a register_user() call that follows, so the bcrypt work is done
+    before the caller takes the database lock (the server's writer group).
+    """
+    conn = get_db()
+    exists = conn.execute("SELECT 1 FROM users WHERE username = ?", (username,)).fetchone()
+    conn.close()
+    if exists:
+        return
+    hashed = hash_password(password)
+    with _cache_lock:
+        if len(_prehashed) > 10000:
+            _prehashed.clear()
+        _prehashed[_credential_key_for(username, password)] = hashed
+
+@instrument
 def register_user(username, password):
+    with _cache_lock:
+        hashed = _prehashed.pop(_credential_key_for(username, password), None)
     conn = get_db()
     cursor = conn.cursor()
 
@@ -11,7 +102,8 @@ def register_user(username, password):
         conn.close()
         return False
 
-    hashed = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
+    if hashed is None:
+        hashed = hash_password(password)
 
     # Якщо це перший користувач у системі — робимо його адміном
     cursor.execute("SELECT COUNT(*) FROM users")
@@ -25,6 +117,7 @@ def register_user(username, password):
     print(f"User '{username}' registered successfully. Admin={bool(is_admin)}")
     return True
 
+@instrument
 def login_user(username, password):
     conn = get_db()
     cursor = conn.cursor()
@@ -33,9 +126,101 @@ def login_user(username, password):
     row = cursor.fetchone()
     conn.close()
 
-    if row and bcrypt.checkpw(password.encode("utf-8"), row[1]):
+    if row and _check_credentials(username, password, row[0], row[1]):
         print(f"Login successful! User ID: {row[0]} (admin={bool(row[2])})")
         return row[0], username, bool(row[2])
     else:
         print("Invalid credentials!")
         return None
+
+@instrument
+def verify_login(username, password):
+    """
+    Do the bcrypt work of a login_user() call that follows, e.g. before the caller takes
+    the database lock: login_user() with the same credentials then only reads the cache.
+    """
+    conn = get_db()
+    row = conn.execute("SELECT id, password FROM users WHERE username = ?", (username,)).fetchone()
+    conn.close()
+    if row:
+        _verify(username, password, row[0], row[1])
+
+def _verify(username, password, user_id, hashed):
+    """Cached bcrypt check, returns (cache key, cache entry). Writes nothing."""
+    key = _credential_key_for(username, password)
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _verified.get(key)
+    # Same credentials checked a moment ago against the same stored hash: skip bcrypt
+    if cached and cached[0] == user_id and cached[1] == hashed and cached[2] > now:
+        return key, cached
+
+    ok = verify_password(password, hashed)
+    # cost factor changed since the password was stored, upgrade it transparently
+    upgraded = hash_password(password) if ok and _cost(hashed) != BCRYPT_ROUNDS else None
+    entry = (user_id, hashed, now + CREDENTIAL_TTL, ok, upgraded)
+    if not ok:
+        return key, entry
+    with _cache_lock:
+        if len(_verified) > 10000:
+            for k in [k for k, v in _verified.items() if v[2] <= now]:
+                del _verified[k]
+            if len(_verified) > 10000:
+                _verified.clear()
+        _verified[key] = entry
+    return key, entry
+
+def _check_credentials(username, password, user_id, hashed):
+    key, (_, _, expires, ok, upgraded) = _verify(username, password, user_id, hashed)
+    if not ok:
+        return False
+    if upgraded is not None:
+        conn = get_db()
+        conn.execute("UPDATE users SET password = ? WHERE id = ?", (upgraded, user_id))
+        conn.commit()
+        conn.close()
+        with _cache_lock:
+            _verified[key] = (user_id, upgraded, expires, True, None)
+    return True
+
+@instrument
+def create_session(user_id, username, is_admin):
+    """Return a token that get_session() accepts for SESSION_TTL seconds."""
+    token = secrets.token_urlsafe(32)
+    with _cache_lock:
+        _sessions[token] = (user_id, username, is_admin, time.monotonic() + SESSION_TTL)
+    return token
+
+@instrument
+def get_session(token):
+    """(user_id, username, is_admin) for a live session token, or None."""
+    with _cache_lock:
+        session = _sessions.get(token)
+        if session is None:
+            return None
+        if session[3] <= time.monotonic():
+            del _sessions[token]
+            return None
+    return session[:3]
+
+@instrument
+def end_session(token):
+    with _cache_lock:
+        _sessions.pop(token, None)
+
+@instrument
+def delete_user(user_id, owned="delete", transitive=False):
+    """
+    Delete a user, the objects it owns (owned="delete") or just their ownership (owned="keep"),
+    its rights and, with transitive=True, the rights derived from them. See revoke.py.
+    """
+    report = delete_user_cascade(user_id, owned, transitive)
+    _forget_user(user_id)
+    if not report["deleted"]:
+        print(f"User {user_id} not found.")
+        return report
+    print(f"User {user_id} deleted: {len(report['objects'])} owned objects "
+          f"{'deleted' if owned == 'delete' else 'kept without owner'}, "
+          f"{len(report['own_rights'])} rights, {len(report['derived_rights'])} derived rights and "
+          f"{len(report['derived_group_rights'])} group rights revoked.")
+    return report
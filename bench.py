@@ -0,0 +1,264 @@
+# bench.py
+"""
+Benchmark of the rights operations on a synthetic population.
+
+  python bench.py --users 2000 --objects 2000 --density 0.01 --chain-depth 5 --out bench.json
+
+Runs against a separate database file (--db, recreated on every run) and writes one JSON
+document with throughput, p50/p99 latency per operation and the database size, so results
+of two commits can be compared. It also times password checks one after another and from
+concurrent callers, to show how much auth.py's hashing pool gains on this machine.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+import auth
+import contentstore
+import db
+import graph
+import metrics
+import rightstore
+from cache import decision_cache
+from objects import create_object, delete_object
+from rights import check_access, grant_right, take_right
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    k = min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+def measure(name, calls):
+    """Run each zero-argument callable once and summarise the latencies."""
+    latencies = []
+    quiet = io.StringIO()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(quiet):
+        for call in calls:
+            t0 = time.perf_counter()
+            call()
+            latencies.append(time.perf_counter() - t0)
+            if quiet.tell() > 1 << 20:
+                quiet.seek(0)
+                quiet.truncate()
+    total = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "operation": name,
+        "calls": len(latencies),
+        "throughput_ops": len(latencies) / total if total else None,
+        "p50_ms": percentile(latencies, 50) * 1000 if latencies else None,
+        "p99_ms": percentile(latencies, 99) * 1000 if latencies else None,
+        "max_ms": latencies[-1] * 1000 if latencies else None,
+    }
+
+
+def bcrypt_speedup(calls, rounds):
+    """Password checks one after another vs. from calls concurrent callers through auth's pool."""
+    hashed = bcrypt.hashpw(b"bench", bcrypt.gensalt(rounds))
+    started = time.perf_counter()
+    for _ in range(calls):
+        bcrypt.checkpw(b"bench", hashed)
+    serial = time.perf_counter() - started
+    with ThreadPoolExecutor(max_workers=calls) as callers:
+        started = time.perf_counter()
+        list(callers.map(lambda _: auth.verify_password("bench", hashed), range(calls)))
+        parallel = time.perf_counter() - started
+    return {
+        "rounds": rounds,
+        "calls": calls,
+        "workers": auth.HASH_WORKERS,
+        "serial_s": serial,
+        "parallel_s": parallel,
+        "speedup": serial / parallel if parallel else None,
+    }
+
+
+def populate(args, rng):
+    """Create users, objects, random rights and take chains directly, in one transaction."""
+    password = bcrypt.hashpw(b"bench", bcrypt.gensalt(4))
+    conn = db.get_db()
+    cursor = conn.cursor()
+    cursor.executemany("INSERT INTO users (username, password, is_admin) VALUES (?, ?, 0)",
+                       ((f"user{i}", password) for i in range(args.users)))
+    cursor.execute("SELECT id FROM users ORDER BY id")
+    users = [row[0] for row in cursor.fetchall()]
+
+    owners = [rng.choice(users) for _ in range(args.objects)]
+    cursor.executemany("INSERT INTO objects (name, owner_id) VALUES (?, ?)",
+                       ((f"obj{i}", owners[i]) for i in range(args.objects)))
+    cursor.execute("SELECT id FROM objects ORDER BY id")
+    objects = [row[0] for row in cursor.fetchall()]
+    for obj in objects:
+        contentstore.write_content(cursor, obj, "x" * args.content_size)
+
+    new_rights = []
+    for obj, owner in zip(objects, owners):
+        new_rights.extend((owner, obj, r) for r in ("read", "write", "take"))
+    extra = int(args.users * args.objects * args.density)
+    for _ in range(extra):
+        new_rights.append((rng.choice(users), rng.choice(objects), rng.choice(("read", "write", "take"))))
+
+    # take chains: chain[0] owns the object, everyone after it holds only 'take'
+    chains = []
+    for obj, owner in zip(objects[:args.chains], owners):
+        chain = [owner] + rng.sample(users, min(args.chain_depth, len(users)))
+        new_rights.extend((u, obj, "take") for u in chain[1:])
+        chains.append((obj, chain))
+
+    rightstore.add_rights(cursor, new_rights)
+    conn.commit()
+    conn.close()
+    return users, objects, chains
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(args.db + suffix):
+            os.remove(args.db + suffix)
+    db.configure_pool(db_name=args.db)
+    rightstore.reset_cache()
+    graph.reset_graph()
+    decision_cache.clear()
+    db.init_db()
+    if args.storage != rightstore.ROWS:
+        rightstore.set_storage_mode(args.storage)
+
+    t0 = time.perf_counter()
+    users, objects, chains = populate(args, rng)
+    populate_s = time.perf_counter() - t0
+
+    if args.graph:
+        graph.load_graph()
+
+    n = args.samples
+    rights = ("read", "write", "take")
+    results = []
+
+    results.append(measure("check_access", [
+        (lambda u=rng.choice(users), o=rng.choice(objects), r=rng.choice(rights): check_access(u, o, r))
+        for _ in range(n)
+    ]))
+
+    # grants from the owner so most of them succeed
+    grant_calls = []
+    for _ in range(n):
+        i = rng.randrange(len(objects))
+        conn = db.get_db()
+        owner = conn.execute("SELECT owner_id FROM objects WHERE id = ?", (objects[i],)).fetchone()[0]
+        conn.close()
+        grant_calls.append(lambda f=owner, t=rng.choice(users), o=objects[i], r=rng.choice(rights): grant_right(f, t, o, r))
+    results.append(measure("grant_right", grant_calls))
+
+    # walk every take chain: each user takes 'read' from the previous one
+    take_calls = []
+    for obj, chain in chains:
+        for prev, user in zip(chain, chain[1:]):
+            take_calls.append(lambda t=user, s=prev, o=obj: take_right(t, s, o, "read"))
+    results.append(measure("take_right", take_calls))
+
+    results.append(measure("create_object", [
+        (lambda i=i: create_object(f"bench_new{i}", "x" * args.content_size, rng.choice(users)))
+        for i in range(n)
+    ]))
+
+    conn = db.get_db()
+    created = [row[0] for row in conn.execute("SELECT id FROM objects WHERE name LIKE 'bench_new%'")]
+    conn.close()
+    results.append(measure("delete_object", [(lambda o=o: delete_object(o)) for o in created]))
+
+    bcrypt_report = bcrypt_speedup(args.bcrypt_calls, args.bcrypt_rounds) if args.bcrypt_calls else None
+
+    db_bytes = sum(os.path.getsize(args.db + s) for s in ("", "-wal") if os.path.exists(args.db + s))
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "params": vars(args),
+        "populate_seconds": populate_s,
+        "db_bytes": db_bytes,
+        "decision_cache": decision_cache.stats(),
+        "bcrypt": bcrypt_report,
+        "results": results,
+    }
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Take-Grant rights operations")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--objects", type=int, default=1000)
+    parser.add_argument("--density", type=float, default=0.005,
+                        help="extra random rights, as a fraction of users*objects")
+    parser.add_argument("--chains", type=int, default=100, help="number of objects with a take chain")
+    parser.add_argument("--chain-depth", type=int, default=5)
+    parser.add_argument("--samples", type=int, default=1000, help="calls per operation")
+    parser.add_argument("--content-size", type=int, default=64)
+    parser.add_argument("--storage", choices=[rightstore.ROWS, rightstore.BITMASK], default=rightstore.ROWS)
+    parser.add_argument("--graph", action="store_true", help="answer check_access from the in-memory graph")
+    parser.add_argument("--metrics", action="store_true", help="instrument the run and add the metrics snapshot")
+    parser.add_argument("--bcrypt-calls", type=int, default=16,
+                        help="password checks for the bcrypt speedup measurement, 0 skips it")
+    parser.add_argument("--bcrypt-rounds", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--db", default="bench.db")
+    parser.add_argument("--out", help="write JSON here instead of stdout")
+    parser.add_argument("--compare", help="previous JSON report to compare against")
+    args = parser.parse_args(argv)
+
+    if args.metrics:
+        metrics.enable()
+    report = run(args)
+    if args.metrics:
+        report["metrics"] = metrics.snapshot()
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = {r["operation"]: r for r in json.load(f)["results"]}
+    for r in report["results"]:
+        if not r["calls"]:
+            continue
+        line = (f"{r['operation']:>14}: {r['throughput_ops']:10.0f} ops/s  p50 {r['p50_ms']:.3f} ms  "
+                f"p99 {r['p99_ms']:.3f} ms")
+        old = baseline.get(r["operation"])
+        if old and old.get("p99_ms"):
+            line += f"  (p99 x{r['p99_ms'] / old['p99_ms']:.2f}, throughput x{r['throughput_ops'] / old['throughput_ops']:.2f})"
+        print(line, file=sys.stderr)
+    b = report["bcrypt"]
+    if b:
+        print(f"{'bcrypt':>14}: {b['calls']} checks at cost {b['rounds']} serial {b['serial_s']:.2f} s, "
+              f"{b['workers']} workers {b['parallel_s']:.2f} s (x{b['speedup']:.2f})", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
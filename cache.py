@@ -0,0 +1,92 @@
+# cache.py
+import threading
+import time
+from collections import OrderedDict
+
+# Decision cache settings
+CACHE_SIZE = 10000
+CACHE_TTL = 5.0  # seconds; bounds staleness when another process changes the rights
+
+
+class DecisionCache:
+    """
+    LRU + TTL cache of access decisions keyed by (user_id, object_id, right_type).
+    Stores both allowed (True) and denied (False) answers. Keys are also indexed by
+    user and by object so a change can invalidate exactly the affected entries.
+    """
+
+    def __init__(self, max_size=CACHE_SIZE, ttl=CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (allowed, expires_at)
+        self._by_user = {}
+        self._by_object = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id, object_id, right_type):
+        """Return True/False for a cached decision or None on a miss."""
+        key = (user_id, object_id, right_type)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, user_id, object_id, right_type, allowed):
+        key = (user_id, object_id, right_type)
+        with self._lock:
+            if key not in self._entries:
+                self._by_user.setdefault(user_id, set()).add(key)
+                self._by_object.setdefault(object_id, set()).add(key)
+            self._entries[key] = (allowed, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        user_id, object_id, _ = key
+        keys = self._by_user.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[user_id]
+        keys = self._by_object.get(object_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_object[object_id]
+
+    def invalidate(self, user_id, object_id, right_type):
+        with self._lock:
+            self._remove((user_id, object_id, right_type))
+
+    def invalidate_object(self, object_id):
+        with self._lock:
+            for key in list(self._by_object.get(object_id, ())):
+                self._remove(key)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for key in list(self._by_user.get(user_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+            self._by_object.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+decision_cache = DecisionCache()
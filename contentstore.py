@@ -0,0 +1,149 @@
+# contentstore.py
+"""
+Object content storage, kept out of the objects table:
+  content_chunks - content-addressed chunks (sha256 of the bytes) with a reference count,
+                   so identical content is stored once however many objects hold it
+  object_chunks  - (object_id, offset) -> chunk, the chunk list of every object
+objects.size and objects.content_hash describe the whole content, metadata queries never
+read a chunk. Chunks are read with incremental blob I/O, so a range read only touches
+the chunks it covers. All functions take the caller's cursor and run inside the
+caller's transaction.
+"""
+import hashlib
+
+CHUNK_SIZE = 64 * 1024
+ENCODING = "utf-8"
+
+
+def _pieces(source):
+    """Split str / bytes / a binary file object into CHUNK_SIZE pieces."""
+    if source is None:
+        return
+    if isinstance(source, str):
+        source = source.encode(ENCODING)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        for i in range(0, len(source), CHUNK_SIZE):
+            yield bytes(source[i:i + CHUNK_SIZE])
+        return
+    while True:
+        piece = source.read(CHUNK_SIZE)
+        if not piece:
+            break
+        yield piece
+
+
+def _store_chunk(cursor, data):
+    digest = hashlib.sha256(data).hexdigest()
+    cursor.execute("""
+        INSERT INTO content_chunks (hash, size, refs, data) VALUES (?, ?, 1, ?)
+        ON CONFLICT (hash) DO UPDATE SET refs = refs + 1
+    """, (digest, len(data), data))
+    cursor.execute("SELECT id FROM content_chunks WHERE hash = ?", (digest,))
+    return cursor.fetchone()[0]
+
+
+def _release_chunks(cursor, chunk_ids):
+    cursor.executemany("UPDATE content_chunks SET refs = refs - 1 WHERE id = ?", ((i,) for i in chunk_ids))
+    cursor.executemany("DELETE FROM content_chunks WHERE id = ? AND refs <= 0", ((i,) for i in chunk_ids))
+
+
+def write_content(cursor, object_id, source, new=False):
+    """
+    Replace the content of an object with source (str, bytes or a binary file object,
+    which is read CHUNK_SIZE bytes at a time). Returns the new size in bytes.
+    new=True: the object was just created and has no content to release.
+    """
+    old_chunks = []
+    if not new:
+        cursor.execute("SELECT chunk_id FROM object_chunks WHERE object_id = ?", (object_id,))
+        old_chunks = [row[0] for row in cursor.fetchall()]
+        cursor.execute("DELETE FROM object_chunks WHERE object_id = ?", (object_id,))
+
+    # new chunks are referenced before the old ones are released, unchanged chunks stay in place
+    whole = hashlib.sha256()
+    size = 0
+    for piece in _pieces(source):
+        cursor.execute("INSERT INTO object_chunks (object_id, offset, chunk_id) VALUES (?, ?, ?)",
+                       (object_id, size, _store_chunk(cursor, piece)))
+        whole.update(piece)
+        size += len(piece)
+    if old_chunks:
+        _release_chunks(cursor, old_chunks)
+
+    cursor.execute("UPDATE objects SET size = ?, content_hash = ?, content = NULL WHERE id = ?",
+                   (size, whole.hexdigest(), object_id))
+    return size
+
+
+def delete_content(cursor, object_id):
+    cursor.execute("SELECT chunk_id FROM object_chunks WHERE object_id = ?", (object_id,))
+    chunks = [row[0] for row in cursor.fetchall()]
+    cursor.execute("DELETE FROM object_chunks WHERE object_id = ?", (object_id,))
+    _release_chunks(cursor, chunks)
+
+
+def delete_owned_content(cursor, owner_id):
+    """Release the content of every object owned by owner_id."""
+    owned = "SELECT id FROM objects WHERE owner_id = ?"
+    cursor.execute(f"SELECT chunk_id, COUNT(*) FROM object_chunks WHERE object_id IN ({owned}) GROUP BY chunk_id",
+                   (owner_id,))
+    counts = cursor.fetchall()
+    cursor.executemany("UPDATE content_chunks SET refs = refs - ? WHERE id = ?", [(n, c) for c, n in counts])
+    cursor.executemany("DELETE FROM content_chunks WHERE id = ? AND refs <= 0", [(c,) for c, _ in counts])
+    cursor.execute(f"DELETE FROM object_chunks WHERE object_id IN ({owned})", (owner_id,))
+
+
+def _read_chunk(cursor, chunk_id, start, length):
+    conn = cursor.connection
+    if hasattr(conn, "blobopen"):
+        with conn.blobopen("content_chunks", "data", chunk_id, readonly=True) as blob:
+            blob.seek(start)
+            return blob.read(length)
+    # Python < 3.11
+    cursor.execute("SELECT substr(data, ?, ?) FROM content_chunks WHERE id = ?", (start + 1, length, chunk_id))
+    return cursor.fetchone()[0]
+
+
+def iter_content(cursor, object_id, offset=0, length=None):
+    """Yield the bytes of the range [offset, offset + length) chunk by chunk (to the end if length is None)."""
+    if length is not None and length <= 0:
+        return
+    end = None if length is None else offset + length
+    # the chunk containing offset and every chunk that starts before the end of the range
+    sql = """
+        SELECT oc.offset, oc.chunk_id, c.size
+        FROM object_chunks oc JOIN content_chunks c ON c.id = oc.chunk_id
+        WHERE oc.object_id = ?
+          AND oc.offset >= COALESCE((SELECT MAX(offset) FROM object_chunks
+                                     WHERE object_id = ? AND offset <= ?), 0)
+    """
+    params = [object_id, object_id, offset]
+    if end is not None:
+        sql += " AND oc.offset < ?"
+        params.append(end)
+    cursor.execute(sql + " ORDER BY oc.offset", params)
+    for chunk_offset, chunk_id, chunk_size in cursor.fetchall():
+        start = max(offset - chunk_offset, 0)
+        stop = chunk_size if end is None else min(end - chunk_offset, chunk_size)
+        if stop > start:
+            yield _read_chunk(cursor, chunk_id, start, stop - start)
+
+
+def read_content(cursor, object_id, offset=0, length=None):
+    return b"".join(iter_content(cursor, object_id, offset, length))
+
+
+def migrate_inline_content(cursor, batch_size=500):
+    """Move content still stored in objects.content into chunks (schema migration 6)."""
+    last_id = 0
+    while True:
+        cursor.execute("SELECT id, content FROM objects WHERE id > ? AND content IS NOT NULL ORDER BY id LIMIT ?",
+                       (last_id, batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        for object_id, content in rows:
+            write_content(cursor, object_id, content)
+        last_id = rows[-1][0]
+    cursor.execute("UPDATE objects SET size = 0, content_hash = ? WHERE size IS NULL",
+                   (hashlib.sha256(b"").hexdigest(),))
@@ -1,10 +1,472 @@
+import atexit
+import contextlib
+import json
+import os
+import queue
 import sqlite3
+import threading
+import time
+
+import metrics
 
 DB_NAME = "take_grant.db"
 
+# Connection pool settings (see configure_pool)
+POOL_SIZE = 5
+DB_TIMEOUT = 5
+HEALTH_CHECK_INTERVAL = 30
+
+# Pragma profiles applied to every new connection.
+# Choose one with TAKE_GRANT_DB_PROFILE, or point TAKE_GRANT_DB_CONFIG to a JSON file:
+#   {"profile": "wal", "pragmas": {"cache_size": -64000}, "checkpoint_interval": 30}
+PRAGMA_PROFILES = {
+    "default": {
+        "busy_timeout": 5000,
+    },
+    # concurrent readers never wait for the writer
+    "wal": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -16000,      # KiB
+        "mmap_size": 268435456,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+    },
+    "wal_durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "busy_timeout": 5000,
+    },
+}
+ALLOWED_PRAGMAS = {"journal_mode", "synchronous", "cache_size", "mmap_size", "temp_store", "busy_timeout",
+                   "foreign_keys", "wal_autocheckpoint"}
+CHECKPOINT_INTERVAL = 60  # seconds between PASSIVE WAL checkpoints, 0 disables
+
+
+def load_db_config():
+    """Return (pragmas, checkpoint_interval) from the environment / config file."""
+    config = {}
+    path = os.environ.get("TAKE_GRANT_DB_CONFIG")
+    if path:
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+
+    profile = os.environ.get("TAKE_GRANT_DB_PROFILE") or config.get("profile", "default")
+    if profile not in PRAGMA_PROFILES:
+        raise ValueError(f"Unknown database profile: {profile}")
+    pragmas = dict(PRAGMA_PROFILES[profile])
+    pragmas.update(config.get("pragmas", {}))
+    for name in pragmas:
+        if name not in ALLOWED_PRAGMAS:
+            raise ValueError(f"Pragma not allowed in config: {name}")
+    return pragmas, config.get("checkpoint_interval", CHECKPOINT_INTERVAL)
+
+
+def apply_pragmas(conn, pragmas):
+    for name, value in pragmas.items():
+        if isinstance(value, str) and not value.isalnum():
+            raise ValueError(f"Invalid value for pragma {name}: {value}")
+        conn.execute(f"PRAGMA {name} = {value}").fetchall()
+
+
+class PooledConnection:
+    """
+    Proxy around a pooled sqlite3 connection.
+    Behaves like sqlite3.Connection, but close() returns the connection to the pool
+    instead of closing it, so existing get_db()/close() callers keep working.
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+        metrics.watch_connection(conn)
+        if metrics.enabled():
+            # timed cursors; without metrics the raw connection methods are used directly
+            timed = metrics.TimedCursor
+            self.cursor = lambda factory=timed: conn.cursor(factory)
+            self.execute = lambda sql, params=(): conn.cursor(timed).execute(sql, params)
+            self.executemany = lambda sql, params: conn.cursor(timed).executemany(sql, params)
+
+    def _live(self):
+        conn = self.__dict__.get("_conn")
+        if conn is None:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+        return conn
+
+    def __getattr__(self, name):
+        return getattr(self._live(), name)
+
+    def commit(self):
+        conn = self._live()
+        conn.commit()
+        _run_after_commit(conn)
+
+    def rollback(self):
+        conn = self._live()
+        conn.rollback()
+        _pending.pop(conn, None)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        conn = self._conn
+        result = conn.__exit__(exc_type, exc, tb)
+        if exc_type is None:
+            _run_after_commit(conn)
+        else:
+            _pending.pop(conn, None)
+        return result
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.release(conn)
+
+    def __del__(self):
+        # A proxy dropped without close() (e.g. "with get_db() as conn") still goes back
+        if self.__dict__.get("_conn") is not None:
+            self.close()
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of long-lived sqlite3 connections.
+    Idle connections are health-checked before reuse; close() shuts the pool down.
+    """
+
+    def __init__(self, db_name, size=POOL_SIZE, timeout=DB_TIMEOUT, pragmas=None, checkpoint_interval=0):
+        self.db_name = db_name
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = pragmas or {}
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._closed = False
+        self._stop = threading.Event()
+        self._checkpointer = None
+        wal = str(self.pragmas.get("journal_mode", "")).upper() == "WAL"
+        if wal and checkpoint_interval:
+            self._checkpointer = threading.Thread(target=self._checkpoint_loop, args=(checkpoint_interval,),
+                                                  name="wal-checkpoint", daemon=True)
+            self._checkpointer.start()
+
+    def _connect(self):
+        # timeout in case the database is locked
+        conn = sqlite3.connect(self.db_name, timeout=self.timeout, check_same_thread=False)
+        apply_pragmas(conn, self.pragmas)
+        return conn
+
+    def _checkpoint_loop(self, interval):
+        # PASSIVE never waits for readers or writers, it copies what it can
+        while not self._stop.wait(interval):
+            try:
+                conn = self.acquire()
+                try:
+                    conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+                finally:
+                    conn.close()
+            except sqlite3.Error:
+                pass
+
+    def _healthy(self, conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._opened -= 1
+
+    def acquire(self):
+        if self._closed:
+            raise sqlite3.ProgrammingError("Connection pool is closed.")
+
+        while True:
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if time.monotonic() - last_used < HEALTH_CHECK_INTERVAL or self._healthy(conn):
+                return PooledConnection(self, conn)
+            self._discard(conn)
+
+        with self._lock:
+            can_open = self._opened < self.size
+            if can_open:
+                self._opened += 1
+        if can_open:
+            try:
+                return PooledConnection(self, self._connect())
+            except sqlite3.Error:
+                with self._lock:
+                    self._opened -= 1
+                raise
+
+        try:
+            conn, _ = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError("Connection pool exhausted.")
+        return PooledConnection(self, conn)
+
+    def release(self, conn):
+        if self._closed:
+            self._discard(conn)
+            return
+        try:
+            # Never hand out a connection with a half-finished transaction
+            _before.pop(conn, None)
+            if conn.in_transaction:
+                conn.rollback()
+                _pending.pop(conn, None)
+            else:
+                # committed without the proxy (raw cursor), the queued work is due now
+                _run_after_commit(conn)
+        except sqlite3.Error:
+            _pending.pop(conn, None)
+            self._discard(conn)
+            return
+        self._idle.put((conn, time.monotonic()))
+
+    def close(self):
+        self._closed = True
+        self._stop.set()
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            pragmas, checkpoint_interval = load_db_config()
+            _pool = ConnectionPool(DB_NAME, POOL_SIZE, DB_TIMEOUT, pragmas, checkpoint_interval)
+        return _pool
+
+
+def enable_wal():
+    """
+    Switch the database file to WAL journaling and return the journal mode now in use.
+    The mode is stored in the file, so it holds for every connection and process.
+    """
+    conn = get_db()
+    try:
+        return conn.execute("PRAGMA journal_mode = WAL").fetchone()[0].lower()
+    finally:
+        conn.close()
+
+
+def configure_pool(db_name=None, size=None, timeout=None):
+    """Change pool settings. The current pool is closed and recreated on next get_db()."""
+    global DB_NAME, POOL_SIZE, DB_TIMEOUT
+    if db_name is not None:
+        DB_NAME = db_name
+    if size is not None:
+        POOL_SIZE = size
+    if timeout is not None:
+        DB_TIMEOUT = timeout
+    close_pool()
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
+
+
+atexit.register(close_pool)
+
+
+class GroupedConnection(PooledConnection):
+    """
+    Connection handed out inside transaction_group(): commit/rollback/close are left
+    to the group, so many get_db() users share one connection and one transaction.
+    """
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_local = threading.local()
+
+# Work waiting for a COMMIT, per raw connection: one list per open savepoint level
+_pending = {}
+# Work to run in a transaction group just before its COMMIT, kept the same way
+_before = {}
+
+
+def in_group(conn=None):
+    """True inside transaction_group() in this thread (and conn, if given, is the group's connection)."""
+    group = getattr(_local, "group", None)
+    if conn is None:
+        return group is not None
+    return group is not None and getattr(conn, "_conn", conn) is group
+
+
+def after_commit(fn, *args, conn=None):
+    """
+    Call fn(*args) once the transaction of conn (default: this thread's transaction group)
+    commits, or right away if it has no open transaction. Dropped if the transaction, or
+    the savepoint it was queued in, is rolled back.
+    """
+    if conn is None:
+        conn = getattr(_local, "group", None)
+    conn = getattr(conn, "_conn", conn)
+    if conn is None or not conn.in_transaction:
+        fn(*args)
+        return
+    _pending.setdefault(conn, [[]])[-1].append((fn, args))
+
+
+def before_commit(fn, item):
+    """
+    Inside a transaction_group(): queue item for fn. Just before the group commits, still in
+    its transaction, fn(items) is called once with every item queued for it, in order.
+    Items are dropped if the group, or the savepoint they were queued in, is rolled back.
+    Outside a group fn([item]) runs right away.
+    """
+    conn = getattr(_local, "group", None)
+    if conn is None:
+        fn([item])
+        return
+    _before.setdefault(conn, [[]])[-1].append((fn, item))
+
+
+def run_before_commit(fn=None):
+    """Run the before_commit() work of this thread's group now: all of it, or only fn's."""
+    conn = getattr(_local, "group", None)
+    levels = _before.get(conn)
+    if not levels:
+        return
+    batches = {}
+    for level in levels:
+        keep = []
+        for queued, item in level:
+            if fn is None or queued is fn:
+                batches.setdefault(queued, []).append(item)
+            else:
+                keep.append((queued, item))
+        level[:] = keep
+    for queued, items in batches.items():
+        queued(items)
+
+
+def _run_after_commit(conn):
+    for level in _pending.pop(conn, None) or ():
+        for fn, args in level:
+            fn(*args)
+
+
+@contextlib.contextmanager
+def savepoint(conn, name="sp"):
+    """
+    SAVEPOINT around the block. If the block raises, it is rolled back to the savepoint
+    together with the before_commit() / after_commit() work queued inside it, and the
+    exception propagates. The before_commit() work queued so far is written first, so
+    writing it early inside the savepoint never loses work queued outside it.
+    """
+    conn = getattr(conn, "_conn", conn)
+    if in_group(conn):
+        run_before_commit()
+    conn.execute(f"SAVEPOINT {name}")
+    queues = (_pending.setdefault(conn, [[]]), _before.setdefault(conn, [[]]))
+    for levels in queues:
+        levels.append([])
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        for levels in queues:
+            work = levels.pop()
+            if ok:
+                levels[-1].extend(work)
+        if not ok:
+            conn.execute(f"ROLLBACK TO {name}")
+        conn.execute(f"RELEASE {name}")
+
+
+@contextlib.contextmanager
+def transaction_group():
+    """
+    Run everything in the block on one connection and in one transaction.
+    get_db() in this thread returns the same connection, commits are deferred until the
+    block exits and the whole group is rolled back if it raises. Work queued with
+    before_commit() runs just before the real COMMIT, after_commit() work after it.
+    """
+    conn = getattr(_local, "group", None)
+    if conn is not None:
+        # nested group joins the outer one
+        yield GroupedConnection(None, conn)
+        return
+
+    pooled = get_pool().acquire()
+    conn = pooled._conn
+    _local.group = conn
+    try:
+        # explicit BEGIN, so savepoints inside the group never commit on RELEASE
+        conn.execute("BEGIN")
+        yield GroupedConnection(None, conn)
+        run_before_commit()
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        _pending.pop(conn, None)
+        _before.pop(conn, None)
+        raise
+    finally:
+        _local.group = None
+        # runs the committed group's after_commit() work, see ConnectionPool.release
+        pooled.close()
+
+
 def get_db():
-    #  timeout   
-    return sqlite3.connect(DB_NAME, timeout=5)
+    conn = getattr(_local, "group", None)
+    if conn is not None:
+        return GroupedConnection(None, conn)
+    with metrics.timed("db.acquire"):
+        return get_pool().acquire()
+
+
+# SQLite limits the number of bound parameters, "IN (...)" lookups go in chunks
+CHUNK_SIZE = 500
+
+
+def chunks(values, size=CHUNK_SIZE):
+    """Lists of at most size items from values, for one "IN (?, ...)" query each."""
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
 
 def init_db():
     with get_db() as conn:
@@ -54,3 +516,284 @@ def init_db():
         """)
 
         conn.commit()
+
+        migrate(conn)
+
+
+def _move_inline_content(cursor):
+    import contentstore
+    contentstore.migrate_inline_content(cursor)
+
+
+def _backfill_structured_audit(cursor):
+    import audit
+    audit.backfill_structured_audit(cursor=cursor)
+
+
+def _backfill_provenance(cursor):
+    import rightstore
+    rightstore.backfill_provenance(cursor)
+
+
+def _repair_provenance(cursor):
+    import rightstore
+    rightstore.repair_provenance(cursor)
+
+
+def _build_effective(cursor):
+    import rightstore
+    rightstore.reset_cache()
+    rightstore.rebuild_effective(cursor, counts=False)
+
+
+def _access_counts(cursor):
+    import rightstore
+    rightstore.rebuild_access_counts(cursor)
+    rightstore.create_access_count_triggers(cursor)
+
+
+# Schema migrations: (version, steps). A step is an SQL string or a function(cursor).
+# Applied in order on top of the base tables, the version is kept in PRAGMA user_version.
+MIGRATIONS = [
+    (1, [
+        # Unique index below fails on existing duplicates, keep the oldest row
+        "DELETE FROM rights WHERE id NOT IN "
+        "(SELECT MIN(id) FROM rights GROUP BY subject_id, object_id, right_type)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_rights_subject_object_right "
+        "ON rights (subject_id, object_id, right_type)",
+        "CREATE INDEX IF NOT EXISTS idx_rights_object ON rights (object_id)",
+        "CREATE INDEX IF NOT EXISTS idx_audit_timestamp ON audit (timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_audit_user ON audit (user)",
+    ]),
+    (2, [
+        # Optional compact rights layout, see rightstore.py
+        """
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS right_types (
+            name TEXT PRIMARY KEY,
+            bit INTEGER UNIQUE NOT NULL
+        )
+        """,
+        "INSERT OR IGNORE INTO right_types (name, bit) VALUES ('read', 1), ('write', 2), ('take', 4)",
+        """
+        CREATE TABLE IF NOT EXISTS rights_mask (
+            subject_id INTEGER NOT NULL,
+            object_id INTEGER NOT NULL,
+            mask INTEGER NOT NULL,
+            PRIMARY KEY (subject_id, object_id)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_rights_mask_object ON rights_mask (object_id)",
+    ]),
+    (3, [
+        # Keyset pagination of filtered audit queries (audit.query_audit)
+        "DROP INDEX IF EXISTS idx_audit_user",
+        "CREATE INDEX IF NOT EXISTS idx_audit_user_id ON audit (user, id)",
+        "CREATE INDEX IF NOT EXISTS idx_audit_target_user ON audit (target_user_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_audit_object_name ON audit (object_name, id)",
+    ]),
+    (4, [
+        # Archived audit segments, see archive.py
+        """
+        CREATE TABLE IF NOT EXISTS audit_segments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            path TEXT UNIQUE,
+            first_id INTEGER,
+            last_id INTEGER,
+            first_ts DATETIME,
+            last_ts DATETIME,
+            rows INTEGER,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    (5, [
+        # Structured audit fields (audit.log_event / audit.backfill_structured_audit)
+        "ALTER TABLE audit ADD COLUMN operation TEXT",
+        "ALTER TABLE audit ADD COLUMN right_type TEXT",
+        "ALTER TABLE audit ADD COLUMN object_id INTEGER",
+        "ALTER TABLE audit ADD COLUMN actor_id INTEGER",
+        "ALTER TABLE audit ADD COLUMN source_user_id INTEGER",
+        "CREATE INDEX IF NOT EXISTS idx_audit_operation_object ON audit (operation, object_id, right_type)",
+        "CREATE INDEX IF NOT EXISTS idx_audit_object_id ON audit (object_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_audit_actor ON audit (actor_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_audit_source_user ON audit (source_user_id, id)",
+    ]),
+    (6, [
+        # Chunked, deduplicated object content, see contentstore.py.
+        # objects.content stays (always NULL) so older SQLite versions need no table rebuild.
+        """
+        CREATE TABLE IF NOT EXISTS content_chunks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            hash TEXT UNIQUE NOT NULL,
+            size INTEGER NOT NULL,
+            refs INTEGER NOT NULL,
+            data BLOB
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS object_chunks (
+            object_id INTEGER NOT NULL,
+            offset INTEGER NOT NULL,
+            chunk_id INTEGER NOT NULL,
+            PRIMARY KEY (object_id, offset)
+        ) WITHOUT ROWID
+        """,
+        "ALTER TABLE objects ADD COLUMN size INTEGER",
+        "ALTER TABLE objects ADD COLUMN content_hash TEXT",
+        _move_inline_content,
+    ]),
+    (7, [
+        # Owned objects of a user, see revoke.py
+        "CREATE INDEX IF NOT EXISTS idx_objects_owner ON objects (owner_id)",
+    ]),
+    (8, [
+        # Where every right came from, see rightstore.py / revoke.py
+        """
+        CREATE TABLE IF NOT EXISTS right_provenance (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            subject_id INTEGER NOT NULL,
+            object_id INTEGER NOT NULL,
+            right_type TEXT NOT NULL,
+            source_id INTEGER,
+            operation TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_provenance_right "
+        "ON right_provenance (subject_id, object_id, right_type, source_id)",
+        # derivation index: rights derived from (source_id, object_id, right_type)
+        "CREATE INDEX IF NOT EXISTS idx_provenance_source ON right_provenance (source_id, object_id, right_type)",
+        "CREATE INDEX IF NOT EXISTS idx_provenance_object ON right_provenance (object_id)",
+        # the provenance backfill reads the structured audit fields
+        _backfill_structured_audit,
+        _backfill_provenance,
+    ]),
+    (9, [
+        # Group subjects and the materialized effective rights, see rightstore.py / groups.py
+        """
+        CREATE TABLE IF NOT EXISTS groups (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS group_members (
+            group_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (group_id, user_id)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_group_members_user ON group_members (user_id)",
+        """
+        CREATE TABLE IF NOT EXISTS group_rights (
+            group_id INTEGER NOT NULL,
+            object_id INTEGER NOT NULL,
+            mask INTEGER NOT NULL,
+            PRIMARY KEY (group_id, object_id)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_group_rights_object ON group_rights (object_id)",
+        """
+        CREATE TABLE IF NOT EXISTS effective_rights (
+            user_id INTEGER NOT NULL,
+            object_id INTEGER NOT NULL,
+            mask INTEGER NOT NULL,
+            PRIMARY KEY (user_id, object_id)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_effective_object ON effective_rights (object_id)",
+        _build_effective,
+    ]),
+    (10, [
+        # Per-user rights and object ACL listings (acl.py): the object index covers the ACL query
+        "DROP INDEX IF EXISTS idx_effective_object",
+        "CREATE INDEX IF NOT EXISTS idx_effective_object_user ON effective_rights (object_id, user_id, mask)",
+        # Access counts maintained by triggers, see rightstore.py
+        """
+        CREATE TABLE IF NOT EXISTS user_access_counts (
+            user_id INTEGER PRIMARY KEY,
+            objects INTEGER NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS object_access_counts (
+            object_id INTEGER PRIMARY KEY,
+            users INTEGER NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_user_access_counts ON user_access_counts (objects)",
+        "CREATE INDEX IF NOT EXISTS idx_object_access_counts ON object_access_counts (users)",
+        _access_counts,
+    ]),
+    (11, [
+        # Incremented with every change of the direct rights, see rightstore.py / graph.py
+        "INSERT OR IGNORE INTO settings (key, value) VALUES ('rights_generation', 0)",
+    ]),
+    (12, [
+        # Databases migrated to 8 before the audit backfill was part of it, see rightstore.py
+        _backfill_structured_audit,
+        _repair_provenance,
+    ]),
+    (13, [
+        # Where every group right came from, see rightstore.py / revoke.py
+        """
+        CREATE TABLE IF NOT EXISTS group_provenance (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            group_id INTEGER NOT NULL,
+            object_id INTEGER NOT NULL,
+            right_type TEXT NOT NULL,
+            source_id INTEGER,
+            operation TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_group_provenance_right "
+        "ON group_provenance (group_id, object_id, right_type, source_id)",
+        "CREATE INDEX IF NOT EXISTS idx_group_provenance_source ON group_provenance (source_id, object_id, right_type)",
+        "CREATE INDEX IF NOT EXISTS idx_group_provenance_object ON group_provenance (object_id)",
+        # who granted the existing group rights is not known
+        "INSERT INTO group_provenance (group_id, object_id, right_type, source_id, operation) "
+        "SELECT g.group_id, g.object_id, t.name, NULL, 'legacy' "
+        "FROM group_rights g JOIN right_types t ON g.mask & t.bit != 0",
+    ]),
+]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """Upgrade the schema of an existing database in place. Returns the new version."""
+    version = schema_version(conn)
+    for target, steps in MIGRATIONS:
+        if target <= version:
+            continue
+        cursor = conn.cursor()
+        cursor.execute("BEGIN")
+        try:
+            for step in steps:
+                if callable(step):
+                    step(cursor)
+                else:
+                    cursor.execute(step)
+            cursor.execute(f"PRAGMA user_version = {int(target)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        version = target
+    return version
+
+
+if __name__ == "__main__":
+    init_db()
+    conn = get_db()
+    print(f"Database '{DB_NAME}' is at schema version {schema_version(conn)}.")
+    conn.close()
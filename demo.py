@@ -4,12 +4,15 @@ import sqlite3
 from time import sleep
 
 # import project modules
-from db import init_db, get_db
+from db import init_db, get_db, close_pool
 from auth import register_user, login_user
 from objects import create_object, list_objects, read_object, write_object, delete_object
 from rights import grant_right, take_right, check_access
-from audit import log_event
+from audit import log_event, query_audit, AUDIT_COLUMNS, flush as flush_audit
 from trojan import trojan_grant
+from graph import reset_graph
+from rightstore import reset_cache as reset_rightstore
+from contentstore import read_content
 
 try:
     from tabulate import tabulate
@@ -19,6 +22,10 @@ except Exception:
 DB_FILE = "take_grant.db"
 
 def reset_db():
+    # pooled connections keep the old file open
+    close_pool()
+    reset_graph()
+    reset_rightstore()
     if os.path.exists(DB_FILE):
         os.remove(DB_FILE)
     init_db()
@@ -134,8 +141,12 @@ def run_demo():
     print_table(rows, ["id", "username", "is_admin"])
 
     print("\nFinal objects table:")
-    rows = fetch_table("SELECT id, name, owner_id, content FROM objects")
-    print_table(rows, ["id", "name", "owner_id", "content"])
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("SELECT id, name, owner_id, size FROM objects")
+    rows = [row + (read_content(cur, row[0]).decode("utf-8"),) for row in cur.fetchall()]
+    conn.close()
+    print_table(rows, ["id", "name", "owner_id", "size", "content"])
 
     print("\nFinal rights table:")
     rows = fetch_table("""
@@ -148,8 +159,9 @@ def run_demo():
     print_table(rows, ["id", "subject", "object", "right_type"])
 
     print("\nAudit log (last 50):")
-    rows = fetch_table("SELECT id, timestamp, user, action, result, target_user_id, object_name FROM audit ORDER BY id DESC LIMIT 50")
-    print_table(rows, ["id", "timestamp", "user", "action", "result", "target_user_id", "object_name"])
+    flush_audit()
+    rows, _ = query_audit(50)
+    print_table(rows, list(AUDIT_COLUMNS))
 
 if __name__ == "__main__":
     run_demo()
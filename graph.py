@@ -0,0 +1,305 @@
+# graph.py
+import threading
+import time
+
+from cache import CACHE_TTL, decision_cache
+from db import after_commit, get_db
+import rightstore
+
+# Seconds between checks of the rights generation: another process's change is seen
+# after at most this long, like a cached decision
+GENERATION_CHECK_INTERVAL = CACHE_TTL
+
+# Bit assigned to every right type. Unknown right types get the next free bit.
+RIGHT_BITS = {"read": 1, "write": 2, "take": 4}
+_bits_lock = threading.Lock()
+
+
+def right_bit(right_type):
+    bit = RIGHT_BITS.get(right_type)
+    if bit is None:
+        with _bits_lock:
+            bit = RIGHT_BITS.get(right_type)
+            if bit is None:
+                bit = 1 << len(RIGHT_BITS)
+                RIGHT_BITS[right_type] = bit
+    return bit
+
+
+def mask_to_rights(mask):
+    return [r for r, bit in RIGHT_BITS.items() if mask & bit]
+
+
+class ProtectionGraph:
+    """
+    In-memory Take-Grant graph built from the rights table.
+    Subjects (user ids) and objects (object ids) are interned to dense integer indexes,
+    every subject -> object edge stores a bitset of rights (see RIGHT_BITS).
+    Edges are kept in both directions: rights of a subject and holders of an object.
+    The rights generation it was loaded at lets refresh() notice changes made elsewhere.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.generation = None
+        self.local_writes = 0
+        self.checked_at = 0.0
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.subject_index = {}   # user id -> index
+            self.object_index = {}    # object id -> index
+            self.subjects = []        # index -> user id (None once removed)
+            self.objects = []         # index -> object id (None once removed)
+            self.out_edges = []       # subject index -> {object index: mask}
+            self.in_edges = []        # object index -> {subject index: mask}
+
+    def _subject(self, user_id):
+        idx = self.subject_index.get(user_id)
+        if idx is None:
+            idx = len(self.subjects)
+            self.subject_index[user_id] = idx
+            self.subjects.append(user_id)
+            self.out_edges.append({})
+        return idx
+
+    def _object(self, object_id):
+        idx = self.object_index.get(object_id)
+        if idx is None:
+            idx = len(self.objects)
+            self.object_index[object_id] = idx
+            self.objects.append(object_id)
+            self.in_edges.append({})
+        return idx
+
+    # --- loading ---
+
+    def load(self, conn=None):
+        """(Re)build the graph from the stored rights."""
+        own = conn is None
+        if own:
+            conn = get_db()
+        began = not conn.in_transaction
+        try:
+            cursor = conn.cursor()
+            if began:
+                # generation and rights from one snapshot
+                cursor.execute("BEGIN")
+            with self._lock:
+                self.clear()
+                self.local_writes = rightstore.local_writes()
+                self.generation = rightstore.generation(cursor)
+                for subject_id, object_id, right_type in rightstore.iter_rights(cursor):
+                    self._add(subject_id, object_id, right_bit(right_type))
+                self.checked_at = time.monotonic()
+        finally:
+            if began:
+                conn.rollback()
+            if own:
+                conn.close()
+        return self
+
+    def refresh(self):
+        """
+        Reload if the rights changed in a way the graph has not seen, checked at most every
+        GENERATION_CHECK_INTERVAL seconds. The process graph (load_graph) follows this
+        process's own changes through the hooks below, any other graph only by reloading.
+        """
+        if time.monotonic() - self.checked_at < GENERATION_CHECK_INTERVAL:
+            return self
+        with self._lock:
+            if time.monotonic() - self.checked_at < GENERATION_CHECK_INTERVAL:
+                return self
+            conn = get_db()
+            try:
+                current = rightstore.generation(conn.cursor())
+            finally:
+                conn.close()
+            expected = self.generation
+            if self is _graph:
+                expected += rightstore.local_writes() - self.local_writes
+            if current != expected:
+                self.load()
+            self.checked_at = time.monotonic()
+        return self
+
+    def _add(self, subject_id, object_id, bits):
+        s = self._subject(subject_id)
+        o = self._object(object_id)
+        mask = self.out_edges[s].get(o, 0) | bits
+        self.out_edges[s][o] = mask
+        self.in_edges[o][s] = mask
+
+    # --- incremental updates ---
+
+    def add_right(self, subject_id, object_id, right_type):
+        with self._lock:
+            self._add(subject_id, object_id, right_bit(right_type))
+
+    def remove_right(self, subject_id, object_id, right_type):
+        with self._lock:
+            s = self.subject_index.get(subject_id)
+            o = self.object_index.get(object_id)
+            if s is None or o is None or o not in self.out_edges[s]:
+                return
+            mask = self.out_edges[s][o] & ~right_bit(right_type)
+            if mask:
+                self.out_edges[s][o] = mask
+                self.in_edges[o][s] = mask
+            else:
+                del self.out_edges[s][o]
+                del self.in_edges[o][s]
+
+    def remove_object(self, object_id):
+        with self._lock:
+            o = self.object_index.pop(object_id, None)
+            if o is None:
+                return
+            for s in self.in_edges[o]:
+                self.out_edges[s].pop(o, None)
+            self.in_edges[o] = {}
+            self.objects[o] = None
+
+    def remove_subject(self, user_id):
+        with self._lock:
+            s = self.subject_index.pop(user_id, None)
+            if s is None:
+                return
+            for o in self.out_edges[s]:
+                self.in_edges[o].pop(s, None)
+            self.out_edges[s] = {}
+            self.subjects[s] = None
+
+    # --- queries ---
+
+    def has_right(self, subject_id, object_id, right_type):
+        s = self.subject_index.get(subject_id)
+        o = self.object_index.get(object_id)
+        if s is None or o is None:
+            return False
+        bit = RIGHT_BITS.get(right_type)
+        return bit is not None and bool(self.out_edges[s].get(o, 0) & bit)
+
+    def rights_of(self, subject_id):
+        """{object_id: [right_type, ...]} for one subject."""
+        s = self.subject_index.get(subject_id)
+        if s is None:
+            return {}
+        with self._lock:
+            return {self.objects[o]: mask_to_rights(m) for o, m in self.out_edges[s].items()}
+
+    def holders_of(self, object_id):
+        """{user_id: [right_type, ...]} for one object."""
+        o = self.object_index.get(object_id)
+        if o is None:
+            return {}
+        with self._lock:
+            return {self.subjects[s]: mask_to_rights(m) for s, m in self.in_edges[o].items()}
+
+    def edges(self):
+        """Yield (user_id, object_id, right_type) for every right in the graph."""
+        with self._lock:
+            for s, row in enumerate(self.out_edges):
+                for o, mask in row.items():
+                    for right_type in mask_to_rights(mask):
+                        yield self.subjects[s], self.objects[o], right_type
+
+    def edge_count(self):
+        with self._lock:
+            return sum(len(row) for row in self.out_edges)
+
+    def verify(self, conn=None):
+        """
+        Compare the graph with the stored rights.
+        Returns (missing, extra): rights in the DB but not in memory, and the other way round.
+        """
+        own = conn is None
+        if own:
+            conn = get_db()
+        try:
+            in_db = set(rightstore.iter_rights(conn.cursor()))
+        finally:
+            if own:
+                conn.close()
+        in_memory = set(self.edges())
+        return in_db - in_memory, in_memory - in_db
+
+
+# Process-wide graph. It is only kept in sync once loaded (see load_graph).
+_graph = None
+# Graph for read-only analysis when no process graph is loaded, see analysis_graph
+_private = None
+
+
+def get_graph():
+    """Return the loaded graph or None."""
+    return _graph
+
+
+def load_graph():
+    """Load the process graph; from then on check_access answers direct rights from it."""
+    global _graph
+    graph = ProtectionGraph().load()
+    _graph = graph
+    return graph
+
+
+def analysis_graph():
+    """
+    A current graph for read-only analysis (analysis.py, simulate.py): the process graph
+    if one is loaded, otherwise a private one, so analysing never switches check_access
+    over to the graph.
+    """
+    global _private
+    if _graph is not None:
+        return _graph.refresh()
+    if _private is None:
+        _private = ProtectionGraph().load()
+    return _private.refresh()
+
+
+def reset_graph():
+    global _graph, _private
+    _graph = None
+    _private = None
+
+
+# Hooks called by rights/objects/auth after a change is committed.
+# They also drop the affected access decisions from the decision cache. Inside a
+# transaction_group() the change is not committed yet: cache and graph follow at the real
+# COMMIT (nothing if rolled back). Until then other threads can only see the old state,
+# and has_access inside the group reads through the group's connection.
+
+def _hook(invalidate, key, change=None):
+    after_commit(_committed, invalidate, key, change)
+
+
+def _committed(invalidate, key, change):
+    invalidate(*key)
+    if change is not None and _graph is not None:
+        getattr(_graph, change)(*key)
+
+
+def on_right_added(subject_id, object_id, right_type):
+    _hook(decision_cache.invalidate, (subject_id, object_id, right_type), "add_right")
+
+
+def on_right_removed(subject_id, object_id, right_type):
+    _hook(decision_cache.invalidate, (subject_id, object_id, right_type), "remove_right")
+
+
+def on_object_deleted(object_id):
+    _hook(decision_cache.invalidate_object, (object_id,), "remove_object")
+
+
+def on_user_deleted(user_id):
+    _hook(decision_cache.invalidate_user, (user_id,), "remove_subject")
+
+
+def on_group_changed(user_ids=(), object_ids=()):
+    # group rights are not in the graph, only cached decisions can be stale
+    for user_id in user_ids:
+        _hook(decision_cache.invalidate_user, (user_id,))
+    for object_id in object_ids:
+        _hook(decision_cache.invalidate_object, (object_id,))
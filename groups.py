@@ -0,0 +1,174 @@
+# groups.py
+"""
+Group subjects. A group holds rights like a user does and passes them on to its members:
+500 users with read on 200 objects are 200 group rights and 500 memberships. What a user
+can do through its groups is kept in effective_rights (see rightstore.py), which
+has_access / check_access read. Rights held through a group can be used but not passed
+on, grant and take work with direct rights only.
+"""
+from db import chunks, get_db
+from graph import on_group_changed
+from metrics import instrument
+import rightstore
+
+
+def _group_exists(cursor, group_id):
+    cursor.execute("SELECT 1 FROM groups WHERE id = ?", (group_id,))
+    return cursor.fetchone() is not None
+
+
+@instrument
+def create_group(name):
+    """Returns the new group id, or None if the name is taken."""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM groups WHERE name = ?", (name,))
+    if cursor.fetchone():
+        print(f"Group '{name}' already exists!")
+        conn.close()
+        return None
+    cursor.execute("INSERT INTO groups (name) VALUES (?)", (name,))
+    group_id = cursor.lastrowid
+    conn.commit()
+    conn.close()
+    print(f"Group '{name}' created with id={group_id}")
+    return group_id
+
+
+@instrument
+def delete_group(group_id):
+    """Delete a group with its rights and memberships."""
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        if not _group_exists(cursor, group_id):
+            print("Group not found.")
+            return False
+        cursor.execute("SELECT user_id FROM group_members WHERE group_id = ?", (group_id,))
+        members = [row[0] for row in cursor.fetchall()]
+        rightstore.delete_group_rights(cursor, group_id)
+        cursor.execute("DELETE FROM groups WHERE id = ?", (group_id,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    on_group_changed(user_ids=members)
+    print(f"Group {group_id} deleted.")
+    return True
+
+
+@instrument
+def add_members(group_id, user_ids):
+    """Add users to a group. Unknown user ids are skipped. Returns the ids added."""
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        if not _group_exists(cursor, group_id):
+            print("Group not found.")
+            return []
+        added = []
+        for chunk in chunks(set(user_ids)):
+            marks = ",".join("?" * len(chunk))
+            cursor.execute(f"""
+                SELECT id FROM users WHERE id IN ({marks})
+                  AND id NOT IN (SELECT user_id FROM group_members WHERE group_id = ?)
+            """, (*chunk, group_id))
+            added.extend(row[0] for row in cursor.fetchall())
+        rightstore.add_members(cursor, [(group_id, user_id) for user_id in added])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    on_group_changed(user_ids=added)
+    print(f"Added {len(added)} members to group {group_id}")
+    return sorted(added)
+
+
+@instrument
+def remove_members(group_id, user_ids):
+    """Remove users from a group. Returns the ids removed."""
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        removed = []
+        for chunk in chunks(set(user_ids)):
+            marks = ",".join("?" * len(chunk))
+            cursor.execute(f"SELECT user_id FROM group_members WHERE group_id = ? AND user_id IN ({marks})",
+                           (group_id, *chunk))
+            removed.extend(row[0] for row in cursor.fetchall())
+        rightstore.remove_members(cursor, [(group_id, user_id) for user_id in removed])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    on_group_changed(user_ids=removed)
+    print(f"Removed {len(removed)} members from group {group_id}")
+    return sorted(removed)
+
+
+@instrument
+def grant_group_right(from_user_id, group_id, object_id, right_type):
+    """Grant a right the user holds directly to a group (and so to all its members)."""
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        if not rightstore.has_right(cursor, from_user_id, object_id, right_type):
+            print("You cannot grant a right you don't have.")
+            return False
+        if not _group_exists(cursor, group_id):
+            print("Group not found.")
+            return False
+        rightstore.add_group_rights(cursor, [(group_id, object_id, right_type)])
+        rightstore.record_group_provenance(cursor, [(group_id, object_id, right_type, from_user_id, "grant")])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    on_group_changed(object_ids=[object_id])
+    print(f"Granted '{right_type}' on object {object_id} to group {group_id}")
+    return True
+
+
+@instrument
+def revoke_group_right(group_id, object_id, right_type):
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        bit = rightstore.right_bit(cursor, right_type)
+        cursor.execute("SELECT 1 FROM group_rights WHERE group_id = ? AND object_id = ? AND mask & ? != 0",
+                       (group_id, object_id, bit))
+        if not bit or cursor.fetchone() is None:
+            print("The group doesn't have this right.")
+            return False
+        rightstore.remove_group_rights(cursor, [(group_id, object_id, right_type)])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    on_group_changed(object_ids=[object_id])
+    print(f"Revoked '{right_type}' on object {object_id} from group {group_id}")
+    return True
+
+
+def list_groups():
+    """[(id, name, members, objects)]"""
+    conn = get_db()
+    try:
+        return conn.execute("""
+            SELECT g.id, g.name,
+                   (SELECT COUNT(*) FROM group_members m WHERE m.group_id = g.id),
+                   (SELECT COUNT(*) FROM group_rights r WHERE r.group_id = g.id)
+            FROM groups g ORDER BY g.id
+        """).fetchall()
+    finally:
+        conn.close()
@@ -1,8 +1,21 @@
-﻿from db import init_db
-from auth import register_user, login_user
-from objects import create_object, list_objects, read_object, write_object, delete_object
-from rights import grant_right, take_right, check_access
-from audit import log_event
+﻿import argparse
+import contextlib
+import io
+import json
+import re
+import sys
+
+import metrics
+
+from db import init_db, get_db, savepoint, transaction_group
+from auth import register_user, login_user, delete_user
+from objects import create_object, list_objects, read_object_checked, write_object_checked, delete_object_checked
+from rights import grant_right, take_right, revoke_right, check_access
+from groups import (create_group, delete_group, add_members, remove_members, grant_group_right,
+                    revoke_group_right, list_groups)
+from acl import rights_for_user, acl_for_object, access_counts, access_summary
+from archive import rotate_audit
+from audit import log_event, configure_audit, query_audit, export_audit, AUDIT_COLUMNS, flush as flush_audit
 
 try:
     from tabulate import tabulate
@@ -23,27 +36,47 @@ Available commands:
   delete_obj           - delete object and its rights
   grant                - grant a right to another user
   take                 - take a right from another user (requires take right)
+  revoke               - (admin/owner) revoke a right, optionally with the rights derived from it
+  list_groups          - list user groups
+  group_create         - (admin) create a user group
+  group_delete         - (admin) delete a group with its rights and memberships
+  group_add            - (admin) add users to a group
+  group_remove         - (admin) remove users from a group
+  group_grant          - grant a right you hold to a group (all its members get it)
+  group_revoke         - (admin/owner) revoke a right from a group
   check                - check access for current user
+  rights               - list what a user can do (yourself, or anyone as admin)
+  acl                  - (admin/owner) list who can access an object
+  access_summary       - (admin) users / objects with the most access
   show_audit           - show last audit records
+  export_audit         - (admin) export audit records to a CSV or JSON Lines file
+  rotate_audit         - (admin) move old audit records to compressed archive files
+  metrics              - (admin) show call/SQL metrics or write them as a Prometheus file
   list_users           - (admin) list all users
-  delete_user          - (admin) delete a user
+  delete_user          - (admin) delete a user with its objects and rights
   make_admin           - (admin) grant admin rights to a user
   exit                 - exit program
+
+Batch mode: python main.py --batch commands.jsonl (or - for stdin), one JSON command per line:
+  {"cmd": "login", "username": "alice", "password": "..."}
+  {"cmd": "grant", "to": 5, "obj": 9, "right": "read"}
+  {"cmd": "read_obj", "obj": 9, "offset": 0, "length": 4096}   (byte range is optional)
+  {"cmd": "delete_user", "user": 5, "keep_objects": false, "transitive": true}
+  {"cmd": "group_add", "group": 2, "users": [5, 6, 7]}
+  {"cmd": "acl", "obj": 9, "limit": 100, "after": 0}   (pass the returned "next" as after)
 """
 
 def print_help():
     print(HELP_TEXT)
 
-def show_audit(limit=20):
-    conn = __import__('sqlite3').connect("take_grant.db")
-    cur = conn.cursor()
-    cur.execute("SELECT id, timestamp, user, action, result, target_user_id, object_name FROM audit ORDER BY id DESC LIMIT ?", (limit,))
-    rows = cur.fetchall()
-    conn.close()
+def show_audit(limit=20, **filters):
+    # records may still be queued in the background writer
+    flush_audit()
+    rows, _ = query_audit(limit, **filters)
     if not rows:
         print("No audit records.")
         return
-    headers = ["id", "timestamp", "user", "action", "result", "target_user_id", "object_name"]
+    headers = list(AUDIT_COLUMNS)
     if tabulate:
         print(tabulate(rows, headers=headers, tablefmt="grid"))
     else:
@@ -51,278 +84,694 @@ def show_audit(limit=20):
         for r in rows:
             print(r)
 
-def main():
-    init_db()
-    current_user_id = None
-    current_username = None
-    current_is_admin = False
+class Session:
+    """Logged-in user of one CLI / batch session."""
 
-    print("Take-Grant Security System (CLI). Type 'help' to list commands.")
+    def __init__(self):
+        self.user_id = None
+        self.username = None
+        self.is_admin = False
+        self.token = None
 
-    while True:
-        prompt = f"{current_username}> " if current_username else "> "
-        cmd = input(prompt).strip()
 
-        if cmd == "help":
-            print_help()
-            continue
+def arg(args, key, prompt, strip=True):
+    """
+    Value of one command argument: asked with input() in interactive mode (args is None),
+    taken from the command dict in batch mode.
+    """
+    if args is None:
+        value = input(prompt)
+    else:
+        value = args.get(key)
+        value = "" if value is None else str(value)
+    return value.strip() if strip else value
 
-        if cmd == "register":
-            username = input("Username: ").strip()
-            password = input("Password: ").strip()
-            ok = register_user(username, password)
-            log_event(username, "register", "success" if ok else "fail")
-            continue
 
-        if cmd == "login":
-            username = input("Username: ").strip()
-            password = input("Password: ").strip()
-            res = login_user(username, password)
-            if res:
-                current_user_id, current_username, current_is_admin = res
-                log_event(current_username, "login", "success")
-            else:
-                log_event(username, "login", "fail")
-            continue
+def object_name(obj_id):
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("SELECT name FROM objects WHERE id = ?", (obj_id,))
+    row = cur.fetchone()
+    conn.close()
+    return row[0] if row else None
 
-        if cmd == "logout":
-            if current_username:
-                log_event(current_username, "logout", "success")
-                print(f"User '{current_username}' logged out.")
-            current_user_id = None
-            current_username = None
-            current_is_admin = False
-            continue
 
-        if cmd == "whoami":
-            if current_username:
-                print(f"Logged in as: {current_username} (id={current_user_id})")
-            else:
-                print("Not logged in.")
-            continue
+def object_id(name):
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM objects WHERE name = ?", (name,))
+    row = cur.fetchone()
+    conn.close()
+    return row[0] if row else None
 
-        if cmd == "create_obj":
-            if not current_user_id:
-                print("You must login first.")
-                log_event("anonymous", "create_obj_attempt", "fail")
-                continue
-            name = input("Object name: ").strip()
-            content = input("Object content: ").strip()
-            ok = create_object(name, content, current_user_id)
-            log_event(current_username, f"create object {name}", "success" if ok else "fail", target_user_id=None, object_name=name)
-            continue
 
-        if cmd == "list_obj":
-            # fetch objects and print nicely
-            conn = __import__('sqlite3').connect("take_grant.db")
-            cur = conn.cursor()
-            cur.execute("SELECT id, name, owner_id FROM objects")
-            rows = cur.fetchall()
-            conn.close()
-            if not rows:
-                print("No objects.")
-            else:
-                headers = ["id", "name", "owner_id"]
-                if tabulate:
-                    print(tabulate(rows, headers=headers, tablefmt="grid"))
-                else:
-                    for r in rows:
-                        print(f"id={r[0]}, name={r[1]}, owner_id={r[2]}")
-            log_event(current_username or "anonymous", "list_objects", "success")
-            continue
+def print_rows(rows, headers):
+    if tabulate:
+        print(tabulate(rows, headers=headers, tablefmt="grid"))
+    else:
+        for r in rows:
+            print(", ".join(f"{h}={v}" for h, v in zip(headers, r)))
 
-        if cmd == "read_obj":
-            oid = input("Object ID: ").strip()
-            if not oid.isdigit():
-                print("Invalid object id.")
-                continue
-            oid = int(oid)
-            if current_user_id and check_access(current_user_id, oid, "read"):
-                # get object name for audit
-                conn = __import__('sqlite3').connect("take_grant.db")
-                cur = conn.cursor()
-                cur.execute("SELECT name FROM objects WHERE id = ?", (oid,))
-                row = cur.fetchone()
-                conn.close()
-                object_name = row[0] if row else None
-                read_object(oid)
-                log_event(current_username, f"read object {oid}", "success", object_name=object_name)
-            else:
-                print("Read denied or you must login first.")
-                log_event(current_username or "anonymous", f"read object {oid}", "denied")
-            continue
 
-        if cmd == "write_obj":
-            oid = input("Object ID: ").strip()
-            if not oid.isdigit():
-                print("Invalid object id.")
-                continue
-            oid = int(oid)
-            new_content = input("New content: ")
-            if current_user_id and check_access(current_user_id, oid, "write"):
-                # get object_name for audit
-                conn = __import__('sqlite3').connect("take_grant.db")
-                cur = conn.cursor()
-                cur.execute("SELECT name FROM objects WHERE id = ?", (oid,))
-                row = cur.fetchone()
-                conn.close()
-                object_name = row[0] if row else None
-                ok = write_object(oid, new_content)
-                log_event(current_username, f"write object {oid}", "success" if ok else "fail", object_name=object_name)
-            else:
-                print("Write denied or you must login first.")
-                log_event(current_username or "anonymous", f"write object {oid}", "denied")
-            continue
+# --- command handlers: handler(session, args) -> result dict ---
 
-        if cmd == "delete_obj":
-            oid = input("Object ID to delete: ").strip()
-            if not oid.isdigit():
-                print("Invalid object id.")
-                continue
-            oid = int(oid)
-            if current_user_id and check_access(current_user_id, oid, "write"):
-                # get object_name for audit
-                conn = __import__('sqlite3').connect("take_grant.db")
-                cur = conn.cursor()
-                cur.execute("SELECT name FROM objects WHERE id = ?", (oid,))
-                row = cur.fetchone()
-                conn.close()
-                object_name = row[0] if row else None
-                ok = delete_object(oid)
-                log_event(current_username, f"delete object {oid}", "success" if ok else "fail", object_name=object_name)
-            else:
-                print("Delete denied or you must login first.")
-                log_event(current_username or "anonymous", f"delete object {oid}", "denied")
-            continue
+def cmd_help(session, args):
+    print_help()
+    return {"ok": True}
 
-        if cmd == "grant":
-            if not current_user_id:
-                print("You must login first.")
-                log_event("anonymous", "grant_attempt", "fail")
-                continue
-            to_user = input("Target user ID: ").strip()
-            obj_id = input("Object ID: ").strip()
-            right = input("Right (read/write/take): ").strip()
-            if not to_user.isdigit() or not obj_id.isdigit():
-                print("Invalid ids.")
-                log_event(current_username, "grant_invalid_ids", "fail")
-                continue
-            to_user_id = int(to_user); obj_id_int = int(obj_id)
-            ok = grant_right(current_user_id, to_user_id, obj_id_int, right)
-            # object name for audit
-            conn = __import__('sqlite3').connect("take_grant.db")
-            cur = conn.cursor()
-            cur.execute("SELECT name FROM objects WHERE id = ?", (obj_id_int,))
-            row = cur.fetchone()
-            conn.close()
-            object_name = row[0] if row else None
-            log_event(current_username, f"grant {right} obj {obj_id} to user {to_user}", "success" if ok else "fail", target_user_id=to_user_id, object_name=object_name)
-            continue
+def cmd_register(session, args):
+    username = arg(args, "username", "Username: ")
+    password = arg(args, "password", "Password: ")
+    ok = register_user(username, password)
+    log_event(username, "register", "success" if ok else "fail", operation="register")
+    return {"ok": ok}
+
+def cmd_login(session, args):
+    username = arg(args, "username", "Username: ")
+    password = arg(args, "password", "Password: ")
+    res = login_user(username, password)
+    if res:
+        session.user_id, session.username, session.is_admin = res
+        log_event(session.username, "login", "success", operation="login", actor_id=session.user_id)
+        return {"ok": True, "user_id": session.user_id}
+    log_event(username, "login", "fail", operation="login")
+    return {"ok": False}
+
+def cmd_logout(session, args):
+    if session.username:
+        log_event(session.username, "logout", "success", operation="logout", actor_id=session.user_id)
+        print(f"User '{session.username}' logged out.")
+    session.user_id = None
+    session.username = None
+    session.is_admin = False
+    return {"ok": True}
+
+def cmd_whoami(session, args):
+    if session.username:
+        print(f"Logged in as: {session.username} (id={session.user_id})")
+    else:
+        print("Not logged in.")
+    return {"ok": True, "user_id": session.user_id, "username": session.username}
+
+def cmd_create_obj(session, args):
+    if not session.user_id:
+        print("You must login first.")
+        log_event("anonymous", "create_obj_attempt", "fail", operation="create_object")
+        return {"ok": False, "error": "not logged in"}
+    name = arg(args, "name", "Object name: ")
+    content = arg(args, "content", "Object content: ")
+    ok = create_object(name, content, session.user_id)
+    log_event(session.username, f"create object {name}", "success" if ok else "fail", target_user_id=None, object_name=name,
+              operation="create_object", object_id=object_id(name) if ok else None, actor_id=session.user_id)
+    return {"ok": ok}
+
+def cmd_list_obj(session, args):
+    # fetch objects and print nicely
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("SELECT id, name, owner_id FROM objects")
+    rows = cur.fetchall()
+    conn.close()
+    if not rows:
+        print("No objects.")
+    else:
+        print_rows(rows, ["id", "name", "owner_id"])
+    log_event(session.username or "anonymous", "list_objects", "success", operation="list_objects", actor_id=session.user_id)
+    return {"ok": True, "objects": [{"id": r[0], "name": r[1], "owner_id": r[2]} for r in rows]}
+
+def cmd_read_obj(session, args):
+    oid = arg(args, "obj", "Object ID: ")
+    if not oid.isdigit():
+        print("Invalid object id.")
+        return {"ok": False, "error": "invalid object id"}
+    # optional byte range, batch mode only
+    offset = int((args or {}).get("offset", 0))
+    length = (args or {}).get("length")
+    result = read_object_checked(session.user_id, int(oid), session.username,
+                                 offset, None if length is None else int(length))
+    if not result["ok"]:
+        print("Object not found!" if result["error"] == "not found" else "Read denied or you must login first.")
+        return result
+    content = result["content"].decode("utf-8", errors="replace")
+    print(f"\nObject: {result['name']} (owner_id={result['owner_id']})")
+    print(f"Content: {content}")
+    return {"ok": True, "name": result["name"], "owner_id": result["owner_id"], "size": result["size"],
+            "offset": offset, "content": content}
+
+def cmd_write_obj(session, args):
+    oid = arg(args, "obj", "Object ID: ")
+    if not oid.isdigit():
+        print("Invalid object id.")
+        return {"ok": False, "error": "invalid object id"}
+    new_content = arg(args, "content", "New content: ", strip=False)
+    result = write_object_checked(session.user_id, int(oid), new_content, session.username)
+    if not result["ok"]:
+        print("Object not found!" if result["error"] == "not found" else "Write denied or you must login first.")
+        return result
+    print(f"Object id={oid} updated successfully.")
+    return {"ok": True}
+
+def cmd_delete_obj(session, args):
+    oid = arg(args, "obj", "Object ID to delete: ")
+    if not oid.isdigit():
+        print("Invalid object id.")
+        return {"ok": False, "error": "invalid object id"}
+    result = delete_object_checked(session.user_id, int(oid), session.username)
+    if not result["ok"]:
+        print("Object not found!" if result["error"] == "not found" else "Delete denied or you must login first.")
+        return result
+    print(f"Object id={oid} and related rights deleted.")
+    return {"ok": True}
+
+def cmd_grant(session, args):
+    if not session.user_id:
+        print("You must login first.")
+        log_event("anonymous", "grant_attempt", "fail", operation="grant")
+        return {"ok": False, "error": "not logged in"}
+    to_user = arg(args, "to", "Target user ID: ")
+    obj_id = arg(args, "obj", "Object ID: ")
+    right = arg(args, "right", "Right (read/write/take): ")
+    if not to_user.isdigit() or not obj_id.isdigit():
+        print("Invalid ids.")
+        log_event(session.username, "grant_invalid_ids", "fail", operation="grant", actor_id=session.user_id)
+        return {"ok": False, "error": "invalid ids"}
+    to_user_id = int(to_user); obj_id_int = int(obj_id)
+    ok = grant_right(session.user_id, to_user_id, obj_id_int, right)
+    log_event(session.username, f"grant {right} obj {obj_id} to user {to_user}", "success" if ok else "fail", target_user_id=to_user_id, object_name=object_name(obj_id_int),
+              operation="grant", right_type=right, object_id=obj_id_int, actor_id=session.user_id)
+    return {"ok": ok}
+
+def cmd_take(session, args):
+    if not session.user_id:
+        print("You must login first.")
+        log_event("anonymous", "take_attempt", "fail", operation="take")
+        return {"ok": False, "error": "not logged in"}
+    target_user = arg(args, "from", "Target user ID: ")
+    obj_id = arg(args, "obj", "Object ID: ")
+    right = arg(args, "right", "Right (read/write): ")
+    if not target_user.isdigit() or not obj_id.isdigit():
+        print("Invalid ids.")
+        log_event(session.username, "take_invalid_ids", "fail", operation="take", actor_id=session.user_id)
+        return {"ok": False, "error": "invalid ids"}
+    target_user_id = int(target_user); obj_id_int = int(obj_id)
+    ok = take_right(session.user_id, target_user_id, obj_id_int, right)
+    log_event(session.username, f"take {right} obj {obj_id} from user {target_user}", "success" if ok else "fail", target_user_id=target_user_id, object_name=object_name(obj_id_int),
+              operation="take", right_type=right, object_id=obj_id_int, actor_id=session.user_id, source_user_id=target_user_id)
+    return {"ok": ok}
+
+def cmd_revoke(session, args):
+    if not session.user_id:
+        print("You must login first.")
+        log_event("anonymous", "revoke_attempt", "fail", operation="revoke")
+        return {"ok": False, "error": "not logged in"}
+    user = arg(args, "user", "User ID: ")
+    obj_id = arg(args, "obj", "Object ID: ")
+    right = arg(args, "right", "Right (read/write/take): ")
+    cascade = arg(args, "cascade", "Also revoke rights derived from it? (y/N): ").lower() in ("y", "yes", "true", "1")
+    if not user.isdigit() or not obj_id.isdigit():
+        print("Invalid ids.")
+        log_event(session.username, "revoke_invalid_ids", "fail", operation="revoke", actor_id=session.user_id)
+        return {"ok": False, "error": "invalid ids"}
+    user_id = int(user); obj_id_int = int(obj_id)
+    conn = get_db()
+    owner = conn.execute("SELECT owner_id FROM objects WHERE id = ?", (obj_id_int,)).fetchone()
+    conn.close()
+    if not session.is_admin and (owner is None or owner[0] != session.user_id):
+        print("Only admin or the object owner can revoke rights.")
+        log_event(session.username, f"revoke {right} obj {obj_id} from user {user}", "denied", target_user_id=user_id,
+                  operation="revoke", right_type=right, object_id=obj_id_int, actor_id=session.user_id)
+        return {"ok": False, "error": "denied"}
+    removed = revoke_right(user_id, obj_id_int, right, cascade=cascade)
+    log_event(session.username, f"revoke {right} obj {obj_id} from user {user}", "success" if removed else "fail", target_user_id=user_id,
+              object_name=object_name(obj_id_int), operation="revoke", right_type=right, object_id=obj_id_int, actor_id=session.user_id)
+    return {"ok": bool(removed), "revoked": [list(r) for r in removed]}
 
-        if cmd == "take":
-            if not current_user_id:
-                print("You must login first.")
-                log_event("anonymous", "take_attempt", "fail")
-                continue
-            target_user = input("Target user ID: ").strip()
-            obj_id = input("Object ID: ").strip()
-            right = input("Right (read/write): ").strip()
-            if not target_user.isdigit() or not obj_id.isdigit():
-                print("Invalid ids.")
-                log_event(current_username, "take_invalid_ids", "fail")
-                continue
-            target_user_id = int(target_user); obj_id_int = int(obj_id)
-            ok = take_right(current_user_id, target_user_id, obj_id_int, right)
-            # object name for audit
-            conn = __import__('sqlite3').connect("take_grant.db")
-            cur = conn.cursor()
-            cur.execute("SELECT name FROM objects WHERE id = ?", (obj_id_int,))
-            row = cur.fetchone()
-            conn.close()
-            object_name = row[0] if row else None
-            log_event(current_username, f"take {right} obj {obj_id} from user {target_user}", "success" if ok else "fail", target_user_id=target_user_id, object_name=object_name)
+def _group_admin(session, action):
+    if session.is_admin:
+        return True
+    print("Only admin can manage groups.")
+    log_event(session.username or "anonymous", action, "denied", operation="group", actor_id=session.user_id)
+    return False
+
+def cmd_list_groups(session, args):
+    rows = list_groups()
+    if not rows:
+        print("No groups.")
+    else:
+        print_rows(rows, ["id", "name", "members", "objects"])
+    return {"ok": True, "groups": [{"id": r[0], "name": r[1], "members": r[2], "objects": r[3]} for r in rows]}
+
+def cmd_group_create(session, args):
+    if not _group_admin(session, "group_create"):
+        return {"ok": False, "error": "denied"}
+    name = arg(args, "name", "Group name: ")
+    if not name:
+        print("Group name cannot be empty.")
+        return {"ok": False, "error": "empty name"}
+    group_id = create_group(name)
+    log_event(session.username, f"group_create {name}", "success" if group_id else "fail",
+              operation="group", actor_id=session.user_id)
+    return {"ok": group_id is not None, "group": group_id}
+
+def cmd_group_delete(session, args):
+    if not _group_admin(session, "group_delete"):
+        return {"ok": False, "error": "denied"}
+    group = arg(args, "group", "Group ID: ")
+    if not group.isdigit():
+        print("Invalid group id.")
+        return {"ok": False, "error": "invalid group id"}
+    ok = delete_group(int(group))
+    log_event(session.username, f"group_delete {group}", "success" if ok else "fail",
+              operation="group", actor_id=session.user_id)
+    return {"ok": ok}
+
+def _group_members_cmd(session, args, action, apply):
+    if not _group_admin(session, action):
+        return {"ok": False, "error": "denied"}
+    group = arg(args, "group", "Group ID: ")
+    users = arg(args, "users", "User IDs (comma separated): ")
+    user_ids = [int(u) for u in re.findall(r"\d+", users)]
+    if not group.isdigit() or not user_ids:
+        print("Invalid ids.")
+        return {"ok": False, "error": "invalid ids"}
+    changed = apply(int(group), user_ids)
+    log_event(session.username, f"{action} {group} users {','.join(map(str, changed))}", "success" if changed else "fail",
+              operation="group", actor_id=session.user_id)
+    return {"ok": bool(changed), "users": changed}
+
+def cmd_group_add(session, args):
+    return _group_members_cmd(session, args, "group_add", add_members)
+
+def cmd_group_remove(session, args):
+    return _group_members_cmd(session, args, "group_remove", remove_members)
+
+def cmd_group_grant(session, args):
+    if not session.user_id:
+        print("You must login first.")
+        log_event("anonymous", "group_grant_attempt", "fail", operation="group")
+        return {"ok": False, "error": "not logged in"}
+    group = arg(args, "group", "Group ID: ")
+    obj_id = arg(args, "obj", "Object ID: ")
+    right = arg(args, "right", "Right (read/write/take): ")
+    if not group.isdigit() or not obj_id.isdigit():
+        print("Invalid ids.")
+        return {"ok": False, "error": "invalid ids"}
+    ok = grant_group_right(session.user_id, int(group), int(obj_id), right)
+    log_event(session.username, f"group_grant {right} obj {obj_id} to group {group}", "success" if ok else "fail",
+              object_name=object_name(int(obj_id)), operation="group", right_type=right, object_id=int(obj_id),
+              actor_id=session.user_id)
+    return {"ok": ok}
+
+def cmd_group_revoke(session, args):
+    if not session.user_id:
+        print("You must login first.")
+        log_event("anonymous", "group_revoke_attempt", "fail", operation="group")
+        return {"ok": False, "error": "not logged in"}
+    group = arg(args, "group", "Group ID: ")
+    obj_id = arg(args, "obj", "Object ID: ")
+    right = arg(args, "right", "Right (read/write/take): ")
+    if not group.isdigit() or not obj_id.isdigit():
+        print("Invalid ids.")
+        return {"ok": False, "error": "invalid ids"}
+    obj_id_int = int(obj_id)
+    conn = get_db()
+    owner = conn.execute("SELECT owner_id FROM objects WHERE id = ?", (obj_id_int,)).fetchone()
+    conn.close()
+    if not session.is_admin and (owner is None or owner[0] != session.user_id):
+        print("Only admin or the object owner can revoke rights.")
+        log_event(session.username, f"group_revoke {right} obj {obj_id} from group {group}", "denied",
+                  operation="group", right_type=right, object_id=obj_id_int, actor_id=session.user_id)
+        return {"ok": False, "error": "denied"}
+    ok = revoke_group_right(int(group), obj_id_int, right)
+    log_event(session.username, f"group_revoke {right} obj {obj_id} from group {group}", "success" if ok else "fail",
+              object_name=object_name(obj_id_int), operation="group", right_type=right, object_id=obj_id_int,
+              actor_id=session.user_id)
+    return {"ok": ok}
+
+def cmd_list_users(session, args):
+    if not session.is_admin:
+        print("Only admin can list users.")
+        log_event(session.username or "anonymous", "list_users", "denied", operation="list_users", actor_id=session.user_id)
+        return {"ok": False, "error": "denied"}
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("SELECT id, username, is_admin FROM users")
+    rows = cur.fetchall()
+    conn.close()
+    print_rows(rows, ["id", "username", "is_admin"])
+    log_event(session.username, "list_users", "success", operation="list_users", actor_id=session.user_id)
+    return {"ok": True, "users": [{"id": r[0], "username": r[1], "is_admin": bool(r[2])} for r in rows]}
+
+def cmd_delete_user(session, args):
+    if not session.is_admin:
+        print("Only admin can delete users.")
+        log_event(session.username or "anonymous", "delete_user", "denied", operation="delete_user", actor_id=session.user_id)
+        return {"ok": False, "error": "denied"}
+    uid = arg(args, "user", "Enter user ID to delete: ")
+    if not uid.isdigit():
+        print("Invalid user id.")
+        return {"ok": False, "error": "invalid user id"}
+    uid = int(uid)
+    keep = arg(args, "keep_objects", "Keep the user's objects without owner? (y/N): ").lower() in ("y", "yes", "true", "1")
+    transitive = arg(args, "transitive", "Also revoke rights derived from this user? (y/N): ").lower() in ("y", "yes", "true", "1")
+    report = delete_user(uid, owned="keep" if keep else "delete", transitive=transitive)
+    ok = report["deleted"]
+    log_event(session.username, f"delete_user {uid}", "success" if ok else "fail", target_user_id=uid,
+              operation="delete_user", actor_id=session.user_id)
+    return {"ok": ok, "objects": report["objects"], "rights_revoked": len(report["own_rights"]),
+            "derived_rights_revoked": [list(r) for r in report["derived_rights"]],
+            "derived_group_rights_revoked": [list(r) for r in report["derived_group_rights"]]}
+
+def cmd_make_admin(session, args):
+    if not session.is_admin:
+        print("Only admin can grant admin rights.")
+        log_event(session.username or "anonymous", "make_admin", "denied", operation="make_admin", actor_id=session.user_id)
+        return {"ok": False, "error": "denied"}
+    uid = arg(args, "user", "Enter user ID to make admin: ")
+    if not uid.isdigit():
+        print("Invalid user id.")
+        return {"ok": False, "error": "invalid user id"}
+    uid = int(uid)
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("UPDATE users SET is_admin = 1 WHERE id = ?", (uid,))
+    conn.commit()
+    conn.close()
+    print(f"User {uid} is now admin.")
+    log_event(session.username, f"make_admin {uid}", "success", target_user_id=uid,
+              operation="make_admin", actor_id=session.user_id)
+    return {"ok": True}
+
+def cmd_check(session, args):
+    if not session.user_id:
+        print("You must login first.")
+        log_event("anonymous", "check_attempt", "fail", operation="check")
+        return {"ok": False, "error": "not logged in"}
+    obj_id = arg(args, "obj", "Object ID: ")
+    right = arg(args, "right", "Right (read/write): ")
+    if not obj_id.isdigit():
+        print("Invalid object id.")
+        log_event(session.username, "check_invalid_id", "fail", operation="check", actor_id=session.user_id)
+        return {"ok": False, "error": "invalid object id"}
+    ok = check_access(session.user_id, int(obj_id), right)
+    log_event(session.username, f"check {right} on object {obj_id}", "success" if ok else "denied",
+              operation="check", right_type=right, object_id=int(obj_id), actor_id=session.user_id)
+    return {"ok": ok}
+
+def _listing(args, query, key, headers):
+    """
+    Interactive mode prints every row a page at a time and returns (None, None); batch mode
+    returns one page of "limit" rows after the "after" cursor, with the cursor of the next page.
+    """
+    if args is None:
+        after = None
+        while True:
+            page, after = query(key, 1000, after)
+            print_rows([(k, n, ",".join(r)) for k, n, r in page], headers)
+            if after is None:
+                return None, None
+    limit = int(args.get("limit") or 100)
+    after = args.get("after")
+    rows, after = query(key, limit, int(after) if after else None)
+    print_rows([(k, n, ",".join(r)) for k, n, r in rows], headers)
+    return rows, after
+
+def cmd_rights(session, args):
+    if not session.user_id:
+        print("You must login first.")
+        return {"ok": False, "error": "not logged in"}
+    user = arg(args, "user", "User ID (empty for yourself): ") if session.is_admin else ""
+    if user and not user.isdigit():
+        print("Invalid user id.")
+        return {"ok": False, "error": "invalid user id"}
+    user_id = int(user) if user else session.user_id
+    rows, after = _listing(args, rights_for_user, user_id, ["object_id", "name", "rights"])
+    total = access_counts(user_id=user_id)["objects"]
+    print(f"User {user_id} can access {total} objects.")
+    result = {"ok": True, "user": user_id, "total": total, "next": after}
+    if rows is not None:
+        result["rights"] = [{"obj": k, "name": n, "rights": r} for k, n, r in rows]
+    return result
+
+def cmd_acl(session, args):
+    if not session.user_id:
+        print("You must login first.")
+        return {"ok": False, "error": "not logged in"}
+    obj_id = arg(args, "obj", "Object ID: ")
+    if not obj_id.isdigit():
+        print("Invalid object id.")
+        return {"ok": False, "error": "invalid object id"}
+    obj_id_int = int(obj_id)
+    conn = get_db()
+    owner = conn.execute("SELECT owner_id FROM objects WHERE id = ?", (obj_id_int,)).fetchone()
+    conn.close()
+    if not session.is_admin and (owner is None or owner[0] != session.user_id):
+        print("Only admin or the object owner can see the access list.")
+        return {"ok": False, "error": "denied"}
+    rows, after = _listing(args, acl_for_object, obj_id_int, ["user_id", "username", "rights"])
+    total = access_counts(object_id=obj_id_int)["users"]
+    print(f"{total} users can access object {obj_id}.")
+    result = {"ok": True, "obj": obj_id_int, "total": total, "next": after}
+    if rows is not None:
+        result["acl"] = [{"user": k, "username": n, "rights": r} for k, n, r in rows]
+    return result
+
+def cmd_access_summary(session, args):
+    if not session.is_admin:
+        print("Only admin can see the access summary.")
+        return {"ok": False, "error": "denied"}
+    summary = access_summary(int((args or {}).get("top") or 10))
+    print(f"{summary['users_with_access']} users have access to {summary['objects_with_access']} objects "
+          f"({summary['access_pairs']} user/object pairs).")
+    print_rows(summary["top_users"], ["user_id", "username", "objects"])
+    print_rows(summary["top_objects"], ["object_id", "name", "users"])
+    return {"ok": True, "summary": summary}
+
+def cmd_show_audit(session, args):
+    limit = (args or {}).get("limit", 20)
+    show_audit(int(limit))
+    return {"ok": True}
+
+def cmd_export_audit(session, args):
+    if not session.is_admin:
+        print("Only admin can export the audit log.")
+        log_event(session.username or "anonymous", "export_audit", "denied", operation="export_audit", actor_id=session.user_id)
+        return {"ok": False, "error": "denied"}
+    path = arg(args, "file", "Export file: ")
+    fmt = arg(args, "format", "Format (csv/jsonl): ") or "jsonl"
+    user = arg(args, "user", "Only records of user (empty for all): ") or None
+    if fmt not in ("csv", "jsonl"):
+        print("Unknown format.")
+        return {"ok": False, "error": "unknown format"}
+    try:
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            count = export_audit(f, fmt, user=user)
+    except OSError as e:
+        print(f"Cannot write {path}: {e}")
+        log_event(session.username, f"export_audit {path}", "fail", operation="export_audit", actor_id=session.user_id)
+        return {"ok": False, "error": str(e)}
+    print(f"Exported {count} audit records to {path}.")
+    log_event(session.username, f"export_audit {path}", "success", operation="export_audit", actor_id=session.user_id)
+    return {"ok": True, "rows": count}
+
+
+def cmd_rotate_audit(session, args):
+    if not session.is_admin:
+        print("Only admin can rotate the audit log.")
+        log_event(session.username or "anonymous", "rotate_audit", "denied", operation="rotate_audit", actor_id=session.user_id)
+        return {"ok": False, "error": "denied"}
+    days = arg(args, "days", "Keep records newer than N days: ")
+    if not days.isdigit():
+        print("Invalid number of days.")
+        return {"ok": False, "error": "invalid days"}
+    count = rotate_audit(max_age_days=int(days))
+    print(f"Archived {count} audit records.")
+    log_event(session.username, f"rotate_audit {days}", "success", operation="rotate_audit", actor_id=session.user_id)
+    return {"ok": True, "rows": count}
+
+def cmd_metrics(session, args):
+    if not session.is_admin:
+        print("Only admin can see metrics.")
+        log_event(session.username or "anonymous", "metrics", "denied", operation="metrics", actor_id=session.user_id)
+        return {"ok": False, "error": "denied"}
+    if not metrics.enabled():
+        print("Metrics are disabled, start with TAKE_GRANT_METRICS=1.")
+        return {"ok": False, "error": "metrics disabled"}
+    path = arg(args, "out", "Prometheus file (empty to print): ")
+    if path:
+        metrics.write_prometheus(path)
+        print(f"Metrics written to {path}.")
+    snapshot = metrics.snapshot()
+    if not path:
+        print_rows([(name, c["count"], c["errors"], c["p50_ms"], c["p99_ms"], c["sql_statements"])
+                    for name, c in sorted(snapshot["calls"].items())],
+                   ["function", "calls", "errors", "p50_ms", "p99_ms", "sql"])
+    log_event(session.username, "metrics", "success", operation="metrics", actor_id=session.user_id)
+    return {"ok": True, "metrics": snapshot}
+
+
+COMMANDS = {
+    "help": cmd_help,
+    "register": cmd_register,
+    "login": cmd_login,
+    "logout": cmd_logout,
+    "whoami": cmd_whoami,
+    "create_obj": cmd_create_obj,
+    "list_obj": cmd_list_obj,
+    "read_obj": cmd_read_obj,
+    "write_obj": cmd_write_obj,
+    "delete_obj": cmd_delete_obj,
+    "grant": cmd_grant,
+    "take": cmd_take,
+    "revoke": cmd_revoke,
+    "list_groups": cmd_list_groups,
+    "group_create": cmd_group_create,
+    "group_delete": cmd_group_delete,
+    "group_add": cmd_group_add,
+    "group_remove": cmd_group_remove,
+    "group_grant": cmd_group_grant,
+    "group_revoke": cmd_group_revoke,
+    "list_users": cmd_list_users,
+    "delete_user": cmd_delete_user,
+    "make_admin": cmd_make_admin,
+    "check": cmd_check,
+    "rights": cmd_rights,
+    "acl": cmd_acl,
+    "access_summary": cmd_access_summary,
+    "show_audit": cmd_show_audit,
+    "export_audit": cmd_export_audit,
+    "rotate_audit": cmd_rotate_audit,
+    "metrics": cmd_metrics,
+}
+
+
+def run_in_group(conn, session, args, isolate=True):
+    """
+    Run one command dict inside a transaction_group() connection, in its own savepoint,
+    so a failing command is rolled back without affecting the rest of the group.
+    With isolate=False there is no savepoint and an exception propagates: the caller
+    rolls back the whole group.
+    """
+    cmd = args.get("cmd")
+    result = {"cmd": cmd}
+    handler = COMMANDS.get(cmd)
+    if handler is None:
+        result.update(ok=False, error="unknown command")
+        return result
+    if not isolate:
+        result.update(handler(session, args))
+        return result
+    try:
+        with savepoint(conn, "group_cmd"):
+            result.update(handler(session, args))
+    except Exception as e:
+        result.update(ok=False, error=str(e))
+    return result
+
+
+def _read_group(lines, lineno, group_size):
+    """
+    Next group_size commands as (lineno, args), args None for a line that is no command,
+    with the error of that line. Returns (commands, lineno, done).
+    """
+    commands = []
+    while len(commands) < group_size:
+        line = next(lines, None)
+        if line is None:
+            return commands, lineno, True
+        lineno += 1
+        line = line.strip()
+        if not line:
             continue
-        
-        if cmd == "list_users":
-            if not current_is_admin:
-                print("Only admin can list users.")
-                log_event(current_username or "anonymous", "list_users", "denied")
-                continue
-            conn = __import__('sqlite3').connect("take_grant.db")
-            cur = conn.cursor()
-            cur.execute("SELECT id, username, is_admin FROM users")
-            rows = cur.fetchall()
-            conn.close()
-            from tabulate import tabulate
-            print(tabulate(rows, headers=["id", "username", "is_admin"], tablefmt="grid"))
-            log_event(current_username, "list_users", "success")
+        try:
+            args = json.loads(line)
+            if not isinstance(args, dict):
+                raise ValueError("command must be a JSON object")
+        except ValueError as e:
+            commands.append((lineno, None, str(e)))
             continue
+        if args.get("cmd") == "exit":
+            return commands, lineno, True
+        commands.append((lineno, args, None))
+    return commands, lineno, False
 
-        if cmd == "delete_user":
-            if not current_is_admin:
-                print("Only admin can delete users.")
-                log_event(current_username or "anonymous", "delete_user", "denied")
-                continue
-            uid = input("Enter user ID to delete: ").strip()
-            if not uid.isdigit():
-                print("Invalid user id.")
-                continue
-            uid = int(uid)
-            conn = __import__('sqlite3').connect("take_grant.db")
-            cur = conn.cursor()
-            # remove rights
-            cur.execute("DELETE FROM rights WHERE subject_id = ?", (uid,))
-            # remove user
-            cur.execute("DELETE FROM users WHERE id = ?", (uid,))
-            conn.commit()
-            conn.close()
-            print(f"User {uid} deleted.")
-            log_event(current_username, f"delete_user {uid}", "success", target_user_id=uid)
-            continue
 
-        if cmd == "make_admin":
-            if not current_is_admin:
-                print("Only admin can grant admin rights.")
-                log_event(current_username or "anonymous", "make_admin", "denied")
-                continue
-            uid = input("Enter user ID to make admin: ").strip()
-            if not uid.isdigit():
-                print("Invalid user id.")
-                continue
-            uid = int(uid)
-            conn = __import__('sqlite3').connect("take_grant.db")
-            cur = conn.cursor()
-            cur.execute("UPDATE users SET is_admin = 1 WHERE id = ?", (uid,))
-            conn.commit()
-            conn.close()
-            print(f"User {uid} is now admin.")
-            log_event(current_username, f"make_admin {uid}", "success", target_user_id=uid)
-            continue
+def _run_group(session, commands, isolate):
+    """Run commands in one transaction group. Returns the results and the handlers' output."""
+    results = []
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output), transaction_group() as conn:
+        for lineno, args, error in commands:
+            if args is None:
+                results.append({"line": lineno, "ok": False, "error": error})
+            else:
+                results.append({"line": lineno, **run_in_group(conn, session, args, isolate)})
+    return results, output.getvalue()
 
-        if cmd == "check":
-            if not current_user_id:
-                print("You must login first.")
-                log_event("anonymous", "check_attempt", "fail")
-                continue
-            obj_id = input("Object ID: ").strip()
-            right = input("Right (read/write): ").strip()
-            if not obj_id.isdigit():
-                print("Invalid object id.")
-                log_event(current_username, "check_invalid_id", "fail")
-                continue
-            ok = check_access(current_user_id, int(obj_id), right)
-            log_event(current_username, f"check {right} on object {obj_id}", "success" if ok else "denied")
-            continue
 
-        if cmd == "show_audit":
-            show_audit()
-            continue
+def run_batch(lines, out, group_size=500):
+    """
+    Run JSON Lines commands through the same handlers as the prompt.
+    Commands share one connection and are committed in groups of group_size.
+    One JSON result per command is written to out once its group is committed, handler
+    messages go to stderr.
+    A group first runs without savepoints (they make every write inside them cost a
+    statement journal write too). If a command raises, the group is rolled back and run
+    again with a savepoint per command, so only the failing command is lost.
+    """
+    session = Session()
+    lines = iter(lines)
+    lineno = 0
+    done = False
+    while not done:
+        commands, lineno, done = _read_group(lines, lineno, group_size)
+        state = dict(vars(session))
+        try:
+            results, output = _run_group(session, commands, isolate=False)
+        except Exception:
+            vars(session).update(state)
+            results, output = _run_group(session, commands, isolate=True)
+        sys.stderr.write(output)
+        for result in results:
+            out.write(json.dumps(result) + "\n")
+        out.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Take-Grant Security System (CLI)")
+    parser.add_argument("--batch", metavar="FILE", help="run JSON Lines commands from FILE ('-' for stdin)")
+    parser.add_argument("--group", type=int, default=500, help="commands per transaction in batch mode")
+    options = parser.parse_args(argv)
+
+    init_db()
+
+    if options.batch:
+        # audit records go into the same grouped transactions
+        configure_audit(mode="sync")
+        if options.batch == "-":
+            run_batch(sys.stdin, sys.stdout, options.group)
+        else:
+            with open(options.batch, encoding="utf-8") as f:
+                run_batch(f, sys.stdout, options.group)
+        return
+
+    session = Session()
+
+    print("Take-Grant Security System (CLI). Type 'help' to list commands.")
+
+    while True:
+        prompt = f"{session.username}> " if session.username else "> "
+        cmd = input(prompt).strip()
 
         if cmd == "exit":
             print("Exiting system.")
             break
 
-        print("Unknown command. Type 'help' to list commands.")
+        handler = COMMANDS.get(cmd)
+        if handler is None:
+            print("Unknown command. Type 'help' to list commands.")
+            continue
+        handler(session, None)
 
 if __name__ == "__main__":
     main()
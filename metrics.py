@@ -0,0 +1,299 @@
+# metrics.py
+"""
+Lightweight instrumentation of the rights, objects, auth and audit functions:
+call counts, errors and latency histograms per function, timed sections (bcrypt,
+waiting for a pooled connection, audit writes) and SQL statement counts and timings.
+
+Off by default. TAKE_GRANT_METRICS=1 or enable() turns it on; TAKE_GRANT_METRICS_FILE=path
+also writes the Prometheus text file at exit. While disabled an instrumented function
+costs one extra call and a flag check, and connections get no trace callback.
+
+  snapshot()              - dict of everything recorded so far
+  prometheus_text()       - the same in the Prometheus text exposition format
+  write_prometheus(path)  - prometheus_text() written atomically, for a node exporter textfile
+"""
+import atexit
+import bisect
+import functools
+import inspect
+import os
+import sqlite3
+import threading
+import time
+from contextlib import nullcontext
+
+# Histogram bucket upper bounds, seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+PREFIX = "take_grant"
+
+_enabled = os.environ.get("TAKE_GRANT_METRICS", "") not in ("", "0")
+_lock = threading.Lock()
+_local = threading.local()
+_calls = {}     # function -> Histogram
+_sections = {}  # section -> Histogram
+_sql = {}       # statement kind -> Histogram (timed through metrics cursors)
+_sql_counts = {}  # statement kind -> count (trace callback, includes implicit BEGIN/COMMIT)
+
+
+class Histogram:
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.errors = 0
+        self.sql_statements = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def cumulative(self):
+        total, out = 0, []
+        for bound, n in zip(BUCKETS + (float("inf"),), self.counts):
+            total += n
+            out.append((bound, total))
+        return out
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (None without observations)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return bound if bound != float("inf") else self.max
+        return self.max
+
+
+def enabled():
+    return _enabled
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def reset():
+    with _lock:
+        for table in (_calls, _sections, _sql, _sql_counts):
+            table.clear()
+
+
+def _histogram(table, name):
+    h = table.get(name)
+    if h is None:
+        h = table.setdefault(name, Histogram())
+    return h
+
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def _record(name, started, failed, statements):
+    elapsed = time.perf_counter() - started
+    with _lock:
+        h = _histogram(_calls, name)
+        h.observe(elapsed)
+        h.sql_statements += statements
+        if failed:
+            h.errors += 1
+
+
+def instrument(func):
+    """Decorator: count calls, errors, latency and SQL statements of func (generators: the whole iteration)."""
+    name = f"{func.__module__}.{func.__qualname__}"
+
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def generator_wrapper(*args, **kwargs):
+            if not _enabled:
+                return (yield from func(*args, **kwargs))
+            gen = func(*args, **kwargs)
+            frame = [0]
+            started = time.perf_counter()
+            failed = True
+            try:
+                while True:
+                    # only the generator's own steps count, not the caller's work between items
+                    _stack().append(frame)
+                    try:
+                        item = next(gen)
+                    except StopIteration as stop:
+                        failed = False
+                        return stop.value
+                    finally:
+                        _stack().pop()
+                    yield item
+            finally:
+                gen.close()
+                _record(name, started, failed, frame[0])
+        return generator_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+        stack = _stack()
+        frame = [0]  # SQL statements run by this call, including nested calls
+        stack.append(frame)
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = func(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            stack.pop()
+            _record(name, started, failed, frame[0])
+    return wrapper
+
+
+class _Timer:
+
+    def __init__(self, section):
+        self.section = section
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started
+        with _lock:
+            _histogram(_sections, self.section).observe(elapsed)
+        return False
+
+
+_NOT_TIMED = nullcontext()
+
+
+def timed(section):
+    """Context manager timing a block of code under the given section name."""
+    return _Timer(section) if _enabled else _NOT_TIMED
+
+
+# --- SQL ---
+
+def _kind(sql):
+    words = sql.lstrip().split(None, 1)
+    return words[0].upper() if words else ""
+
+
+def _trace(sql):
+    kind = _kind(sql)
+    with _lock:
+        _sql_counts[kind] = _sql_counts.get(kind, 0) + 1
+    for frame in getattr(_local, "stack", ()):
+        frame[0] += 1
+
+
+def watch_connection(conn):
+    """Install or remove the statement trace callback of a raw sqlite3 connection."""
+    conn.set_trace_callback(_trace if _enabled else None)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that records execute()/executemany() time per statement kind."""
+
+    def _timed(self, method, sql, params):
+        started = time.perf_counter()
+        try:
+            return method(self, sql, params)
+        finally:
+            elapsed = time.perf_counter() - started
+            with _lock:
+                _histogram(_sql, _kind(sql)).observe(elapsed)
+
+    def execute(self, sql, params=()):
+        return self._timed(sqlite3.Cursor.execute, sql, params)
+
+    def executemany(self, sql, params):
+        return self._timed(sqlite3.Cursor.executemany, sql, params)
+
+
+# --- Export ---
+
+def _summary(h):
+    return {
+        "count": h.count,
+        "errors": h.errors,
+        "sum_seconds": h.sum,
+        "max_ms": h.max * 1000,
+        "p50_ms": None if not h.count else h.quantile(0.5) * 1000,
+        "p99_ms": None if not h.count else h.quantile(0.99) * 1000,
+    }
+
+
+def snapshot():
+    with _lock:
+        calls = {name: dict(_summary(h), sql_statements=h.sql_statements) for name, h in _calls.items()}
+        sections = {name: _summary(h) for name, h in _sections.items()}
+        sql = {}
+        for kind in set(_sql) | set(_sql_counts):
+            sql[kind] = _summary(_sql[kind]) if kind in _sql else {}
+            sql[kind]["statements"] = _sql_counts.get(kind, 0)
+    return {"enabled": _enabled, "calls": calls, "sections": sections, "sql": sql}
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _histogram_lines(metric, label, table):
+    lines = [f"# TYPE {metric} histogram"]
+    for name, h in sorted(table.items()):
+        labels = f'{label}="{_label(name)}"'
+        for bound, total in h.cumulative():
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{metric}_bucket{{{labels},le="{le}"}} {total}')
+        lines.append(f"{metric}_sum{{{labels}}} {h.sum!r}")
+        lines.append(f"{metric}_count{{{labels}}} {h.count}")
+    return lines
+
+
+def prometheus_text():
+    with _lock:
+        lines = _histogram_lines(f"{PREFIX}_call_seconds", "function", _calls)
+        lines.append(f"# TYPE {PREFIX}_call_errors_total counter")
+        lines += [f'{PREFIX}_call_errors_total{{function="{_label(n)}"}} {h.errors}' for n, h in sorted(_calls.items())]
+        lines.append(f"# TYPE {PREFIX}_call_sql_statements_total counter")
+        lines += [f'{PREFIX}_call_sql_statements_total{{function="{_label(n)}"}} {h.sql_statements}'
+                  for n, h in sorted(_calls.items())]
+        lines += _histogram_lines(f"{PREFIX}_section_seconds", "section", _sections)
+        lines += _histogram_lines(f"{PREFIX}_sql_seconds", "statement", _sql)
+        lines.append(f"# TYPE {PREFIX}_sql_statements_total counter")
+        lines += [f'{PREFIX}_sql_statements_total{{statement="{_label(k)}"}} {n}' for k, n in sorted(_sql_counts.items())]
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(prometheus_text())
+    os.replace(tmp, path)
+
+
+def _write_at_exit():
+    path = os.environ.get("TAKE_GRANT_METRICS_FILE")
+    if path and (_calls or _sql_counts):
+        write_prometheus(path)
+
+
+if os.environ.get("TAKE_GRANT_METRICS_FILE"):
+    _enabled = True
+atexit.register(_write_at_exit)
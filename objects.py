@@ -1,5 +1,11 @@
 ﻿from db import get_db
+from audit import log_event
+from graph import on_right_added, on_object_deleted
+from metrics import instrument
+import contentstore
+import rightstore
 
+@instrument
 def create_object(name, content, owner_id):
     conn = get_db()
     cursor = conn.cursor()
@@ -10,23 +16,23 @@ def create_object(name, content, owner_id):
         conn.close()
         return False
 
-    cursor.execute("INSERT INTO objects (name, content, owner_id) VALUES (?, ?, ?)", (name, content, owner_id))
+    cursor.execute("INSERT INTO objects (name, owner_id) VALUES (?, ?)", (name, owner_id))
     obj_id = cursor.lastrowid
+    contentstore.write_content(cursor, obj_id, content, new=True)
 
     rights = ['read', 'write', 'take']
-    for r in rights:
-        cursor.execute("SELECT * FROM rights WHERE subject_id = ? AND object_id = ? AND right_type = ?",
-                       (owner_id, obj_id, r))
-        if cursor.fetchone() is None:
-            cursor.execute("INSERT INTO rights (subject_id, object_id, right_type) VALUES (?, ?, ?)",
-                           (owner_id, obj_id, r))
+    rightstore.add_rights(cursor, [(owner_id, obj_id, r) for r in rights])
+    rightstore.record_provenance(cursor, [(owner_id, obj_id, r, None, "create") for r in rights])
 
     conn.commit()
     conn.close()
+    for r in rights:
+        on_right_added(owner_id, obj_id, r)
     print(f"Object '{name}' (id={obj_id}) created successfully with owner rights!")
     return True
 
 
+@instrument
 def list_objects():
     conn = get_db()
     cursor = conn.cursor()
@@ -44,22 +50,28 @@ def list_objects():
         print(f"ID: {obj[0]} | Name: {obj[1]} | Owner ID: {obj[2]}")
 
 
-def read_object(object_id):
+@instrument
+def read_object(object_id, offset=0, length=None):
+    """Print the object content (or the byte range offset..offset+length). Returns the object name or None."""
     conn = get_db()
     cursor = conn.cursor()
 
-    cursor.execute("SELECT name, content, owner_id FROM objects WHERE id = ?", (object_id,))
+    cursor.execute("SELECT name, owner_id FROM objects WHERE id = ?", (object_id,))
     row = cursor.fetchone()
+    content = contentstore.read_content(cursor, object_id, offset, length) if row else None
     conn.close()
 
     if row:
-        print(f"\nObject: {row[0]} (owner_id={row[2]})")
-        print(f"Content: {row[1]}")
-    else:
-        print("Object not found!")
+        print(f"\nObject: {row[0]} (owner_id={row[1]})")
+        print(f"Content: {content.decode(contentstore.ENCODING, errors='replace')}")
+        return row[0]
+    print("Object not found!")
+    return None
 
 
+@instrument
 def write_object(object_id, new_content):
+    """new_content is a str, bytes or a binary file object (read in chunks)."""
     conn = get_db()
     cursor = conn.cursor()
 
@@ -69,13 +81,22 @@ def write_object(object_id, new_content):
         print("Object not found!")
         return False
 
-    cursor.execute("UPDATE objects SET content = ? WHERE id = ?", (new_content, object_id))
+    contentstore.write_content(cursor, object_id, new_content)
     conn.commit()
     conn.close()
     print(f"Object id={object_id} updated successfully.")
     return True
 
 
+def _delete(cursor, object_id):
+    # Delete rights related to the object
+    rightstore.delete_object_rights(cursor, object_id)
+    contentstore.delete_content(cursor, object_id)
+    # Delete the object
+    cursor.execute("DELETE FROM objects WHERE id = ?", (object_id,))
+
+
+@instrument
 def delete_object(object_id):
     conn = get_db()
     cursor = conn.cursor()
@@ -86,12 +107,85 @@ def delete_object(object_id):
         print("Object not found!")
         return False
 
-    # Delete rights related to the object
-    cursor.execute("DELETE FROM rights WHERE object_id = ?", (object_id,))
-    # Delete the object
-    cursor.execute("DELETE FROM objects WHERE id = ?", (object_id,))
+    _delete(cursor, object_id)
 
     conn.commit()
     conn.close()
+    on_object_deleted(object_id)
     print(f"Object id={object_id} and related rights deleted.")
     return True
+
+
+# --- Permission-checked operations ---
+# The access check, the operation and the audit record use one connection and one
+# transaction. Nothing is printed; the result is a dict:
+#   {"ok": True, "name": ..., ...} or {"ok": False, "error": "denied" | "not found"}
+
+def _checked(object_id, user_id, username, right_type, operation, verb, apply):
+    """Run apply(cursor) -> (name or None, extra result fields) if user_id holds right_type."""
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        if operation != "read" and not conn.in_transaction:
+            # check and change under the same write lock
+            cursor.execute("BEGIN IMMEDIATE")
+        # read through the cursor, never from the graph or the decision cache: either may
+        # still hold a right another connection revoked before we took the lock
+        if not user_id or not rightstore.has_effective_right(cursor, user_id, object_id, right_type):
+            result, name, outcome = {"ok": False, "error": "denied"}, None, "denied"
+        else:
+            name, extra = apply(cursor)
+            if name is None:
+                result, outcome = {"ok": False, "error": "not found"}, "fail"
+            else:
+                result, outcome = {"ok": True, "name": name, **extra}, "success"
+        log_event(username or "anonymous", f"{verb} object {object_id}", outcome, object_name=name,
+                  operation=operation, object_id=object_id, actor_id=user_id, cursor=cursor)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return result
+
+
+@instrument
+def read_object_checked(user_id, object_id, username=None, offset=0, length=None):
+    """Read content (bytes, optionally a range) if the user holds 'read'. Adds name, owner_id, size, content."""
+    def apply(cursor):
+        cursor.execute("SELECT name, owner_id, size FROM objects WHERE id = ?", (object_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None, {}
+        content = contentstore.read_content(cursor, object_id, offset, length)
+        return row[0], {"owner_id": row[1], "size": row[2], "content": content}
+    return _checked(object_id, user_id, username, "read", "read", "read", apply)
+
+
+@instrument
+def write_object_checked(user_id, object_id, new_content, username=None):
+    """Replace the content if the user holds 'write'. Adds the new size."""
+    def apply(cursor):
+        cursor.execute("SELECT name FROM objects WHERE id = ?", (object_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None, {}
+        return row[0], {"size": contentstore.write_content(cursor, object_id, new_content)}
+    return _checked(object_id, user_id, username, "write", "write", "write", apply)
+
+
+@instrument
+def delete_object_checked(user_id, object_id, username=None):
+    """Delete the object, its content and its rights if the user holds 'write'."""
+    def apply(cursor):
+        cursor.execute("SELECT name FROM objects WHERE id = ?", (object_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None, {}
+        _delete(cursor, object_id)
+        return row[0], {}
+    result = _checked(object_id, user_id, username, "write", "delete_object", "delete", apply)
+    if result["ok"]:
+        on_object_deleted(object_id)
+    return result
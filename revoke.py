@@ -0,0 +1,198 @@
+# revoke.py
+"""
+Revocation engine: everything that has to change when a user is deleted (or a right is
+revoked), computed first and then applied set-based in one transaction.
+
+  owned objects  - deleted with their content and all rights on them (owned="delete"),
+                   or kept without an owner (owned="keep")
+  own rights     - every right the user holds
+  derived rights - with transitive=True, rights other users got from the user through
+                   grant or take, and rights derived from those in turn. A derived right
+                   survives if it also came from a holder outside the revoked set or has
+                   no source at all (the owner's rights). Group rights granted from a
+                   revoked right go the same way; they are never passed on further.
+
+Derivations are the right_provenance rows (see rightstore.py); the affected subtree is
+found with one recursive query over the derivation index, so only rights reachable from
+the revoked ones are looked at. group_provenance is looked up once for the whole subtree.
+"""
+from collections import defaultdict
+
+import contentstore
+import rightstore
+from db import get_db
+from graph import on_group_changed, on_object_deleted, on_right_removed, on_user_deleted
+
+OWNED_POLICIES = ("delete", "keep")
+
+_SUBTREE_SQL = """
+    WITH RECURSIVE subtree(subject_id, object_id, right_type) AS (
+        SELECT subject_id, object_id, right_type FROM temp.revoke_seeds
+        UNION
+        SELECT p.subject_id, p.object_id, p.right_type
+        FROM right_provenance p JOIN subtree s
+          ON p.source_id = s.subject_id AND p.object_id = s.object_id AND p.right_type = s.right_type
+    )
+    SELECT p.subject_id, p.object_id, p.right_type, p.source_id
+    FROM subtree s JOIN right_provenance p
+      ON p.subject_id = s.subject_id AND p.object_id = s.object_id AND p.right_type = s.right_type
+"""
+
+_GROUP_SQL = """
+    SELECT p.group_id, p.object_id, p.right_type, p.source_id
+    FROM (
+        SELECT DISTINCT d.group_id, d.object_id, d.right_type
+        FROM temp.revoke_seeds s JOIN group_provenance d
+          ON d.source_id = s.subject_id AND d.object_id = s.object_id AND d.right_type = s.right_type
+    ) c JOIN group_provenance p
+      ON p.group_id = c.group_id AND p.object_id = c.object_id AND p.right_type = c.right_type
+"""
+
+
+def _sources(cursor, seeds, sql):
+    """{right: set of source ids} of the rows sql returns for the seed rights."""
+    rightstore.flush_pending()
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS revoke_seeds (subject_id INTEGER, object_id INTEGER, right_type TEXT)")
+    cursor.execute("DELETE FROM temp.revoke_seeds")
+    cursor.executemany("INSERT INTO temp.revoke_seeds VALUES (?, ?, ?)", seeds)
+    cursor.execute(sql)
+    sources = defaultdict(set)
+    for key, object_id, right_type, source_id in cursor.fetchall():
+        sources[(key, object_id, right_type)].add(source_id)
+    cursor.execute("DELETE FROM temp.revoke_seeds")
+    return sources
+
+
+def derived_rights(cursor, seeds):
+    """
+    Rights that have to go together with the seed rights (see the module docstring),
+    as a set of (subject_id, object_id, right_type), not including the seeds.
+    """
+    seeds = set(seeds)
+    if not seeds:
+        return set()
+    sources = _sources(cursor, seeds, _SUBTREE_SQL)
+
+    revoked = set(sources) - seeds
+    held = {}
+
+    def supports(source_id, right):
+        if source_id is None:
+            return True
+        support = (source_id, right[1], right[2])
+        if support in seeds or support in revoked:
+            return False
+        if support not in held:
+            held[support] = rightstore.has_right(cursor, *support)
+        return held[support]
+
+    # keep rights that also have support from outside the revoked set
+    changed = True
+    while changed:
+        changed = False
+        for right in list(revoked):
+            if any(supports(source_id, right) for source_id in sources[right]):
+                revoked.discard(right)
+                changed = True
+    return revoked
+
+
+def derived_group_rights(cursor, revoked):
+    """
+    Group rights that have to go with the revoked (subject_id, object_id, right_type) rights:
+    granted from one of them and not also from a right that stays or without a source.
+    Returns a set of (group_id, object_id, right_type).
+    """
+    revoked = set(revoked)
+    if not revoked:
+        return set()
+    held = {}
+
+    def supports(source_id, object_id, right_type):
+        if source_id is None:
+            return True
+        support = (source_id, object_id, right_type)
+        if support in revoked:
+            return False
+        if support not in held:
+            held[support] = rightstore.has_right(cursor, *support)
+        return held[support]
+
+    return {right for right, sources in _sources(cursor, revoked, _GROUP_SQL).items()
+            if not any(supports(source_id, right[1], right[2]) for source_id in sources)}
+
+
+def plan_user_deletion(cursor, user_id, owned="delete", transitive=False):
+    """Compute what delete_user_cascade() would change, without changing anything."""
+    if owned not in OWNED_POLICIES:
+        raise ValueError(f"Unknown owned objects policy: {owned}")
+    cursor.execute("SELECT 1 FROM users WHERE id = ?", (user_id,))
+    exists = cursor.fetchone() is not None
+    cursor.execute("SELECT id FROM objects WHERE owner_id = ?", (user_id,))
+    owned_objects = [row[0] for row in cursor.fetchall()]
+    own_rights = set(rightstore.iter_subject_rights(cursor, user_id))
+
+    derived = set()
+    derived_groups = set()
+    if transitive:
+        derived = derived_rights(cursor, own_rights)
+        derived_groups = derived_group_rights(cursor, own_rights | derived)
+        if owned == "delete":
+            # rights on deleted objects go with the objects
+            gone = set(owned_objects)
+            derived = {r for r in derived if r[1] not in gone}
+            derived_groups = {r for r in derived_groups if r[1] not in gone}
+    return {
+        "user_id": user_id,
+        "user_exists": exists,
+        "owned": owned,
+        "objects": owned_objects,
+        "own_rights": sorted(own_rights),
+        "derived_rights": sorted(derived),
+        "derived_group_rights": sorted(derived_groups),
+    }
+
+
+def delete_user_cascade(user_id, owned="delete", transitive=False, dry_run=False):
+    """
+    Delete a user with everything that depends on it, in one transaction.
+    Returns the plan (see plan_user_deletion) with "deleted": True/False.
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        if not conn.in_transaction:
+            cursor.execute("BEGIN IMMEDIATE")
+        plan = plan_user_deletion(cursor, user_id, owned, transitive)
+        if dry_run or not plan["user_exists"]:
+            conn.rollback()
+            plan["deleted"] = False
+            return plan
+
+        if owned == "delete":
+            contentstore.delete_owned_content(cursor, user_id)
+            rightstore.delete_owned_object_rights(cursor, user_id)
+            cursor.execute("DELETE FROM objects WHERE owner_id = ?", (user_id,))
+        else:
+            cursor.execute("UPDATE objects SET owner_id = NULL WHERE owner_id = ?", (user_id,))
+        rightstore.delete_user_memberships(cursor, user_id)
+        rightstore.delete_subject_rights(cursor, user_id)
+        rightstore.remove_rights(cursor, plan["derived_rights"])
+        rightstore.remove_group_rights(cursor, plan["derived_group_rights"])
+        cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    if owned == "delete":
+        for object_id in plan["objects"]:
+            on_object_deleted(object_id)
+    for right in plan["derived_rights"]:
+        on_right_removed(*right)
+    on_group_changed(object_ids={r[1] for r in plan["derived_group_rights"]})
+    on_user_deleted(user_id)
+    plan["deleted"] = True
+    return plan
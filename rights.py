@@ -1,82 +1,155 @@
-﻿from db import get_db
+﻿from db import chunks, get_db, in_group
+from audit import log_events
+from cache import decision_cache
+from graph import get_graph, on_group_changed, on_right_added, on_right_removed
+from metrics import instrument
+from revoke import derived_group_rights, derived_rights
+import rightstore
 
 # Grant right from one user to another
+@instrument
 def grant_right(from_user_id, to_user_id, object_id, right_type):
     conn = get_db()
     cursor = conn.cursor()
 
     # Check if from_user actually has this right
-    cursor.execute("SELECT * FROM rights WHERE subject_id=? AND object_id=? AND right_type=?", 
-                   (from_user_id, object_id, right_type))
-    if cursor.fetchone() is None:
+    if not rightstore.has_right(cursor, from_user_id, object_id, right_type):
         print("You cannot grant a right you don't have.")
         conn.close()
         return False
 
-    # Avoid duplicate right
-    cursor.execute("SELECT * FROM rights WHERE subject_id=? AND object_id=? AND right_type=?", 
-                   (to_user_id, object_id, right_type))
-    if cursor.fetchone():
-        print("Target already has this right.")
+    # Avoid duplicate right, but remember the grant as another source of it
+    if rightstore.has_right(cursor, to_user_id, object_id, right_type):
+        rightstore.record_provenance(cursor, [(to_user_id, object_id, right_type, from_user_id, "grant")])
+        conn.commit()
         conn.close()
+        print("Target already has this right.")
         return True
 
     # Add right to target user
-    cursor.execute("INSERT INTO rights (subject_id, object_id, right_type) VALUES (?, ?, ?)", 
-                   (to_user_id, object_id, right_type))
+    rightstore.add_right(cursor, to_user_id, object_id, right_type)
+    rightstore.record_provenance(cursor, [(to_user_id, object_id, right_type, from_user_id, "grant")])
     conn.commit()
     conn.close()
+    on_right_added(to_user_id, object_id, right_type)
     print(f"Granted '{right_type}' on object {object_id} to user {to_user_id}")
     return True
 
 
 # Take right from another user (requires 'take' right for the taker on that object)
+@instrument
 def take_right(taker_user_id, target_user_id, object_id, right_type):
     conn = get_db()
     cursor = conn.cursor()
 
     # Check if taker has TAKE permission on that object
-    cursor.execute("SELECT * FROM rights WHERE subject_id=? AND object_id=? AND right_type='take'", 
-                   (taker_user_id, object_id))
-    if cursor.fetchone() is None:
+    if not rightstore.has_right(cursor, taker_user_id, object_id, "take"):
         print("You don't have TAKE rights on this object.")
         conn.close()
         return False
 
     # Check if target_user actually has the right
-    cursor.execute("SELECT * FROM rights WHERE subject_id=? AND object_id=? AND right_type=?", 
-                   (target_user_id, object_id, right_type))
-    if cursor.fetchone() is None:
+    if not rightstore.has_right(cursor, target_user_id, object_id, right_type):
         print("Target user doesn't have this right.")
         conn.close()
         return False
 
-    # Avoid duplicate
-    cursor.execute("SELECT * FROM rights WHERE subject_id=? AND object_id=? AND right_type=?", 
-                   (taker_user_id, object_id, right_type))
-    if cursor.fetchone():
-        print("You already have this right.")
+    # Avoid duplicate, but remember the take as another source of the right
+    if rightstore.has_right(cursor, taker_user_id, object_id, right_type):
+        rightstore.record_provenance(cursor, [(taker_user_id, object_id, right_type, target_user_id, "take")])
+        conn.commit()
         conn.close()
+        print("You already have this right.")
         return True
 
     # Assign right to taker
-    cursor.execute("INSERT INTO rights (subject_id, object_id, right_type) VALUES (?, ?, ?)", 
-                   (taker_user_id, object_id, right_type))
+    rightstore.add_right(cursor, taker_user_id, object_id, right_type)
+    rightstore.record_provenance(cursor, [(taker_user_id, object_id, right_type, target_user_id, "take")])
     conn.commit()
     conn.close()
+    on_right_added(taker_user_id, object_id, right_type)
     print(f"Took '{right_type}' on object {object_id} from user {target_user_id}")
     return True
 
 
-# Check if user has a specific right
-def check_access(user_id, object_id, right_type):
+# Revoke a right, and with cascade=True every right derived from it that has no other source
+@instrument
+def revoke_right(subject_id, object_id, right_type, cascade=False):
+    """
+    Returns the list of removed (subject_id, object_id, right_type), empty if the right was
+    not held. With cascade=True group rights granted from the removed rights go as well.
+    """
     conn = get_db()
     cursor = conn.cursor()
+    try:
+        if not conn.in_transaction:
+            cursor.execute("BEGIN IMMEDIATE")
+        seed = (subject_id, object_id, right_type)
+        if not rightstore.has_right(cursor, *seed):
+            conn.rollback()
+            print("User doesn't have this right.")
+            return []
+        removed = [seed]
+        groups = []
+        if cascade:
+            removed += sorted(derived_rights(cursor, [seed]))
+            groups = sorted(derived_group_rights(cursor, removed))
+        rightstore.remove_rights(cursor, removed)
+        rightstore.remove_group_rights(cursor, groups)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
 
-    cursor.execute("SELECT * FROM rights WHERE subject_id=? AND object_id=? AND right_type=?", 
-                   (user_id, object_id, right_type))
-    result = cursor.fetchone()
-    conn.close()
+    for right in removed:
+        on_right_removed(*right)
+    on_group_changed(object_ids={r[1] for r in groups})
+    print(f"Revoked '{right_type}' on object {object_id} from user {subject_id}"
+          + (f" and {len(removed) - 1} derived rights" if cascade else "")
+          + (f" and {len(groups)} group rights" if groups else ""))
+    return removed
+
+
+# Check if user has a specific right, without printing anything
+@instrument
+def has_access(user_id, object_id, right_type, cursor=None):
+    """
+    Quiet access check: direct rights and rights through groups. A given cursor is used
+    instead of a new connection.
+    """
+    if in_group():
+        # the group's uncommitted changes are in neither the graph nor the cache yet
+        conn = get_db()
+        result = rightstore.has_effective_right(cursor or conn.cursor(), user_id, object_id, right_type)
+        conn.close()
+        return result
+
+    graph = get_graph()
+    if graph is not None and graph.refresh().has_right(user_id, object_id, right_type):
+        # Direct rights are answered from the in-memory graph once it is loaded
+        return True
+
+    result = decision_cache.get(user_id, object_id, right_type)
+    if result is not None:
+        return result
+
+    if cursor is not None:
+        result = rightstore.has_effective_right(cursor, user_id, object_id, right_type)
+    else:
+        conn = get_db()
+        result = rightstore.has_effective_right(conn.cursor(), user_id, object_id, right_type)
+        conn.close()
+
+    decision_cache.put(user_id, object_id, right_type, result)
+    return result
+
+
+# Check if user has a specific right
+@instrument
+def check_access(user_id, object_id, right_type):
+    result = has_access(user_id, object_id, right_type)
 
     if result:
         print(f"Access granted: user {user_id} can '{right_type}' object {object_id}")
@@ -84,3 +157,114 @@ def check_access(user_id, object_id, right_type):
     else:
         print(f"Access denied: user {user_id} cannot '{right_type}' object {object_id}")
         return False
+
+
+# --- Bulk operations ---
+
+def _names(cursor, table, column, ids):
+    names = {}
+    for chunk in chunks(ids):
+        marks = ",".join("?" * len(chunk))
+        cursor.execute(f"SELECT id, {column} FROM {table} WHERE id IN ({marks})", chunk)
+        names.update(cursor.fetchall())
+    return names
+
+
+def _apply_bulk(items, validate, describe, derive):
+    """
+    Shared driver for grant_rights_bulk/take_rights_bulk.
+    validate(held, item) -> (ok, message, new_right or None)
+    describe(item) -> (actor_id, audit action, target_user_id, operation, source_user_id)
+    derive(item) -> (holder_id, source_id) of the right, for its provenance
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        # Take the write lock first so the snapshot can't change under us
+        if not conn.in_transaction:
+            cursor.execute("BEGIN IMMEDIATE")
+        held = set(rightstore.iter_rights(cursor, {item[2] for item in items}))
+        usernames = _names(cursor, "users", "username", {item[0] for item in items})
+        object_names = _names(cursor, "objects", "name", {item[2] for item in items})
+
+        results, new_rights, events, provenance = [], [], [], []
+        for item in items:
+            ok, message, new_right = validate(held, item)
+            if new_right is not None:
+                # later items in the batch see rights added by earlier ones
+                held.add(new_right)
+                new_rights.append(new_right)
+            results.append((ok, message))
+            actor_id, action, target_user_id, operation, source_user_id = describe(item)
+            if ok:
+                holder_id, source_id = derive(item)
+                provenance.append((holder_id, item[2], item[3], source_id, operation))
+            events.append((usernames.get(actor_id, "anonymous"), action, "success" if ok else "fail",
+                           target_user_id, object_names.get(item[2]),
+                           operation, item[3], item[2], actor_id, source_user_id))
+
+        rightstore.add_rights(cursor, new_rights)
+        rightstore.record_provenance(cursor, provenance)
+        log_events(cursor, events)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    for subject_id, object_id, right_type in new_rights:
+        on_right_added(subject_id, object_id, right_type)
+    return results
+
+
+def _validate_grant(held, item):
+    from_user_id, to_user_id, object_id, right_type = item
+    if (from_user_id, object_id, right_type) not in held:
+        return False, "You cannot grant a right you don't have.", None
+    if (to_user_id, object_id, right_type) in held:
+        return True, "Target already has this right.", None
+    return True, f"Granted '{right_type}' on object {object_id} to user {to_user_id}", (to_user_id, object_id, right_type)
+
+
+def _validate_take(held, item):
+    taker_user_id, target_user_id, object_id, right_type = item
+    if (taker_user_id, object_id, "take") not in held:
+        return False, "You don't have TAKE rights on this object.", None
+    if (target_user_id, object_id, right_type) not in held:
+        return False, "Target user doesn't have this right.", None
+    if (taker_user_id, object_id, right_type) in held:
+        return True, "You already have this right.", None
+    return True, f"Took '{right_type}' on object {object_id} from user {target_user_id}", (taker_user_id, object_id, right_type)
+
+
+@instrument
+def grant_rights_bulk(items):
+    """
+    Apply many grants in one transaction.
+    items: iterable of (from_user_id, to_user_id, object_id, right_type)
+    Every item is validated against one snapshot of the rights table (plus the grants
+    accepted earlier in the same batch). Audit records are written in the same transaction.
+    Returns a list of (ok, message), one per item, with grant_right's meaning of ok.
+    """
+    return _apply_bulk(items, _validate_grant,
+                       lambda item: (item[0], f"grant {item[3]} obj {item[2]} to user {item[1]}", item[1],
+                                     "grant", None),
+                       lambda item: (item[1], item[0]))
+
+
+@instrument
+def take_rights_bulk(items):
+    """
+    Apply many takes in one transaction.
+    items: iterable of (taker_user_id, target_user_id, object_id, right_type)
+    Returns a list of (ok, message), one per item, with take_right's meaning of ok.
+    """
+    return _apply_bulk(items, _validate_take,
+                       lambda item: (item[0], f"take {item[3]} obj {item[2]} from user {item[1]}", item[1],
+                                     "take", item[1]),
+                       lambda item: (item[0], item[1]))
@@ -0,0 +1,667 @@
+# rightstore.py
+"""
+Storage of rights, in one of two layouts:
+  rows    - one row per (subject_id, object_id, right_type) in the rights table (default)
+  bitmask - one row per (subject_id, object_id) in rights_mask with an integer mask;
+            bits are assigned in the right_types table, so new right types need no schema change
+The layout in use is recorded in the settings table. All functions take the caller's
+cursor and run inside the caller's transaction.
+
+Where every right came from is kept in right_provenance, one row per derivation:
+(subject_id, object_id, right_type, source_id, operation, created_at), with source_id
+NULL for rights that have no source (the owner's rights of a new object). Removing a
+right removes its own provenance rows; see revoke.py for the cascading revocation.
+
+Groups are subjects as well: group_members lists who is in a group and group_rights holds
+(group_id, object_id, mask) with the bits of right_types. effective_rights (user_id,
+object_id, mask) is what a user can do, its direct rights and the rights of all its groups
+together, so an access check is one primary key lookup. Every function here keeps it up to
+date for the (user, object) pairs it touches: additions are OR-ed in, removals recompute
+just those pairs. group_provenance records where group rights came from, like
+right_provenance does for direct rights.
+
+Every transaction that changes direct rights also increments the rights_generation
+setting, so an in-memory copy of the rights (graph.py) can tell that another process
+changed them. Increments committed by this process are counted in local_writes().
+
+Inside a transaction_group() the new provenance rows, the effective_rights additions and
+the rights_generation increment are not written one command at a time: they are queued
+with db.before_commit() and written together just before the group commits.
+flush_pending() writes them earlier; every function here that reads or removes
+provenance or effective rights calls it first.
+"""
+import sys
+import threading
+
+from db import after_commit, before_commit, chunks, get_db, in_group, run_before_commit
+
+ROWS = "rows"
+BITMASK = "bitmask"
+
+_modes = {}  # raw connection -> (PRAGMA data_version, layout)
+_bits = {}
+_local_writes = 0
+_local_lock = threading.Lock()
+
+
+def reset_cache():
+    """Forget the cached layout and right bits (after a migration or a new database file)."""
+    _modes.clear()
+    _bits.clear()
+
+
+def storage_mode(cursor):
+    """
+    Layout in use. Cached per connection until its PRAGMA data_version changes, i.e. until
+    another connection (of this or another process) commits, which may have converted it.
+    """
+    conn = cursor.connection
+    version = conn.execute("PRAGMA data_version").fetchone()[0]
+    cached = _modes.get(conn)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    row = conn.execute("SELECT value FROM settings WHERE key = 'rights_storage'").fetchone()
+    mode = row[0] if row else ROWS
+    if len(_modes) > 64:
+        # connections closed by the pool
+        _modes.clear()
+    _modes[conn] = (version, mode)
+    return mode
+
+
+def right_bit(cursor, right_type, create=False):
+    """
+    Bit of a right type in bitmask mode, 0 if unknown and create is False. A bit is only
+    cached once the transaction that read (or created) it commits.
+    """
+    bit = _bits.get(right_type)
+    if bit is not None:
+        return bit
+    cursor.execute("SELECT bit FROM right_types WHERE name = ?", (right_type,))
+    row = cursor.fetchone()
+    if row is None:
+        if not create:
+            return 0
+        cursor.execute("SELECT COALESCE(MAX(bit), 0) FROM right_types")
+        bit = max(cursor.fetchone()[0] * 2, 1)
+        cursor.execute("INSERT INTO right_types (name, bit) VALUES (?, ?)", (right_type, bit))
+    else:
+        bit = row[0]
+    after_commit(_cache_bit, right_type, bit, conn=cursor.connection)
+    return bit
+
+
+def _cache_bit(right_type, bit):
+    _bits[right_type] = bit
+
+
+def _count_local_write():
+    global _local_writes
+    with _local_lock:
+        _local_writes += 1
+
+
+def local_writes():
+    """Number of rights_generation increments committed by this process."""
+    return _local_writes
+
+
+def generation(cursor):
+    cursor.execute("SELECT value FROM settings WHERE key = 'rights_generation'")
+    row = cursor.fetchone()
+    return int(row[0]) if row else 0
+
+
+def rights_changed(cursor):
+    """Increment rights_generation in the caller's transaction, once per transaction group."""
+    if in_group(cursor.connection):
+        before_commit(_write_generation, None)
+        return
+    _increment_generation(cursor)
+
+
+def _increment_generation(cursor):
+    cursor.execute("UPDATE settings SET value = value + 1 WHERE key = 'rights_generation'")
+    after_commit(_count_local_write, conn=cursor.connection)
+
+
+# before_commit() work of a transaction group, see the module docstring
+
+def _write_generation(changes):
+    conn = get_db()
+    try:
+        _increment_generation(conn.cursor())
+    finally:
+        conn.close()
+
+
+def _write_provenance(rows):
+    conn = get_db()
+    try:
+        conn.executemany(_INSERT_PROVENANCE, rows)
+    finally:
+        conn.close()
+
+
+def _write_effective(masks):
+    conn = get_db()
+    try:
+        conn.executemany(_MERGE_EFFECTIVE, _merged(masks))
+    finally:
+        conn.close()
+
+
+def flush_pending():
+    """Write the queued provenance rows and effective_rights additions of this thread's group now."""
+    run_before_commit(_write_provenance)
+    run_before_commit(_write_effective)
+
+
+def _right_types(cursor):
+    cursor.execute("SELECT name, bit FROM right_types")
+    return cursor.fetchall()
+
+
+def has_right(cursor, subject_id, object_id, right_type):
+    if storage_mode(cursor) == BITMASK:
+        bit = right_bit(cursor, right_type)
+        if not bit:
+            return False
+        cursor.execute("SELECT 1 FROM rights_mask WHERE subject_id=? AND object_id=? AND mask & ? != 0",
+                       (subject_id, object_id, bit))
+    else:
+        cursor.execute("SELECT 1 FROM rights WHERE subject_id=? AND object_id=? AND right_type=?",
+                       (subject_id, object_id, right_type))
+    return cursor.fetchone() is not None
+
+
+_MERGE_EFFECTIVE = """
+    INSERT INTO effective_rights (user_id, object_id, mask) VALUES (?, ?, ?)
+    ON CONFLICT (user_id, object_id) DO UPDATE SET mask = mask | excluded.mask
+"""
+
+
+def _merged(masks):
+    """(subject_id, object_id, mask) tuples with one tuple per pair, the masks OR-ed."""
+    merged = {}
+    for s, o, mask in masks:
+        merged[(s, o)] = merged.get((s, o), 0) | mask
+    return [(s, o, mask) for (s, o), mask in merged.items()]
+
+
+def add_rights(cursor, rights, effective=True):
+    """
+    Add (subject_id, object_id, right_type) tuples. Rights already held are ignored.
+    effective=False leaves effective_rights alone (bulk loads that rebuild it afterwards).
+    """
+    masks = [(s, o, right_bit(cursor, r, create=True)) for s, o, r in rights]
+    if not masks:
+        return
+    rights_changed(cursor)
+    if storage_mode(cursor) == BITMASK:
+        cursor.executemany("""
+            INSERT INTO rights_mask (subject_id, object_id, mask) VALUES (?, ?, ?)
+            ON CONFLICT (subject_id, object_id) DO UPDATE SET mask = mask | excluded.mask
+        """, _merged(masks))
+    else:
+        cursor.executemany("INSERT OR IGNORE INTO rights (subject_id, object_id, right_type) VALUES (?, ?, ?)",
+                           rights)
+    if not effective:
+        return
+    if in_group(cursor.connection):
+        for mask in masks:
+            before_commit(_write_effective, mask)
+    else:
+        cursor.executemany(_MERGE_EFFECTIVE, _merged(masks))
+
+
+def add_right(cursor, subject_id, object_id, right_type):
+    add_rights(cursor, [(subject_id, object_id, right_type)])
+
+
+def remove_right(cursor, subject_id, object_id, right_type):
+    flush_pending()
+    rights_changed(cursor)
+    if storage_mode(cursor) == BITMASK:
+        bit = right_bit(cursor, right_type)
+        cursor.execute("UPDATE rights_mask SET mask = mask & ~? WHERE subject_id=? AND object_id=?",
+                       (bit, subject_id, object_id))
+        cursor.execute("DELETE FROM rights_mask WHERE subject_id=? AND object_id=? AND mask = 0",
+                       (subject_id, object_id))
+    else:
+        cursor.execute("DELETE FROM rights WHERE subject_id=? AND object_id=? AND right_type=?",
+                       (subject_id, object_id, right_type))
+    cursor.execute("DELETE FROM right_provenance WHERE subject_id=? AND object_id=? AND right_type=?",
+                   (subject_id, object_id, right_type))
+    _mark_pairs(cursor, [(subject_id, object_id)])
+    _refresh_effective(cursor)
+
+
+def remove_rights(cursor, rights):
+    """Remove (subject_id, object_id, right_type) tuples. Rights not held are ignored."""
+    flush_pending()
+    if not rights:
+        return
+    rights_changed(cursor)
+    if storage_mode(cursor) == BITMASK:
+        masks = {}
+        for s, o, r in rights:
+            masks[(s, o)] = masks.get((s, o), 0) | right_bit(cursor, r)
+        cursor.executemany("UPDATE rights_mask SET mask = mask & ~? WHERE subject_id=? AND object_id=?",
+                           [(mask, s, o) for (s, o), mask in masks.items()])
+        cursor.executemany("DELETE FROM rights_mask WHERE subject_id=? AND object_id=? AND mask = 0",
+                           list(masks))
+    else:
+        cursor.executemany("DELETE FROM rights WHERE subject_id=? AND object_id=? AND right_type=?", rights)
+    cursor.executemany("DELETE FROM right_provenance WHERE subject_id=? AND object_id=? AND right_type=?",
+                       rights)
+    _mark_pairs(cursor, {(s, o) for s, o, _ in rights})
+    _refresh_effective(cursor)
+
+
+def delete_object_rights(cursor, object_id):
+    """Delete every right on an object, the rights of groups included."""
+    flush_pending()
+    rights_changed(cursor)
+    table = "rights_mask" if storage_mode(cursor) == BITMASK else "rights"
+    for table in (table, "right_provenance", "group_rights", "group_provenance", "effective_rights"):
+        cursor.execute(f"DELETE FROM {table} WHERE object_id = ?", (object_id,))
+
+
+def delete_owned_object_rights(cursor, owner_id):
+    """Delete every right on the objects owned by owner_id, in one statement per table."""
+    flush_pending()
+    rights_changed(cursor)
+    table = "rights_mask" if storage_mode(cursor) == BITMASK else "rights"
+    for table in (table, "right_provenance", "group_rights", "group_provenance", "effective_rights"):
+        cursor.execute(f"DELETE FROM {table} WHERE object_id IN (SELECT id FROM objects WHERE owner_id = ?)",
+                       (owner_id,))
+
+
+def delete_subject_rights(cursor, subject_id):
+    """Delete the direct rights of a user; rights it has through groups stay."""
+    flush_pending()
+    rights_changed(cursor)
+    table = "rights_mask" if storage_mode(cursor) == BITMASK else "rights"
+    cursor.execute(f"DELETE FROM {table} WHERE subject_id = ?", (subject_id,))
+    cursor.execute("DELETE FROM right_provenance WHERE subject_id = ?", (subject_id,))
+    _mark(cursor, "SELECT user_id, object_id FROM effective_rights WHERE user_id = ?", (subject_id,))
+    _refresh_effective(cursor)
+
+
+_INSERT_PROVENANCE = """
+    INSERT OR IGNORE INTO right_provenance (subject_id, object_id, right_type, source_id, operation)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+
+def record_provenance(cursor, rows):
+    """rows: (subject_id, object_id, right_type, source_id or None, operation). Known derivations are ignored."""
+    if in_group(cursor.connection):
+        for row in rows:
+            before_commit(_write_provenance, row)
+    else:
+        cursor.executemany(_INSERT_PROVENANCE, rows)
+
+
+def rights_query(cursor):
+    """SQL of a (subject_id, object_id, right_type) relation of all rights, for use as a subquery."""
+    if storage_mode(cursor) == BITMASK:
+        return ("SELECT m.subject_id, m.object_id, t.name AS right_type "
+                "FROM rights_mask m JOIN right_types t ON m.mask & t.bit != 0")
+    return "SELECT subject_id, object_id, right_type FROM rights"
+
+
+def backfill_provenance(cursor):
+    """
+    Provenance of rights that existed before it was recorded (schema migration 8): the owner's
+    rights are roots, other rights are derived from successful grant/take audit records,
+    anything else becomes a 'legacy' root.
+    """
+    held = rights_query(cursor)
+    cursor.execute(f"""
+        INSERT OR IGNORE INTO right_provenance (subject_id, object_id, right_type, source_id, operation)
+        SELECT r.subject_id, r.object_id, r.right_type, NULL, 'create'
+        FROM ({held}) r JOIN objects o ON o.id = r.object_id AND o.owner_id = r.subject_id
+    """)
+    _audit_provenance(cursor, held)
+    cursor.execute(f"""
+        INSERT INTO right_provenance (subject_id, object_id, right_type, source_id, operation)
+        SELECT r.subject_id, r.object_id, r.right_type, NULL, 'legacy'
+        FROM ({held}) r
+        WHERE NOT EXISTS (SELECT 1 FROM right_provenance p WHERE p.subject_id = r.subject_id
+                          AND p.object_id = r.object_id AND p.right_type = r.right_type)
+    """)
+
+
+def repair_provenance(cursor):
+    """
+    Schema migration 12: derivations backfill_provenance() missed because the old audit
+    records had no structured fields yet. The 'legacy' roots they got instead are dropped.
+    """
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM right_provenance")
+    last_id = cursor.fetchone()[0]
+    _audit_provenance(cursor, rights_query(cursor))
+    cursor.execute("""
+        DELETE FROM right_provenance
+        WHERE operation = 'legacy' AND EXISTS (
+            SELECT 1 FROM right_provenance p WHERE p.id > ? AND p.subject_id = right_provenance.subject_id
+              AND p.object_id = right_provenance.object_id AND p.right_type = right_provenance.right_type)
+    """, (last_id,))
+
+
+def _audit_provenance(cursor, held):
+    """Derivations of the held rights from successful grant/take audit records."""
+    cursor.execute(f"""
+        INSERT OR IGNORE INTO right_provenance
+            (subject_id, object_id, right_type, source_id, operation, created_at)
+        SELECT d.holder, d.object_id, d.right_type, d.source, d.operation, d.timestamp
+        FROM (
+            SELECT CASE operation WHEN 'take' THEN actor_id ELSE target_user_id END AS holder,
+                   CASE operation WHEN 'take' THEN source_user_id WHEN 'trojan_take' THEN source_user_id
+                                  ELSE actor_id END AS source,
+                   object_id, right_type, operation, timestamp
+            FROM audit
+            WHERE operation IN ('grant', 'take', 'trojan_grant', 'trojan_take') AND result = 'success'
+        ) d JOIN ({held}) r ON r.subject_id = d.holder AND r.object_id = d.object_id AND r.right_type = d.right_type
+        WHERE d.source IS NOT NULL AND d.source != d.holder
+    """)
+
+
+def _expand(cursor, rows):
+    types = _right_types(cursor)
+    for subject_id, object_id, mask in rows:
+        for name, bit in types:
+            if mask & bit:
+                yield subject_id, object_id, name
+
+
+def iter_subject_rights(cursor, subject_id):
+    """Yield (subject_id, object_id, right_type) for the rights of one subject."""
+    bitmask = storage_mode(cursor) == BITMASK
+    table, column = ("rights_mask", "mask") if bitmask else ("rights", "right_type")
+    cursor.execute(f"SELECT subject_id, object_id, {column} FROM {table} WHERE subject_id = ?", (subject_id,))
+    rows = cursor.fetchall()
+    return _expand(cursor, rows) if bitmask else iter(rows)
+
+
+def iter_rights(cursor, object_ids=None):
+    """
+    Yield (subject_id, object_id, right_type) for all rights,
+    or only for the given object ids.
+    """
+    bitmask = storage_mode(cursor) == BITMASK
+    table, column = ("rights_mask", "mask") if bitmask else ("rights", "right_type")
+    if object_ids is None:
+        cursor.execute(f"SELECT subject_id, object_id, {column} FROM {table}")
+        rows = cursor.fetchall()
+    else:
+        rows = []
+        for chunk in chunks(object_ids):
+            marks = ",".join("?" * len(chunk))
+            cursor.execute(f"SELECT subject_id, object_id, {column} FROM {table} WHERE object_id IN ({marks})", chunk)
+            rows.extend(cursor.fetchall())
+    return _expand(cursor, rows) if bitmask else iter(rows)
+
+
+# --- groups and effective rights ---
+
+def has_effective_right(cursor, user_id, object_id, right_type):
+    """Direct or group right, one primary key lookup."""
+    flush_pending()
+    bit = right_bit(cursor, right_type)
+    if not bit:
+        return False
+    cursor.execute("SELECT 1 FROM effective_rights WHERE user_id = ? AND object_id = ? AND mask & ? != 0",
+                   (user_id, object_id, bit))
+    return cursor.fetchone() is not None
+
+
+def record_group_provenance(cursor, rows):
+    """rows: (group_id, object_id, right_type, source_id or None, operation). Known derivations are ignored."""
+    cursor.executemany("""
+        INSERT OR IGNORE INTO group_provenance (group_id, object_id, right_type, source_id, operation)
+        VALUES (?, ?, ?, ?, ?)
+    """, rows)
+
+
+def add_group_rights(cursor, rights):
+    """Add (group_id, object_id, right_type) tuples and pass them on to the members."""
+    masks = [(g, o, right_bit(cursor, r, create=True)) for g, o, r in rights]
+    cursor.executemany("""
+        INSERT INTO group_rights (group_id, object_id, mask) VALUES (?, ?, ?)
+        ON CONFLICT (group_id, object_id) DO UPDATE SET mask = mask | excluded.mask
+    """, masks)
+    cursor.executemany("""
+        INSERT INTO effective_rights (user_id, object_id, mask)
+        SELECT user_id, ?, ? FROM group_members WHERE group_id = ?
+        ON CONFLICT (user_id, object_id) DO UPDATE SET mask = mask | excluded.mask
+    """, [(o, mask, g) for g, o, mask in masks])
+
+
+def remove_group_rights(cursor, rights):
+    """Remove (group_id, object_id, right_type) tuples with their provenance."""
+    flush_pending()
+    rights = list(rights)
+    if not rights:
+        return
+    masks = {}
+    for g, o, r in rights:
+        masks[(g, o)] = masks.get((g, o), 0) | right_bit(cursor, r)
+    cursor.executemany("UPDATE group_rights SET mask = mask & ~? WHERE group_id = ? AND object_id = ?",
+                       [(mask, g, o) for (g, o), mask in masks.items()])
+    cursor.executemany("DELETE FROM group_rights WHERE group_id = ? AND object_id = ? AND mask = 0", list(masks))
+    cursor.executemany("DELETE FROM group_provenance WHERE group_id = ? AND object_id = ? AND right_type = ?",
+                       rights)
+    _mark_many(cursor, "SELECT user_id, ? FROM group_members WHERE group_id = ?", [(o, g) for g, o in masks])
+    _refresh_effective(cursor)
+
+
+def add_members(cursor, members):
+    """Add (group_id, user_id) tuples; the users get the group's rights."""
+    members = list(members)
+    cursor.executemany("INSERT OR IGNORE INTO group_members (group_id, user_id) VALUES (?, ?)", members)
+    cursor.executemany("""
+        INSERT INTO effective_rights (user_id, object_id, mask)
+        SELECT ?, object_id, mask FROM group_rights WHERE group_id = ?
+        ON CONFLICT (user_id, object_id) DO UPDATE SET mask = mask | excluded.mask
+    """, [(u, g) for g, u in members])
+
+
+def remove_members(cursor, members):
+    """Remove (group_id, user_id) tuples."""
+    flush_pending()
+    members = list(members)
+    cursor.executemany("DELETE FROM group_members WHERE group_id = ? AND user_id = ?", members)
+    _mark_many(cursor, "SELECT ?, object_id FROM group_rights WHERE group_id = ?", [(u, g) for g, u in members])
+    _refresh_effective(cursor)
+
+
+def delete_user_memberships(cursor, user_id):
+    cursor.execute("SELECT group_id FROM group_members WHERE user_id = ?", (user_id,))
+    remove_members(cursor, [(group_id, user_id) for (group_id,) in cursor.fetchall()])
+
+
+def delete_group_rights(cursor, group_id):
+    """Delete the rights and the members of a group."""
+    flush_pending()
+    _mark(cursor, """
+        SELECT m.user_id, g.object_id FROM group_members m JOIN group_rights g ON g.group_id = m.group_id
+        WHERE m.group_id = ?
+    """, (group_id,))
+    cursor.execute("DELETE FROM group_rights WHERE group_id = ?", (group_id,))
+    cursor.execute("DELETE FROM group_provenance WHERE group_id = ?", (group_id,))
+    cursor.execute("DELETE FROM group_members WHERE group_id = ?", (group_id,))
+    _refresh_effective(cursor)
+
+
+def _dirty_table(cursor):
+    cursor.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS effective_dirty (
+            user_id INTEGER, object_id INTEGER, PRIMARY KEY (user_id, object_id)
+        ) WITHOUT ROWID
+    """)
+
+
+def _mark_pairs(cursor, pairs):
+    _dirty_table(cursor)
+    cursor.executemany("INSERT OR IGNORE INTO temp.effective_dirty VALUES (?, ?)", pairs)
+
+
+def _mark(cursor, select, params=()):
+    """Mark the (user_id, object_id) pairs returned by select for recomputation."""
+    _dirty_table(cursor)
+    cursor.execute(f"INSERT OR IGNORE INTO temp.effective_dirty {select}", params)
+
+
+def _mark_many(cursor, select, seq):
+    _dirty_table(cursor)
+    cursor.executemany(f"INSERT OR IGNORE INTO temp.effective_dirty {select}", seq)
+
+
+def _effective_select(cursor, dirty):
+    """SELECT of (user_id, object_id, mask) from direct and group rights, for the marked pairs if dirty."""
+    if storage_mode(cursor) == BITMASK:
+        direct = "rights_mask r JOIN right_types t ON r.mask & t.bit != 0"
+    else:
+        direct = "rights r JOIN right_types t ON t.name = r.right_type"
+    groups = ("group_members m JOIN group_rights g ON g.group_id = m.group_id "
+              "JOIN right_types t ON g.mask & t.bit != 0")
+    if dirty:
+        direct = f"temp.effective_dirty d JOIN {direct} AND r.subject_id = d.user_id AND r.object_id = d.object_id"
+        groups = (f"temp.effective_dirty d JOIN group_members m ON m.user_id = d.user_id "
+                  f"JOIN group_rights g ON g.group_id = m.group_id AND g.object_id = d.object_id "
+                  f"JOIN right_types t ON g.mask & t.bit != 0")
+    # bits are distinct powers of two, so SUM(DISTINCT bit) is their OR
+    return f"""
+        SELECT user_id, object_id, SUM(DISTINCT bit) FROM (
+            SELECT r.subject_id AS user_id, r.object_id AS object_id, t.bit AS bit FROM {direct}
+            UNION ALL
+            SELECT m.user_id, g.object_id, t.bit FROM {groups}
+        ) GROUP BY user_id, object_id
+    """
+
+
+def _refresh_effective(cursor):
+    """Recompute effective_rights for the marked pairs."""
+    _dirty_table(cursor)
+    cursor.execute("""
+        DELETE FROM effective_rights
+        WHERE (user_id, object_id) IN (SELECT user_id, object_id FROM temp.effective_dirty)
+    """)
+    cursor.execute(f"INSERT INTO effective_rights (user_id, object_id, mask) {_effective_select(cursor, True)}")
+    cursor.execute("DELETE FROM temp.effective_dirty")
+
+
+def rebuild_effective(cursor, counts=True):
+    """
+    Recompute the whole effective_rights table (schema migration 9, snapshot import), and
+    with counts=True the access counts in one pass instead of row by row in the triggers.
+    """
+    flush_pending()
+    cursor.execute("SELECT DISTINCT right_type FROM rights")
+    for (right_type,) in cursor.fetchall():
+        right_bit(cursor, right_type, create=True)
+    if counts:
+        drop_access_count_triggers(cursor)
+    cursor.execute("DELETE FROM effective_rights")
+    cursor.execute(f"INSERT INTO effective_rights (user_id, object_id, mask) {_effective_select(cursor, False)}")
+    if counts:
+        rebuild_access_counts(cursor)
+        create_access_count_triggers(cursor)
+
+
+def right_types(cursor):
+    """[(name, bit)] of all right types, by bit."""
+    return sorted(_right_types(cursor), key=lambda t: t[1])
+
+
+# --- access counts ---
+# Objects per user and users per object with any effective right, kept by triggers on
+# effective_rights so summaries never need a GROUP BY over it. An upsert that only changes
+# a mask fires no insert/delete trigger, which is right: the pair keeps its access.
+
+ACCESS_COUNT_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_effective_insert AFTER INSERT ON effective_rights BEGIN
+        INSERT INTO user_access_counts (user_id, objects) VALUES (NEW.user_id, 1)
+        ON CONFLICT (user_id) DO UPDATE SET objects = objects + 1;
+        INSERT INTO object_access_counts (object_id, users) VALUES (NEW.object_id, 1)
+        ON CONFLICT (object_id) DO UPDATE SET users = users + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_effective_delete AFTER DELETE ON effective_rights BEGIN
+        UPDATE user_access_counts SET objects = objects - 1 WHERE user_id = OLD.user_id;
+        DELETE FROM user_access_counts WHERE user_id = OLD.user_id AND objects <= 0;
+        UPDATE object_access_counts SET users = users - 1 WHERE object_id = OLD.object_id;
+        DELETE FROM object_access_counts WHERE object_id = OLD.object_id AND users <= 0;
+    END
+    """,
+]
+
+
+def create_access_count_triggers(cursor):
+    for sql in ACCESS_COUNT_TRIGGERS:
+        cursor.execute(sql)
+
+
+def drop_access_count_triggers(cursor):
+    cursor.execute("DROP TRIGGER IF EXISTS trg_effective_insert")
+    cursor.execute("DROP TRIGGER IF EXISTS trg_effective_delete")
+
+
+def rebuild_access_counts(cursor):
+    cursor.execute("DELETE FROM user_access_counts")
+    cursor.execute("DELETE FROM object_access_counts")
+    cursor.execute("INSERT INTO user_access_counts (user_id, objects) "
+                   "SELECT user_id, COUNT(*) FROM effective_rights GROUP BY user_id")
+    cursor.execute("INSERT INTO object_access_counts (object_id, users) "
+                   "SELECT object_id, COUNT(*) FROM effective_rights GROUP BY object_id")
+
+
+def set_storage_mode(mode):
+    """Convert the existing rights to the given layout, in place and in one transaction."""
+    if mode not in (ROWS, BITMASK):
+        raise ValueError(f"Unknown rights storage: {mode}")
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        reset_cache()
+        current = storage_mode(cursor)
+        if current != mode:
+            if mode == BITMASK:
+                cursor.execute("SELECT DISTINCT right_type FROM rights")
+                for (right_type,) in cursor.fetchall():
+                    right_bit(cursor, right_type, create=True)
+                cursor.execute("""
+                    INSERT INTO rights_mask (subject_id, object_id, mask)
+                    SELECT r.subject_id, r.object_id, SUM(DISTINCT t.bit)
+                    FROM rights r JOIN right_types t ON t.name = r.right_type
+                    GROUP BY r.subject_id, r.object_id
+                """)
+                cursor.execute("DELETE FROM rights")
+            else:
+                cursor.execute("""
+                    INSERT OR IGNORE INTO rights (subject_id, object_id, right_type)
+                    SELECT m.subject_id, m.object_id, t.name
+                    FROM rights_mask m JOIN right_types t ON m.mask & t.bit != 0
+                """)
+                cursor.execute("DELETE FROM rights_mask")
+            cursor.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('rights_storage', ?)", (mode,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        reset_cache()
+        conn.close()
+    print(f"Rights storage is now '{mode}'.")
+
+
+if __name__ == "__main__":
+    # python rightstore.py bitmask|rows
+    from db import init_db
+    init_db()
+    set_storage_mode(sys.argv[1] if len(sys.argv) > 1 else BITMASK)
@@ -0,0 +1,260 @@
+# server.py
+"""
+Asyncio server for the Take-Grant operations, line-delimited JSON over TCP or a Unix socket.
+
+  python server.py --port 8765            (or --unix /tmp/take_grant.sock)
+
+Every request is one JSON object per line with the same fields as main.py batch mode,
+plus an optional "id" that is echoed back:
+  {"id": 1, "cmd": "login", "username": "alice", "password": "..."}
+  {"id": 2, "cmd": "check", "obj": 9, "right": "read"}
+Every connection has its own session; apart from register, login and resume every command
+needs a logged-in session. Commands that change state go through one writer (queued,
+committed together in small groups), everything else runs concurrently on a thread pool
+with check_access answered from the in-memory protection graph.
+
+The server never touches files named by a client: export_audit (admin) streams the records
+back as {"id", "cmd", "rows": [...]} lines followed by the usual result line, and metrics
+only returns the snapshot. show_audit is admin-only here, every client sees the whole log.
+The database is switched to WAL at start, so readers never wait for the writer.
+"""
+import argparse
+import asyncio
+import io
+import json
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from audit import AUDIT_COLUMNS, flush as flush_audit, log_event, query_audit
+from auth import create_session, get_session, end_session, prehash_password, verify_login
+from db import enable_wal, init_db, transaction_group
+from graph import load_graph
+from main import COMMANDS, Session, arg, run_in_group
+
+OPEN_COMMANDS = {"register", "login"}  # and resume, everything else needs a session
+WRITE_COMMANDS = {"register", "login", "create_obj", "write_obj", "delete_obj", "grant", "take", "revoke",
+                  "group_create", "group_delete", "group_add", "group_remove", "group_grant", "group_revoke",
+                  "delete_user", "make_admin", "rotate_audit"}
+FILE_ARGS = {"export_audit": "file", "metrics": "out"}  # server-side paths, refused from clients
+ADMIN_COMMANDS = {"show_audit"}  # open in the CLI, admin-only for network clients
+# bcrypt work done on a reader before the command is queued, never while the writer holds the lock
+PREPARE = {"register": prehash_password, "login": verify_login}
+READ_WORKERS = 8
+WRITE_GROUP = 64  # queued write commands committed in one transaction
+EXPORT_PAGE = 500  # audit rows per streamed export_audit line
+MAX_LINE = 1 << 20
+
+
+class CapturedOutput(io.TextIOBase):
+    """sys.stdout replacement that collects print() output per thread while capturing."""
+
+    def __init__(self, fallback):
+        self._fallback = fallback
+        self._local = threading.local()
+
+    def write(self, text):
+        buf = getattr(self._local, "buf", None)
+        if buf is None:
+            return self._fallback.write(text)
+        buf.append(text)
+        return len(text)
+
+    def flush(self):
+        self._fallback.flush()
+
+    def start(self):
+        self._local.buf = []
+
+    def stop(self):
+        buf, self._local.buf = self._local.buf, None
+        return "".join(buf)
+
+
+class TakeGrantServer:
+
+    def __init__(self):
+        self.output = CapturedOutput(sys.stdout)
+        self.readers = ThreadPoolExecutor(max_workers=READ_WORKERS, thread_name_prefix="reader")
+        # one thread owns every write, so SQLite sees a single writer
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="writer")
+        self.write_queue = None
+
+    def _run_read(self, session, args):
+        result = {"cmd": args["cmd"]}
+        self.output.start()
+        try:
+            result.update(COMMANDS[args["cmd"]](session, args))
+        except Exception as e:
+            result.update(ok=False, error=str(e))
+        result["output"] = self.output.stop()
+        return result
+
+    def _run_writes(self, batch):
+        results = []
+        with transaction_group() as conn:
+            for session, args in batch:
+                self.output.start()
+                result = run_in_group(conn, session, args)
+                result["output"] = self.output.stop()
+                results.append(result)
+        return results
+
+    async def _write_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.write_queue.get()]
+            while len(batch) < WRITE_GROUP and not self.write_queue.empty():
+                batch.append(self.write_queue.get_nowait())
+            try:
+                results = await loop.run_in_executor(
+                    self.writer, self._run_writes, [(s, a) for s, a, _ in batch])
+            except Exception as e:
+                results = [{"ok": False, "error": str(e)}] * len(batch)
+            for (_, _, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def _export_audit(self, session, args, send):
+        loop = asyncio.get_running_loop()
+        if not session.is_admin:
+            await loop.run_in_executor(self.readers, partial(
+                log_event, session.username, "export_audit", "denied", operation="export_audit",
+                actor_id=session.user_id))
+            return {"cmd": "export_audit", "ok": False, "error": "denied"}
+        filters = {"user": str(args["user"])} if args.get("user") else {}
+        await loop.run_in_executor(self.readers, flush_audit)
+        count, after = 0, None
+        while True:
+            rows, after = await loop.run_in_executor(
+                self.readers, partial(query_audit, EXPORT_PAGE, after, False, **filters))
+            if rows:
+                await send({"cmd": "export_audit", "rows": [dict(zip(AUDIT_COLUMNS, r)) for r in rows]})
+                count += len(rows)
+            if after is None:
+                break
+        await loop.run_in_executor(self.readers, partial(
+            log_event, session.username, "export_audit", "success", operation="export_audit",
+            actor_id=session.user_id))
+        return {"cmd": "export_audit", "ok": True, "rows": count}
+
+    async def execute(self, session, args, send):
+        cmd = args.get("cmd")
+
+        # session handling that needs no database
+        if cmd == "resume":
+            restored = get_session(args.get("token"))
+            if restored is None:
+                return {"cmd": cmd, "ok": False, "error": "invalid or expired token"}
+            session.user_id, session.username, session.is_admin = restored
+            session.token = args.get("token")
+            return {"cmd": cmd, "ok": True, "user_id": session.user_id}
+
+        if cmd not in COMMANDS:
+            return {"cmd": cmd, "ok": False, "error": "unknown command"}
+        if session.user_id is None and cmd not in OPEN_COMMANDS:
+            return {"cmd": cmd, "ok": False, "error": "not logged in"}
+        loop = asyncio.get_running_loop()
+        if cmd in ADMIN_COMMANDS and not session.is_admin:
+            await loop.run_in_executor(self.readers, partial(
+                log_event, session.username, cmd, "denied", operation=cmd, actor_id=session.user_id))
+            return {"cmd": cmd, "ok": False, "error": "denied"}
+        if args.get(FILE_ARGS.get(cmd)):
+            return {"cmd": cmd, "ok": False, "error": f"'{FILE_ARGS[cmd]}' is not accepted by the server"}
+        if cmd == "export_audit":
+            return await self._export_audit(session, args, send)
+
+        if cmd in PREPARE:
+            try:
+                await loop.run_in_executor(self.readers, PREPARE[cmd], arg(args, "username", None),
+                                           arg(args, "password", None))
+            except Exception:
+                pass  # the command itself reports the error
+        if cmd in WRITE_COMMANDS:
+            future = loop.create_future()
+            await self.write_queue.put((session, args, future))
+            result = await future
+        else:
+            result = await loop.run_in_executor(self.readers, self._run_read, session, args)
+        if cmd == "login" and result.get("ok"):
+            session.token = create_session(session.user_id, session.username, session.is_admin)
+            result["token"] = session.token
+        elif cmd == "logout" and session.token:
+            end_session(session.token)
+            session.token = None
+        return result
+
+    async def handle_client(self, reader, writer):
+        session = Session()
+
+        async def send(response):
+            if "id" in args:
+                response = {"id": args["id"], **response}
+            writer.write((json.dumps(response) + "\n").encode("utf-8"))
+            await writer.drain()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    args = json.loads(line)
+                    if not isinstance(args, dict):
+                        raise ValueError("command must be a JSON object")
+                except ValueError as e:
+                    args = {}
+                    await send({"ok": False, "error": str(e)})
+                    continue
+                if args.get("cmd") == "exit":
+                    break
+                await send(await self.execute(session, args, send))
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8765, unix_path=None):
+        init_db()
+        if enable_wal() != "wal":
+            print("Warning: the database could not be switched to WAL, readers wait for the writer.",
+                  file=sys.stderr)
+        load_graph()
+        sys.stdout = self.output
+        self.write_queue = asyncio.Queue()
+        write_task = asyncio.create_task(self._write_loop())
+        if unix_path:
+            server = await asyncio.start_unix_server(self.handle_client, path=unix_path, limit=MAX_LINE)
+            where = unix_path
+        else:
+            server = await asyncio.start_server(self.handle_client, host, port, limit=MAX_LINE)
+            where = f"{host}:{port}"
+        print(f"Take-Grant server listening on {where}", file=sys.stderr)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            write_task.cancel()
+            sys.stdout = self.output._fallback
+            self.readers.shutdown()
+            self.writer.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Take-Grant JSON lines server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="listen on a Unix socket instead of TCP")
+    options = parser.parse_args(argv)
+    try:
+        asyncio.run(TakeGrantServer().serve(options.host, options.port, options.unix))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
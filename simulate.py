@@ -0,0 +1,292 @@
+# simulate.py
+"""
+What-if analysis of trojan attacks on an in-memory, copy-on-write view of the protection
+graph. Nothing here writes to the database.
+
+A trojan runs with its victim's identity, so it can do whatever the victim can (rights.py):
+grant any right the victim holds, and on an object where the victim holds 'take', first take
+any right from any holder. For a set of victims and an attacker this closes per object:
+  coalition  = victims + attacker
+  held       = rights the coalition holds on the object
+  obtainable = every right anyone holds on it if 'take' is in held, otherwise held
+The attacker gains what is obtainable minus what it could already get on its own: one pass
+over the coalition's objects, no rule application or search.
+
+  python simulate.py attack ATTACKER VICTIM [VICTIM ...] [--steps]
+  python simulate.py rank [--attacker ID] [--top N] [--workers N]
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from graph import RIGHT_BITS, ProtectionGraph, analysis_graph, mask_to_rights, right_bit
+
+PARALLEL_MIN = 2000   # fewer victims / scenarios than this run in the calling process
+CHUNK_SIZE = 500      # victims or scenarios per worker task
+
+
+def _bits(mask):
+    return bin(mask).count("1")
+
+
+class RightsView:
+    """
+    Copy-on-write view of a ProtectionGraph, keyed by user and object ids. Reads fall
+    through to the graph until a user's or an object's row is changed, then that row is
+    copied into the view. The graph itself is never modified.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self._rights = {}    # user id -> {object id: mask}, changed rows
+        self._holders = {}   # object id -> {user id: mask}, changed rows
+        self._all = {}       # object id -> OR of all holders' masks
+
+    def rights_of(self, user_id):
+        """{object_id: mask} for one user."""
+        row = self._rights.get(user_id)
+        if row is not None:
+            return row
+        g = self.graph
+        s = g.subject_index.get(user_id)
+        if s is None:
+            return {}
+        return {g.objects[o]: mask for o, mask in g.out_edges[s].items()}
+
+    def holders_of(self, object_id):
+        """{user_id: mask} for one object."""
+        row = self._holders.get(object_id)
+        if row is not None:
+            return row
+        g = self.graph
+        o = g.object_index.get(object_id)
+        if o is None:
+            return {}
+        return {g.subjects[s]: mask for s, mask in g.in_edges[o].items()}
+
+    def object_mask(self, object_id):
+        """Every right somebody holds on the object."""
+        mask = self._all.get(object_id)
+        if mask is None:
+            mask = 0
+            for holder_mask in self.holders_of(object_id).values():
+                mask |= holder_mask
+            self._all[object_id] = mask
+        return mask
+
+    def _set(self, user_id, object_id, mask):
+        rights = self._rights.setdefault(user_id, dict(self.rights_of(user_id)))
+        holders = self._holders.setdefault(object_id, dict(self.holders_of(object_id)))
+        if mask:
+            rights[object_id] = holders[user_id] = mask
+        else:
+            rights.pop(object_id, None)
+            holders.pop(user_id, None)
+        self._all.pop(object_id, None)
+
+    def add_right(self, user_id, object_id, right_type):
+        self._set(user_id, object_id, self.rights_of(user_id).get(object_id, 0) | right_bit(right_type))
+
+    def remove_right(self, user_id, object_id, right_type):
+        self._set(user_id, object_id, self.rights_of(user_id).get(object_id, 0) & ~right_bit(right_type))
+
+    def subjects(self):
+        g = self.graph
+        ids = {user_id for user_id in g.subjects if user_id is not None}
+        return sorted(ids | set(self._rights))
+
+    def edges(self):
+        """Yield (user_id, object_id, mask) for every edge of the view."""
+        g = self.graph
+        for s, row in enumerate(g.out_edges):
+            user_id = g.subjects[s]
+            if user_id is None or user_id in self._rights:
+                continue
+            for o, mask in row.items():
+                yield user_id, g.objects[o], mask
+        for user_id, row in self._rights.items():
+            for object_id, mask in row.items():
+                yield user_id, object_id, mask
+
+
+def obtainable(view, subjects):
+    """{object_id: mask} of every right the subjects can get together (see the module docstring)."""
+    take = RIGHT_BITS["take"]
+    held = {}
+    for user_id in subjects:
+        for object_id, mask in view.rights_of(user_id).items():
+            held[object_id] = held.get(object_id, 0) | mask
+    return {o: view.object_mask(o) if mask & take else mask for o, mask in held.items()}
+
+
+def attack(view, attacker_id, victim_ids):
+    """{object_id: mask} of the rights attacker_id gains if every victim runs a trojan."""
+    alone = obtainable(view, [attacker_id])
+    gained = {}
+    for object_id, mask in obtainable(view, [attacker_id, *victim_ids]).items():
+        mask &= ~alone.get(object_id, 0)
+        if mask:
+            gained[object_id] = mask
+    return gained
+
+
+def attack_steps(view, attacker_id, victim_ids, gained=None):
+    """
+    Calls that would realise an attack, in order:
+      ("trojan_grant", victim_id, attacker_id, object_id, right_type) -> trojan.trojan_grant
+      ("take", attacker_id, holder_id, object_id, right_type)         -> rights.take_right
+    """
+    if gained is None:
+        gained = attack(view, attacker_id, victim_ids)
+    take = RIGHT_BITS["take"]
+    steps = []
+    for object_id, mask in sorted(gained.items()):
+        holders = view.holders_of(object_id)
+        attacker_take = bool(view.rights_of(attacker_id).get(object_id, 0) & take)
+        # get 'take' first, the other rights may need it
+        right_types = sorted(mask_to_rights(mask), key=lambda r: r != "take")
+        for right_type in right_types:
+            bit = right_bit(right_type)
+            victim = next((v for v in victim_ids if holders.get(v, 0) & bit), None)
+            if victim is not None:
+                steps.append(("trojan_grant", victim, attacker_id, object_id, right_type))
+            else:
+                if not attacker_take:
+                    taker = next(v for v in victim_ids if holders.get(v, 0) & take)
+                    steps.append(("trojan_grant", taker, attacker_id, object_id, "take"))
+                holder = next(u for u, m in sorted(holders.items()) if m & bit)
+                steps.append(("take", attacker_id, holder, object_id, right_type))
+            if bit == take:
+                attacker_take = True
+    return steps
+
+
+def blast_radius(view, victim_id, attacker_id=None):
+    """
+    (rights, objects) a trojan run by victim_id leaks: to attacker_id beyond what it can
+    already get, or to a user without rights when attacker_id is None.
+    """
+    if attacker_id is None:
+        leaked = obtainable(view, [victim_id])
+    else:
+        leaked = attack(view, attacker_id, [victim_id])
+    return sum(_bits(mask) for mask in leaked.values()), len(leaked)
+
+
+def _describe(gained):
+    return {object_id: mask_to_rights(mask) for object_id, mask in sorted(gained.items())}
+
+
+def _scenario(view, attacker_id, victim_ids):
+    gained = attack(view, attacker_id, victim_ids)
+    return {
+        "attacker": attacker_id,
+        "victims": list(victim_ids),
+        "rights": sum(_bits(mask) for mask in gained.values()),
+        "gained": _describe(gained),
+    }
+
+
+# --- process pool ---
+
+_worker_view = None
+
+
+def _init_worker(edges, right_bits):
+    global _worker_view
+    RIGHT_BITS.update(right_bits)
+    graph = ProtectionGraph()
+    for user_id, object_id, mask in edges:
+        graph._add(user_id, object_id, mask)
+    _worker_view = RightsView(graph)
+
+
+def _rank_chunk(victim_ids, attacker_id):
+    return [(victim_id, *blast_radius(_worker_view, victim_id, attacker_id)) for victim_id in victim_ids]
+
+
+def _scenario_chunk(scenarios):
+    return [_scenario(_worker_view, attacker_id, victim_ids) for attacker_id, victim_ids in scenarios]
+
+
+def _view(view):
+    if view is not None:
+        return view
+    return RightsView(analysis_graph())
+
+
+def _run(view, items, serial, chunk, workers):
+    """Apply serial(view, item) to every item, on a process pool for large inputs."""
+    if workers is None:
+        workers = 1 if len(items) < PARALLEL_MIN else os.cpu_count() or 1
+    with view.graph._lock:
+        if workers <= 1:
+            return [serial(view, item) for item in items]
+        # every worker gets its own copy of the view, built once
+        edges = list(view.edges())
+        right_bits = dict(RIGHT_BITS)
+    parts = [items[i:i + CHUNK_SIZE] for i in range(0, len(items), CHUNK_SIZE)]
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(edges, right_bits)) as pool:
+        return [result for part in pool.map(chunk, parts) for result in part]
+
+
+def rank_victims(attacker_id=None, victim_ids=None, top=None, workers=None, view=None):
+    """
+    Rank victims by blast radius (see blast_radius). victim_ids defaults to every user
+    holding a right. Returns [(victim_id, rights, objects)], largest first.
+    """
+    view = _view(view)
+    victim_ids = [v for v in (view.subjects() if victim_ids is None else victim_ids) if v != attacker_id]
+    ranked = _run(view, victim_ids,
+                  lambda v, victim_id: (victim_id, *blast_radius(v, victim_id, attacker_id)),
+                  partial(_rank_chunk, attacker_id=attacker_id), workers)
+    ranked.sort(key=lambda r: (-r[1], -r[2], r[0]))
+    return ranked[:top] if top is not None else ranked
+
+
+def run_scenarios(scenarios, workers=None, view=None):
+    """
+    Evaluate independent (attacker_id, victim_ids) scenarios. Returns one dict per scenario:
+    attacker, victims, rights (count) and gained ({object_id: [right_type, ...]}).
+    """
+    view = _view(view)
+    scenarios = [(attacker_id, tuple(victim_ids)) for attacker_id, victim_ids in scenarios]
+    return _run(view, scenarios, lambda v, s: _scenario(v, *s), _scenario_chunk, workers)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Trojan what-if analysis (read-only)")
+    sub = parser.add_subparsers(dest="action", required=True)
+    p = sub.add_parser("attack", help="rights an attacker gains if the victims run a trojan")
+    p.add_argument("attacker", type=int)
+    p.add_argument("victims", type=int, nargs="+")
+    p.add_argument("--steps", action="store_true", help="print the calls that would realise the attack")
+    p = sub.add_parser("rank", help="rank victims by blast radius")
+    p.add_argument("--attacker", type=int)
+    p.add_argument("--top", type=int, default=20)
+    p.add_argument("--workers", type=int)
+    args = parser.parse_args(argv)
+
+    import db
+    db.init_db()
+    view = _view(None)
+    if args.action == "attack":
+        gained = attack(view, args.attacker, args.victims)
+        print(f"User {args.attacker} gains {sum(_bits(m) for m in gained.values())} rights "
+              f"on {len(gained)} objects.")
+        for object_id, rights in _describe(gained).items():
+            print(f"  object {object_id}: {', '.join(rights)}")
+        if args.steps:
+            for step in attack_steps(view, args.attacker, args.victims, gained):
+                print("  " + " ".join(str(part) for part in step))
+    else:
+        ranked = rank_victims(args.attacker, top=args.top, workers=args.workers, view=view)
+        print(f"{'victim':>8} {'rights':>8} {'objects':>8}")
+        for victim_id, rights, objects in ranked:
+            print(f"{victim_id:>8} {rights:>8} {objects:>8}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
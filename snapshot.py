@@ -0,0 +1,372 @@
+# snapshot.py
+"""
+Export and import of the complete protection state: users, objects with their content,
+rights, right provenance, groups and optionally the audit log.
+
+A snapshot is a gzip JSON Lines file. Apart from the header and the trailer every line is
+a block of up to BLOCK_ROWS records of one kind, ["u", [[...], [...], ...]]:
+  u  [id, username, password_hash, is_admin]
+  c  [sha256, base64 data]                 content chunk, stored once
+  o  [id, name, owner_id, size, content_hash, [chunk sha256, ...]]
+  r  [subject_id, object_id, right_type]
+  p  [subject_id, object_id, right_type, source_id, operation, created_at]
+  g  [group_id, name]
+  m  [group_id, user_id]                   group membership
+  gr [group_id, object_id, right_type]
+  gp [group_id, object_id, right_type, source_id, operation, created_at]
+  a  audit row in AUDIT_COLUMNS order      only with --audit
+The first line is ["header", {...}], the last ["end", {"counts": {...}, "sha256": ...}],
+the digest covering every block line.
+
+Import runs in one transaction with executemany batches and the secondary indexes dropped
+and recreated afterwards; verification recomputes the digest from the database.
+
+  python snapshot.py export state.jsonl.gz [--audit]
+  python snapshot.py import state.jsonl.gz [--replace] [--no-verify]
+  python snapshot.py verify state.jsonl.gz
+"""
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import os
+import time
+
+import db
+import rightstore
+from audit import AUDIT_COLUMNS, flush as flush_audit
+from cache import decision_cache
+from graph import reset_graph
+
+FORMAT_VERSION = 1
+BLOCK_ROWS = 5000
+CHUNK_BLOCK_ROWS = 16  # content chunks are up to 64 KiB each
+COMPRESS_LEVEL = 6
+
+# tables whose secondary indexes are rebuilt after a bulk load
+_LOAD_TABLES = ("objects", "rights", "rights_mask", "right_provenance", "group_provenance", "effective_rights",
+                "audit")
+# effective_rights and the access counts are not in the snapshot, they are rebuilt after a load
+_STATE_TABLES = ("users", "objects", "rights", "rights_mask", "right_provenance",
+                 "content_chunks", "object_chunks", "groups", "group_members", "group_rights", "group_provenance")
+
+
+def _line(record):
+    return json.dumps(record, separators=(",", ":"), ensure_ascii=False) + "\n"
+
+
+def _password(value):
+    return value.decode("ascii") if isinstance(value, (bytes, bytearray)) else value
+
+
+def _chunked(kind, rows, size=BLOCK_ROWS):
+    block = []
+    for row in rows:
+        block.append(row)
+        if len(block) >= size:
+            yield [kind, block]
+            block = []
+    if block:
+        yield [kind, block]
+
+
+def _fetched(kind, cursor):
+    while True:
+        rows = cursor.fetchmany(BLOCK_ROWS)
+        if not rows:
+            return
+        yield [kind, rows]
+
+
+def _objects(cursor):
+    cursor.execute("""
+        SELECT o.id, o.name, o.owner_id, o.size, o.content_hash, c.hash
+        FROM objects o
+        LEFT JOIN object_chunks oc ON oc.object_id = o.id
+        LEFT JOIN content_chunks c ON c.id = oc.chunk_id
+        ORDER BY o.id, oc.offset
+    """)
+    current = None
+    for object_id, name, owner_id, size, content_hash, chunk in cursor:
+        if current is None or current[0] != object_id:
+            if current is not None:
+                yield current
+            current = [object_id, name, owner_id, size, content_hash, []]
+        if chunk is not None:
+            current[5].append(chunk)
+    if current is not None:
+        yield current
+
+
+def _blocks(cursor, include_audit):
+    """[kind, rows] blocks of the whole state in canonical order, the order export writes them in."""
+    cursor.execute("SELECT id, username, password, is_admin FROM users ORDER BY id")
+    yield from _chunked("u", ([i, name, _password(pw), admin] for i, name, pw, admin in cursor))
+
+    cursor.execute("SELECT hash, data FROM content_chunks ORDER BY hash")
+    yield from _chunked("c", ([h, base64.b64encode(data).decode("ascii")] for h, data in cursor), CHUNK_BLOCK_ROWS)
+
+    yield from _chunked("o", _objects(cursor))
+
+    cursor.execute(f"SELECT * FROM ({rightstore.rights_query(cursor)}) ORDER BY 1, 2, 3")
+    yield from _fetched("r", cursor)
+
+    cursor.execute("""
+        SELECT subject_id, object_id, right_type, source_id, operation, created_at
+        FROM right_provenance ORDER BY subject_id, object_id, right_type, source_id
+    """)
+    yield from _fetched("p", cursor)
+
+    cursor.execute("SELECT id, name FROM groups ORDER BY id")
+    yield from _fetched("g", cursor)
+    cursor.execute("SELECT group_id, user_id FROM group_members ORDER BY group_id, user_id")
+    yield from _fetched("m", cursor)
+    cursor.execute("""
+        SELECT g.group_id, g.object_id, t.name FROM group_rights g JOIN right_types t ON g.mask & t.bit != 0
+        ORDER BY 1, 2, 3
+    """)
+    yield from _fetched("gr", cursor)
+    cursor.execute("""
+        SELECT group_id, object_id, right_type, source_id, operation, created_at
+        FROM group_provenance ORDER BY group_id, object_id, right_type, source_id
+    """)
+    yield from _fetched("gp", cursor)
+
+    if include_audit:
+        cursor.execute(f"SELECT {', '.join(AUDIT_COLUMNS)} FROM audit ORDER BY id")
+        yield from _fetched("a", cursor)
+
+
+def _state_lines(cursor, include_audit):
+    """Block lines of the current state: (line, kind, number of rows)."""
+    for kind, rows in _blocks(cursor, include_audit):
+        yield _line([kind, rows]), kind, len(rows)
+
+
+def export_snapshot(path, include_audit=False):
+    """Write the snapshot file. Returns the trailer: record counts and digest."""
+    flush_audit()
+    conn = db.get_db()
+    cursor = conn.cursor()
+    counts = {}
+    digest = hashlib.sha256()
+    try:
+        # one read transaction, so the snapshot is consistent
+        cursor.execute("BEGIN")
+        header = {"format": FORMAT_VERSION, "schema_version": db.schema_version(conn),
+                  "rights_storage": rightstore.storage_mode(cursor), "audit": include_audit,
+                  "created": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        with gzip.open(path + ".tmp", "wt", encoding="utf-8", compresslevel=COMPRESS_LEVEL) as f:
+            f.write(_line(["header", header]))
+            for line, kind, n in _state_lines(cursor, include_audit):
+                digest.update(line.encode("utf-8"))
+                counts[kind] = counts.get(kind, 0) + n
+                f.write(line)
+            trailer = {"counts": counts, "sha256": digest.hexdigest()}
+            f.write(_line(["end", trailer]))
+        conn.rollback()
+    finally:
+        conn.close()
+    os.replace(path + ".tmp", path)
+    return trailer
+
+
+def _open(path):
+    """Header of a snapshot file and an iterator over its remaining lines."""
+    f = gzip.open(path, "rt", encoding="utf-8")
+    header = json.loads(f.readline() or "null")
+    if not header or header[0] != "header" or header[1].get("format") != FORMAT_VERSION:
+        f.close()
+        raise ValueError(f"{path} is not a snapshot file of format {FORMAT_VERSION}")
+    return header[1], f
+
+
+def _drop_indexes(cursor):
+    marks = ",".join("?" * len(_LOAD_TABLES))
+    cursor.execute(f"SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL "
+                   f"AND tbl_name IN ({marks})", _LOAD_TABLES)
+    indexes = cursor.fetchall()
+    for name, _ in indexes:
+        cursor.execute(f'DROP INDEX "{name}"')
+    return indexes
+
+
+class _Loader:
+    """Writes snapshot blocks with executemany; content chunks get new ids."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM content_chunks")
+        self.next_chunk = cursor.fetchone()[0] + 1
+        self.chunks = {}  # sha256 -> [id, size, refs]
+
+    def load(self, kind, rows):
+        c = self.cursor
+        if kind == "u":
+            c.executemany("INSERT INTO users (id, username, password, is_admin) VALUES (?, ?, ?, ?)",
+                          [(i, name, None if pw is None else pw.encode("ascii"), admin) for i, name, pw, admin in rows])
+        elif kind == "c":
+            batch = []
+            for digest, data in rows:
+                data = base64.b64decode(data)
+                self.chunks[digest] = [self.next_chunk, len(data), 0]
+                batch.append((self.next_chunk, digest, len(data), data))
+                self.next_chunk += 1
+            c.executemany("INSERT INTO content_chunks (id, hash, size, refs, data) VALUES (?, ?, ?, 0, ?)", batch)
+        elif kind == "o":
+            placed = []
+            for object_id, _, _, _, _, chunks in rows:
+                offset = 0
+                for digest in chunks:
+                    chunk = self.chunks[digest]
+                    chunk[2] += 1
+                    placed.append((object_id, offset, chunk[0]))
+                    offset += chunk[1]
+            c.executemany("INSERT INTO objects (id, name, owner_id, size, content_hash) VALUES (?, ?, ?, ?, ?)",
+                          [row[:5] for row in rows])
+            c.executemany("INSERT INTO object_chunks (object_id, offset, chunk_id) VALUES (?, ?, ?)", placed)
+        elif kind == "r":
+            rightstore.add_rights(c, rows, effective=False)
+        elif kind == "p":
+            c.executemany("INSERT INTO right_provenance (subject_id, object_id, right_type, source_id, operation, "
+                          "created_at) VALUES (?, ?, ?, ?, ?, ?)", rows)
+        elif kind == "g":
+            c.executemany("INSERT INTO groups (id, name) VALUES (?, ?)", rows)
+        elif kind == "m":
+            c.executemany("INSERT INTO group_members (group_id, user_id) VALUES (?, ?)", rows)
+        elif kind == "gr":
+            c.executemany("""
+                INSERT INTO group_rights (group_id, object_id, mask) VALUES (?, ?, ?)
+                ON CONFLICT (group_id, object_id) DO UPDATE SET mask = mask | excluded.mask
+            """, [(g, o, rightstore.right_bit(c, r, create=True)) for g, o, r in rows])
+        elif kind == "gp":
+            c.executemany("INSERT INTO group_provenance (group_id, object_id, right_type, source_id, operation, "
+                          "created_at) VALUES (?, ?, ?, ?, ?, ?)", rows)
+        elif kind == "a":
+            c.executemany(f"INSERT INTO audit ({', '.join(AUDIT_COLUMNS)}) "
+                          f"VALUES ({', '.join('?' * len(AUDIT_COLUMNS))})", rows)
+        else:
+            raise ValueError(f"Unknown snapshot record: {kind}")
+
+    def finish(self):
+        self.cursor.executemany("UPDATE content_chunks SET refs = ? WHERE id = ?",
+                                [(refs, chunk_id) for chunk_id, _, refs in self.chunks.values()])
+        rightstore.rebuild_effective(self.cursor)
+
+
+def import_snapshot(path, replace=False, verify=True):
+    """
+    Load a snapshot into the database in one transaction. The database must be empty
+    unless replace=True, which deletes the current state (and the audit log, if the
+    snapshot has one) first. Returns the snapshot trailer.
+    """
+    flush_audit()
+    header, lines = _open(path)
+    conn = db.get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        tables = _STATE_TABLES + (("audit",) if header.get("audit") else ())
+        if replace:
+            for table in tables:
+                cursor.execute(f"DELETE FROM {table}")
+        else:
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM users) OR EXISTS (SELECT 1 FROM objects)")
+            if cursor.fetchone()[0]:
+                raise ValueError("Database is not empty, import with replace=True")
+
+        indexes = _drop_indexes(cursor)
+        loader = _Loader(cursor)
+        digest = hashlib.sha256()
+        trailer = None
+        for line in lines:
+            kind, rows = json.loads(line)
+            if kind == "end":
+                trailer = rows
+                break
+            digest.update(line.encode("utf-8"))
+            loader.load(kind, rows)
+        if trailer is None or trailer["sha256"] != digest.hexdigest():
+            raise ValueError(f"{path} is truncated or corrupted")
+        loader.finish()
+        rightstore.rights_changed(cursor)
+        for _, sql in indexes:
+            cursor.execute(sql)
+
+        if verify:
+            # compare before committing, a mismatch leaves the database untouched
+            state = hashlib.sha256()
+            for line, _, _ in _state_lines(conn.cursor(), header.get("audit", False)):
+                state.update(line.encode("utf-8"))
+            if state.hexdigest() != trailer["sha256"]:
+                raise ValueError(f"Imported state does not match {path}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+        lines.close()
+
+    rightstore.reset_cache()
+    reset_graph()
+    decision_cache.clear()
+    return trailer
+
+
+def verify_snapshot(path):
+    """True if the database state (and audit, if the snapshot has it) is exactly the snapshot's."""
+    flush_audit()
+    header, lines = _open(path)
+    with lines:
+        digest = hashlib.sha256()
+        last = None
+        for line in lines:
+            if last is not None:
+                digest.update(last.encode("utf-8"))
+            last = line
+    trailer = json.loads(last)[1] if last else None
+    if trailer is None or trailer["sha256"] != digest.hexdigest():
+        return False
+
+    conn = db.get_db()
+    try:
+        state = hashlib.sha256()
+        for line, _, _ in _state_lines(conn.cursor(), header.get("audit", False)):
+            state.update(line.encode("utf-8"))
+    finally:
+        conn.close()
+    return state.hexdigest() == trailer["sha256"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export / import Take-Grant state snapshots")
+    parser.add_argument("action", choices=["export", "import", "verify"])
+    parser.add_argument("path")
+    parser.add_argument("--audit", action="store_true", help="include the audit log in the export")
+    parser.add_argument("--replace", action="store_true", help="replace the current state on import")
+    parser.add_argument("--no-verify", action="store_true", help="skip comparing the imported state")
+    args = parser.parse_args(argv)
+
+    db.init_db()
+    started = time.perf_counter()
+    try:
+        if args.action == "export":
+            trailer = export_snapshot(args.path, args.audit)
+            print(f"Exported {trailer['counts']} to {args.path} in {time.perf_counter() - started:.2f}s.")
+        elif args.action == "import":
+            trailer = import_snapshot(args.path, args.replace, not args.no_verify)
+            print(f"Imported {trailer['counts']} in {time.perf_counter() - started:.2f}s.")
+        else:
+            ok = verify_snapshot(args.path)
+            print("Database matches the snapshot." if ok else "Database does NOT match the snapshot.")
+            return 0 if ok else 1
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TAKE_GRANT_BCRYPT_ROUNDS", "4")
+
+import audit
+import db
+import graph
+import rightstore
+from cache import decision_cache
+
+
+def _reset():
+    rightstore.reset_cache()
+    graph.reset_graph()
+    decision_cache.clear()
+
+
+@pytest.fixture
+def database(tmp_path):
+    """A new database file per test, audit written synchronously, nothing cached."""
+    audit.configure_audit(mode="sync")
+    db.configure_pool(db_name=str(tmp_path / "take_grant.db"))
+    _reset()
+    db.init_db()
+    yield
+    db.close_pool()
+    _reset()
+
+
+@pytest.fixture
+def users(database):
+    """Ids of four registered users, the first one is admin."""
+    import auth
+    ids = []
+    for name in ("alice", "bob", "carol", "dave"):
+        assert auth.register_user(name, "pw")
+        ids.append(auth.login_user(name, "pw")[0])
+    return ids
@@ -0,0 +1,46 @@
+import analysis
+import db
+import groups
+import objects
+import rights
+from graph import analysis_graph
+
+
+def _replay(path):
+    for step in path:
+        assert getattr(rights, f"{step[0]}_right")(*step[1:])
+
+
+def test_witness_paths_replay(users):
+    alice, bob, carol, dave = users
+    assert objects.create_object("doc", "x", alice)
+    conn = db.get_db()
+    try:
+        doc = conn.execute("SELECT id FROM objects WHERE name = 'doc'").fetchone()[0]
+    finally:
+        conn.close()
+    assert rights.grant_right(alice, bob, doc, "write")
+    ok, path = analysis.can_steal("write", carol, doc, analysis_graph())
+    assert ok and path == [("grant", alice, carol, doc, "take"), ("take", carol, alice, doc, "write")]
+    _replay(path)
+    assert rights.has_access(carol, doc, "write")
+    ok, path = analysis.can_share("read", dave, doc, analysis_graph())
+    assert ok and path == [("grant", alice, dave, doc, "read")]
+    assert analysis.stealable_objects("read", dave, analysis_graph()) == [doc]
+
+
+def test_group_rights_are_not_holders(users):
+    alice, bob, carol, dave = users
+    assert objects.create_object("doc", "x", bob)
+    conn = db.get_db()
+    try:
+        doc = conn.execute("SELECT id FROM objects WHERE name = 'doc'").fetchone()[0]
+    finally:
+        conn.close()
+    team = groups.create_group("team")
+    groups.add_members(team, [dave])
+    assert groups.grant_group_right(bob, team, doc, "read")
+    # dave has access through the group, but may not pass the right on
+    assert rights.has_access(dave, doc, "read")
+    assert not rights.grant_right(dave, carol, doc, "read")
+    assert analysis.can_share("read", carol, doc, analysis_graph()) == (True, [("grant", bob, carol, doc, "read")])
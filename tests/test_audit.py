@@ -0,0 +1,79 @@
+import threading
+
+import pytest
+
+import audit
+import db
+
+
+def _events(flush=True):
+    if flush:
+        audit.flush()
+    conn = db.get_db()
+    try:
+        return [row[0] for row in conn.execute("SELECT action FROM audit ORDER BY id")]
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def settings(database, monkeypatch):
+    """Audit settings changed by the test are restored afterwards."""
+    for name in ("AUDIT_MODE", "BATCH_SIZE", "FLUSH_INTERVAL", "MAX_QUEUE", "OVERFLOW"):
+        monkeypatch.setattr(audit, name, getattr(audit, name))
+    yield
+    audit.shutdown()
+
+
+@pytest.fixture
+def stalled_writer(settings, monkeypatch):
+    """Async audit with room for two queued records and a writer thread that waits for release()."""
+    gate = threading.Event()
+    write = audit._write
+
+    def slow_write(records):
+        if threading.current_thread().name == "audit-writer":
+            gate.wait()
+        write(records)
+
+    monkeypatch.setattr(audit, "_write", slow_write)
+
+    def configure(overflow):
+        audit.configure_audit(mode="async", batch_size=1, max_queue=2, overflow=overflow)
+        audit.log_event("alice", "taken by the writer", "success")
+        while not audit._queue.empty():
+            pass  # until the writer holds the first record
+    yield configure, gate.set
+    gate.set()
+
+
+def test_overflow_drop(stalled_writer, monkeypatch):
+    configure, release = stalled_writer
+    configure("drop")
+    monkeypatch.setattr(audit, "dropped", 0)
+    for i in range(4):
+        audit.log_event("alice", f"event {i}", "success")
+    assert audit.dropped == 2
+    release()
+    assert _events() == ["taken by the writer", "event 0", "event 1"]
+
+
+def test_overflow_sync(stalled_writer):
+    configure, release = stalled_writer
+    configure("sync")
+    for i in range(4):
+        audit.log_event("alice", f"event {i}", "success")
+    # the records that did not fit were written inline, ahead of the queued ones
+    assert _events(flush=False) == ["event 2", "event 3"]
+    release()
+    assert sorted(_events()) == ["event 0", "event 1", "event 2", "event 3", "taken by the writer"]
+
+
+def test_shutdown_writes_queued_records(settings):
+    audit.configure_audit(mode="async", batch_size=1000)
+    for i in range(50):
+        audit.log_event("alice", f"event {i}", "success")
+    writer = audit._writer
+    audit.shutdown()
+    assert not writer.is_alive()
+    assert _events(flush=False) == [f"event {i}" for i in range(50)]
@@ -0,0 +1,14 @@
+import auth
+
+
+def test_only_successful_checks_are_cached(users, monkeypatch):
+    monkeypatch.setattr(auth, "_verified", {})  # the fixture's logins
+    checks = []
+    verify = auth.verify_password
+    monkeypatch.setattr(auth, "verify_password", lambda *a: checks.append(a) or verify(*a))
+    assert auth.login_user("bob", "wrong") is None
+    assert auth.login_user("bob", "wrong") is None
+    assert len(checks) == 2
+    assert auth.login_user("bob", "pw")[0] == users[1]
+    assert auth.login_user("bob", "pw")[0] == users[1]
+    assert len(checks) == 3
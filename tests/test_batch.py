@@ -0,0 +1,104 @@
+import io
+import json
+
+import db
+import main
+import rightstore
+
+
+def _run(commands, group_size=500):
+    out = io.StringIO()
+    main.run_batch([json.dumps(c) if isinstance(c, dict) else c for c in commands], out, group_size)
+    return [json.loads(line) for line in out.getvalue().splitlines()]
+
+
+def _rows(sql, params=()):
+    conn = db.get_db()
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+LOGIN = {"cmd": "login", "username": "alice", "password": "pw"}
+
+
+def test_results_per_line(users):
+    results = _run([
+        LOGIN,
+        {"cmd": "create_obj", "name": "doc", "content": "hello"},
+        "",
+        "not json",
+        {"cmd": "grant", "to": users[1], "obj": 1, "right": "read"},
+        {"cmd": "nope"},
+        {"cmd": "exit"},
+        {"cmd": "create_obj", "name": "never", "content": "x"},
+    ])
+    assert [(r["line"], r.get("cmd"), r["ok"]) for r in results] == [
+        (1, "login", True), (2, "create_obj", True), (4, None, False), (5, "grant", True), (6, "nope", False)]
+    assert _rows("SELECT name FROM objects") == [("doc",)]
+
+
+def test_failing_command_is_rolled_back_alone(users, monkeypatch):
+    def cmd_fail(session, args):
+        db.get_db().execute("INSERT INTO groups (name) VALUES ('half done')")
+        raise RuntimeError("broken")
+    monkeypatch.setitem(main.COMMANDS, "fail", cmd_fail)
+    results = _run([
+        LOGIN,
+        {"cmd": "create_obj", "name": "a", "content": "x"},
+        {"cmd": "fail"},
+        {"cmd": "create_obj", "name": "b", "content": "x"},
+    ])
+    assert [r["ok"] for r in results] == [True, True, False, True]
+    assert results[2]["error"] == "broken"
+    # the group ran again with a savepoint per command, the session still logged in
+    assert _rows("SELECT name FROM objects ORDER BY id") == [("a",), ("b",)]
+    assert _rows("SELECT COUNT(*) FROM groups") == [(0,)]
+    assert _rows("SELECT COUNT(*) FROM audit WHERE operation = 'create_object'") == [(2,)]
+
+
+def test_commands_see_earlier_commands_of_their_group(users):
+    alice, bob, carol, dave = users
+    results = _run([
+        LOGIN,
+        {"cmd": "create_obj", "name": "doc", "content": "x"},
+        {"cmd": "grant", "to": bob, "obj": 1, "right": "read"},
+        {"cmd": "acl", "obj": 1},
+        {"cmd": "login", "username": "bob", "password": "pw"},
+        {"cmd": "read_obj", "obj": 1},
+    ])
+    assert all(r["ok"] for r in results)
+    assert [entry["user"] for entry in results[3]["acl"]] == [alice, bob]
+    assert results[5]["content"] == "x"
+
+
+def test_cascade_in_the_group_that_granted(users):
+    alice, bob, carol, dave = users
+    results = _run([
+        LOGIN,
+        {"cmd": "create_obj", "name": "doc", "content": "x"},
+        {"cmd": "grant", "to": bob, "obj": 1, "right": "read"},
+        {"cmd": "login", "username": "bob", "password": "pw"},
+        {"cmd": "grant", "to": carol, "obj": 1, "right": "read"},
+        LOGIN,
+        {"cmd": "revoke", "user": bob, "obj": 1, "right": "read", "cascade": "y"},
+    ])
+    assert all(r["ok"] for r in results)
+    # carol's right is found through the provenance written by the same group
+    assert _rows("SELECT user_id FROM effective_rights") == [(alice,)]
+    assert _rows("SELECT DISTINCT subject_id FROM right_provenance") == [(alice,)]
+
+
+def test_one_generation_increment_per_group(users):
+    conn = db.get_db()
+    try:
+        before = rightstore.generation(conn.cursor())
+    finally:
+        conn.close()
+    _run([LOGIN] + [{"cmd": "create_obj", "name": f"o{i}", "content": "x"} for i in range(10)], group_size=4)
+    conn = db.get_db()
+    try:
+        assert rightstore.generation(conn.cursor()) == before + 3
+    finally:
+        conn.close()
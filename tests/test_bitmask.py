@@ -0,0 +1,80 @@
+import pytest
+
+import db
+import objects
+import rightstore
+
+
+def _rows(sql, params=()):
+    conn = db.get_db()
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def doc(users):
+    rightstore.set_storage_mode(rightstore.BITMASK)
+    assert objects.create_object("doc", "x", users[0])
+    return _rows("SELECT id FROM objects WHERE name = 'doc'")[0][0]
+
+
+def _add(subject_id, object_id, right_type):
+    conn = db.get_db()
+    try:
+        rightstore.add_right(conn.cursor(), subject_id, object_id, right_type)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def test_new_right_types_get_the_next_bit(users, doc):
+    alice, bob, carol, dave = users
+    _add(bob, doc, "share")
+    _add(bob, doc, "read")
+    _add(carol, doc, "audit")
+    assert _rows("SELECT name, bit FROM right_types ORDER BY bit") == [
+        ("read", 1), ("write", 2), ("take", 4), ("share", 8), ("audit", 16)]
+    assert _rows("SELECT mask FROM rights_mask WHERE subject_id = ?", (bob,)) == [(9,)]
+    conn = db.get_db()
+    try:
+        assert rightstore.has_right(conn.cursor(), carol, doc, "audit")
+        assert not rightstore.has_right(conn.cursor(), carol, doc, "share")
+    finally:
+        conn.close()
+
+
+def test_rows_and_bitmask_hold_the_same_rights(users, doc):
+    alice, bob, carol, dave = users
+    _add(bob, doc, "share")
+    _add(bob, doc, "write")
+    conn = db.get_db()
+    try:
+        held = sorted(rightstore.iter_rights(conn.cursor()))
+    finally:
+        conn.close()
+    rightstore.set_storage_mode(rightstore.ROWS)
+    assert sorted(_rows("SELECT subject_id, object_id, right_type FROM rights")) == held
+    rightstore.set_storage_mode(rightstore.BITMASK)
+    assert _rows("SELECT COUNT(*) FROM rights") == [(0,)]
+    assert _rows("SELECT mask FROM rights_mask WHERE subject_id = ?", (bob,)) == [(10,)]
+
+
+def test_bit_of_a_rolled_back_transaction_is_not_kept(users, doc):
+    alice, bob, carol, dave = users
+    with pytest.raises(RuntimeError):
+        with db.transaction_group() as conn:
+            rightstore.add_right(conn.cursor(), bob, doc, "share")
+            raise RuntimeError("rolled back")
+    assert _rows("SELECT bit FROM right_types WHERE name = 'share'") == []
+    # another connection takes bit 8 for another right type
+    conn = db.get_db()
+    try:
+        conn.execute("INSERT INTO right_types (name, bit) VALUES ('audit', 8)")
+        conn.commit()
+        assert rightstore.right_bit(conn.cursor(), "share") == 0
+        assert rightstore.right_bit(conn.cursor(), "share", create=True) == 16
+        conn.commit()
+    finally:
+        conn.close()
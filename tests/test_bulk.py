@@ -0,0 +1,70 @@
+import pytest
+
+import db
+import objects
+import rights
+import rightstore
+
+
+@pytest.fixture
+def doc(users):
+    assert objects.create_object("doc", "x", users[0])
+    conn = db.get_db()
+    try:
+        return conn.execute("SELECT id FROM objects WHERE name = 'doc'").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _rows(sql, params=()):
+    conn = db.get_db()
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+def _has(subject_id, object_id, right_type):
+    conn = db.get_db()
+    try:
+        return rightstore.has_right(conn.cursor(), subject_id, object_id, right_type)
+    finally:
+        conn.close()
+
+
+def test_empty_batch(database):
+    assert rights.grant_rights_bulk([]) == []
+    assert rights.take_rights_bulk([]) == []
+
+
+def test_grants_see_earlier_items_of_the_batch(users, doc):
+    alice, bob, carol, dave = users
+    results = rights.grant_rights_bulk([
+        (alice, bob, doc, "read"),
+        (bob, carol, doc, "read"),    # bob got read one item earlier
+        (dave, carol, doc, "write"),  # dave holds nothing
+        (alice, bob, doc, "read"),    # already held
+    ])
+    assert [ok for ok, _ in results] == [True, True, False, True]
+    assert results[3][1] == "Target already has this right."
+    assert _has(carol, doc, "read") and not _has(carol, doc, "write")
+    assert _rows("SELECT source_id FROM right_provenance WHERE subject_id = ? AND object_id = ?",
+                 (carol, doc)) == [(bob,)]
+    # one audit record per item, in the same transaction
+    assert _rows("SELECT result, actor_id, target_user_id FROM audit WHERE operation = 'grant' ORDER BY id") == [
+        ("success", alice, bob), ("success", bob, carol), ("fail", dave, carol), ("success", alice, bob)]
+
+
+def test_takes(users, doc):
+    alice, bob, carol, dave = users
+    rights.grant_rights_bulk([(alice, bob, doc, "write"), (alice, dave, doc, "take")])
+    results = rights.take_rights_bulk([
+        (dave, bob, doc, "write"),
+        (carol, bob, doc, "write"),   # carol has no take
+        (dave, carol, doc, "read"),   # carol holds no read
+    ])
+    assert [ok for ok, _ in results] == [True, False, False]
+    assert _has(dave, doc, "write") and not _has(carol, doc, "write")
+    assert _rows("SELECT source_id, operation FROM right_provenance WHERE subject_id = ? AND right_type = 'write'",
+                 (dave,)) == [(bob, "take")]
+    assert rights.has_access(dave, doc, "write")
@@ -0,0 +1,82 @@
+import pytest
+
+import db
+import groups
+import objects
+import rights
+from cache import DecisionCache, decision_cache
+
+
+@pytest.fixture
+def doc(users):
+    assert objects.create_object("doc", "x", users[0])
+    conn = db.get_db()
+    try:
+        return conn.execute("SELECT id FROM objects WHERE name = 'doc'").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_revoke_invalidates_only_its_decision(users, doc):
+    alice, bob, carol, dave = users
+    assert rights.grant_right(alice, bob, doc, "read")
+    assert rights.has_access(bob, doc, "read")
+    assert not rights.has_access(carol, doc, "read")
+    assert decision_cache.get(bob, doc, "read") is True
+    rights.revoke_right(bob, doc, "read")
+    assert decision_cache.get(bob, doc, "read") is None
+    assert decision_cache.get(carol, doc, "read") is False
+    assert not rights.has_access(bob, doc, "read")
+
+
+def test_cascade_invalidates_derived_decisions(users, doc):
+    alice, bob, carol, dave = users
+    assert rights.grant_right(alice, bob, doc, "read")
+    assert rights.grant_right(bob, carol, doc, "read")
+    assert rights.has_access(carol, doc, "read")
+    rights.revoke_right(bob, doc, "read", cascade=True)
+    assert not rights.has_access(carol, doc, "read")
+
+
+def test_group_revoke_invalidates_the_members(users, doc):
+    alice, bob, carol, dave = users
+    team = groups.create_group("team")
+    groups.add_members(team, [dave])
+    assert groups.grant_group_right(alice, team, doc, "write")
+    assert rights.has_access(dave, doc, "write")
+    groups.revoke_group_right(team, doc, "write")
+    assert not rights.has_access(dave, doc, "write")
+    assert groups.grant_group_right(alice, team, doc, "write")
+    assert rights.has_access(dave, doc, "write")
+    groups.remove_members(team, [dave])
+    assert not rights.has_access(dave, doc, "write")
+
+
+def test_revoke_in_a_group_invalidates_at_commit(users, doc):
+    alice, bob, carol, dave = users
+    assert rights.grant_right(alice, bob, doc, "read")
+    assert rights.has_access(bob, doc, "read")
+    with pytest.raises(RuntimeError):
+        with db.transaction_group():
+            rights.revoke_right(bob, doc, "read")
+            raise RuntimeError("rolled back")
+    assert decision_cache.get(bob, doc, "read") is True
+    with db.transaction_group():
+        rights.revoke_right(bob, doc, "read")
+        assert decision_cache.get(bob, doc, "read") is True
+    assert not rights.has_access(bob, doc, "read")
+
+
+def test_lru_and_ttl():
+    cache = DecisionCache(max_size=2, ttl=60)
+    cache.put(1, 1, "read", True)
+    cache.put(1, 2, "read", False)
+    assert cache.get(1, 1, "read") is True
+    cache.put(1, 3, "read", True)  # evicts (1, 2), used least recently
+    assert cache.get(1, 2, "read") is None
+    assert cache.get(1, 1, "read") is True
+    cache.invalidate_user(1)
+    assert cache.stats()["size"] == 0
+    expired = DecisionCache(ttl=-1)
+    expired.put(1, 1, "read", True)
+    assert expired.get(1, 1, "read") is None
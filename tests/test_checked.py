@@ -0,0 +1,65 @@
+import db
+import objects
+import rights
+from cache import decision_cache
+
+
+def _rows(sql, params=()):
+    conn = db.get_db()
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+def _create(name, owner_id):
+    assert objects.create_object(name, "hello world", owner_id)
+    return _rows("SELECT id FROM objects WHERE name = ?", (name,))[0][0]
+
+
+def test_read_and_write(users):
+    alice, bob, carol, dave = users
+    doc = _create("doc", alice)
+    read = objects.read_object_checked(alice, doc, username="alice", offset=6, length=5)
+    assert read == {"ok": True, "name": "doc", "owner_id": alice, "size": 11, "content": b"world"}
+    assert objects.write_object_checked(alice, doc, "new", username="alice") == {"ok": True, "name": "doc", "size": 3}
+    assert objects.read_object_checked(alice, doc)["content"] == b"new"
+    assert _rows("SELECT result, actor_id FROM audit WHERE operation IN ('read', 'write') ORDER BY id") == [
+        ("success", alice), ("success", alice), ("success", alice)]
+
+
+def test_denied(users):
+    alice, bob, carol, dave = users
+    doc = _create("doc", alice)
+    assert rights.grant_right(alice, bob, doc, "read")
+    assert objects.write_object_checked(bob, doc, "mine", username="bob") == {"ok": False, "error": "denied"}
+    assert objects.delete_object_checked(carol, doc) == {"ok": False, "error": "denied"}
+    assert objects.read_object_checked(None, doc) == {"ok": False, "error": "denied"}
+    assert objects.read_object_checked(alice, doc)["content"] == b"hello world"
+    assert _rows("SELECT user, operation, result FROM audit WHERE result = 'denied' ORDER BY id") == [
+        ("bob", "write", "denied"), ("anonymous", "delete_object", "denied"), ("anonymous", "read", "denied")]
+
+
+def test_not_found(users):
+    alice, bob, carol, dave = users
+    doc = _create("doc", alice)
+    # the right outlived its object (another connection deleted the row)
+    conn = db.get_db()
+    try:
+        conn.execute("DELETE FROM objects WHERE id = ?", (doc,))
+        conn.commit()
+    finally:
+        conn.close()
+    assert objects.read_object_checked(alice, doc) == {"ok": False, "error": "not found"}
+    assert objects.write_object_checked(alice, doc, "x") == {"ok": False, "error": "not found"}
+    assert _rows("SELECT result FROM audit WHERE object_id = ? AND operation = 'write'", (doc,)) == [("fail",)]
+
+
+def test_check_ignores_a_stale_cached_decision(users):
+    alice, bob, carol, dave = users
+    doc = _create("doc", alice)
+    # what the cache of this process may still say after another process revoked the right
+    decision_cache.put(bob, doc, "write", True)
+    assert rights.has_access(bob, doc, "write")
+    assert objects.write_object_checked(bob, doc, "mine") == {"ok": False, "error": "denied"}
+    assert objects.read_object_checked(alice, doc)["content"] == b"hello world"
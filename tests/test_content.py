@@ -0,0 +1,92 @@
+import hashlib
+import io
+import random
+
+import pytest
+
+import auth
+import contentstore
+import db
+import objects
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(contentstore, "CHUNK_SIZE", 16)
+
+
+def _rows(sql, params=()):
+    conn = db.get_db()
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+def _create(name, content, owner_id):
+    assert objects.create_object(name, content, owner_id)
+    return _rows("SELECT id FROM objects WHERE name = ?", (name,))[0][0]
+
+
+def _read(object_id, offset=0, length=None):
+    conn = db.get_db()
+    try:
+        return contentstore.read_content(conn.cursor(), object_id, offset, length)
+    finally:
+        conn.close()
+
+
+def _write(object_id, source):
+    conn = db.get_db()
+    try:
+        size = contentstore.write_content(conn.cursor(), object_id, source)
+        conn.commit()
+        return size
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("size", [0, 1, 16, 17, 53])
+def test_round_trip(users, size):
+    data = bytes(random.Random(size).randrange(256) for _ in range(size))
+    obj = _create("doc", "", users[0])
+    for source in (data, io.BytesIO(data)):
+        assert _write(obj, source) == size
+        assert _read(obj) == data
+    assert _rows("SELECT size, content_hash FROM objects WHERE id = ?", (obj,)) == [
+        (size, hashlib.sha256(data).hexdigest())]
+    for offset in range(0, size + 2, 5):
+        for length in (0, 1, 15, 16, 17, 40, None):
+            end = None if length is None else offset + length
+            assert _read(obj, offset, length) == data[offset:end]
+
+
+def test_text_is_stored_as_utf8(users):
+    obj = _create("doc", "grüße " * 10, users[0])
+    assert _read(obj).decode("utf-8") == "grüße " * 10
+
+
+def test_shared_chunks_are_counted(users):
+    alice, bob, carol, dave = users
+    text = "a" * 16 + "b" * 16 + "c" * 5
+    first = _create("first", text, alice)
+    second = _create("second", text, bob)
+    assert _rows("SELECT size, refs FROM content_chunks ORDER BY id") == [(16, 2), (16, 2), (5, 2)]
+    # the first chunk stays shared, the others are replaced
+    _write(second, "a" * 16 + "d")
+    assert _rows("SELECT size, refs FROM content_chunks ORDER BY id") == [(16, 2), (16, 1), (5, 1), (1, 1)]
+    objects.delete_object(first)
+    assert _rows("SELECT size, refs FROM content_chunks ORDER BY id") == [(16, 1), (1, 1)]
+    assert _read(second) == b"a" * 16 + b"d"
+    objects.delete_object(second)
+    assert _rows("SELECT COUNT(*) FROM content_chunks") == [(0,)]
+
+
+def test_owned_content_goes_with_the_user(users):
+    alice, bob, carol, dave = users
+    _create("one", "x" * 20, bob)
+    _create("two", "x" * 20, bob)
+    _create("kept", "x" * 20, carol)
+    auth.delete_user(bob, owned="delete")
+    assert _rows("SELECT refs FROM content_chunks ORDER BY id") == [(1,), (1,)]
+    assert _rows("SELECT COUNT(*) FROM object_chunks") == [(2,)]
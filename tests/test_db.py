@@ -0,0 +1,129 @@
+import sqlite3
+
+import pytest
+
+import db
+
+
+def _count(sql):
+    conn = db.get_db()
+    try:
+        return conn.execute(sql).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_connections_are_reused(database):
+    first = db.get_db()
+    raw = first._conn
+    first.close()
+    second = db.get_db()
+    try:
+        assert second._conn is raw
+    finally:
+        second.close()
+    assert db.get_pool()._opened == 1
+
+
+def test_release_rolls_back_an_open_transaction(database):
+    done = []
+    conn = db.get_db()
+    conn.execute("INSERT INTO groups (name) VALUES ('half done')")
+    db.after_commit(done.append, "committed", conn=conn)
+    conn.close()
+    assert _count("SELECT COUNT(*) FROM groups") == 0
+    conn = db.get_db()
+    try:
+        assert not conn.in_transaction
+    finally:
+        conn.close()
+    assert done == []
+
+
+def test_after_commit_runs_at_commit(database):
+    done = []
+    conn = db.get_db()
+    try:
+        conn.execute("INSERT INTO groups (name) VALUES ('team')")
+        db.after_commit(done.append, "committed", conn=conn)
+        assert done == []
+        conn.commit()
+        assert done == ["committed"]
+    finally:
+        conn.close()
+
+
+def test_pool_size_is_a_limit(database, monkeypatch):
+    monkeypatch.setattr(db, "POOL_SIZE", 2)
+    monkeypatch.setattr(db, "DB_TIMEOUT", 0.1)
+    db.close_pool()
+    held = [db.get_db(), db.get_db()]
+    with pytest.raises(sqlite3.OperationalError):
+        db.get_db()
+    held.pop().close()
+    conn = db.get_db()
+    conn.close()
+    held.pop().close()
+    assert db.get_pool()._opened == 2
+
+
+def test_closed_proxy_refuses_work(database):
+    conn = db.get_db()
+    conn.close()
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1")
+
+
+# the schema before migration 1, as the first release created it
+V0_SCHEMA = """
+CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE, password BLOB,
+                    is_admin INTEGER DEFAULT 0);
+CREATE TABLE objects (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE, content TEXT, owner_id INTEGER);
+CREATE TABLE rights (id INTEGER PRIMARY KEY AUTOINCREMENT, subject_id INTEGER, object_id INTEGER, right_type TEXT);
+CREATE TABLE audit (id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    user TEXT, action TEXT, result TEXT, target_user_id INTEGER, object_name TEXT);
+"""
+
+
+def test_migrate_a_version_0_database(database, tmp_path):
+    import auth
+    import objects
+    import rights
+    import rightstore
+
+    path = str(tmp_path / "v0.db")
+    old = sqlite3.connect(path)
+    old.executescript(V0_SCHEMA)
+    hashed = auth.hash_password("pw")
+    old.executemany("INSERT INTO users (username, password, is_admin) VALUES (?, ?, ?)",
+                    [("alice", hashed, 1), ("bob", hashed, 0)])
+    old.execute("INSERT INTO objects (name, content, owner_id) VALUES ('doc', 'hello', 1)")
+    old.executemany("INSERT INTO rights (subject_id, object_id, right_type) VALUES (?, 1, ?)",
+                    [(1, "read"), (1, "write"), (1, "take"), (2, "read"), (2, "read")])
+    old.execute("INSERT INTO audit (user, action, result, target_user_id) "
+                "VALUES ('alice', 'grant read obj 1 to user 2', 'success', 2)")
+    old.commit()
+    old.close()
+
+    db.configure_pool(db_name=path)
+    rightstore.reset_cache()
+    db.init_db()
+    conn = db.get_db()
+    try:
+        assert db.schema_version(conn) == db.MIGRATIONS[-1][0] == 13
+    finally:
+        conn.close()
+    assert _count("SELECT COUNT(*) FROM rights WHERE subject_id = 2") == 1
+    assert _count("SELECT COUNT(*) FROM objects WHERE content IS NOT NULL") == 0
+    assert objects.read_object_checked(2, 1)["content"] == b"hello"
+    assert rights.has_access(2, 1, "read") and not rights.has_access(2, 1, "write")
+    assert _count("SELECT source_id FROM right_provenance WHERE subject_id = 2") == 1
+    assert _count("SELECT operation FROM audit WHERE id = 1") == "grant"
+    assert _count("SELECT objects FROM user_access_counts WHERE user_id = 2") == 1
+    assert auth.login_user("bob", "pw")[0] == 2
+    # running the migrations again changes nothing
+    conn = db.get_db()
+    try:
+        assert db.migrate(conn) == 13
+    finally:
+        conn.close()
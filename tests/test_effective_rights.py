@@ -0,0 +1,140 @@
+import random
+
+import pytest
+
+import auth
+import db
+import groups
+import objects
+import rights
+import rightstore
+
+RIGHT_TYPES = ("read", "write", "take")
+# tables kept up to date incrementally that rebuild_effective() recomputes from scratch
+DERIVED_TABLES = ("effective_rights", "user_access_counts", "object_access_counts")
+# random operations and how often they are picked
+STEPS = {"grant": 4, "take": 2, "revoke": 2, "bulk_grant": 1, "group_add": 2, "group_remove": 2,
+         "group_grant": 4, "group_revoke": 2, "group_delete": 0.3, "object_delete": 0.5,
+         "user_delete": 0.3, "register": 0.5}
+
+
+def _tables(cursor):
+    return {table: sorted(cursor.execute(f"SELECT * FROM {table}").fetchall()) for table in DERIVED_TABLES}
+
+
+def _assert_matches_rebuild():
+    conn = db.get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN")
+        incremental = _tables(cursor)
+        rightstore.rebuild_effective(cursor)
+        assert incremental == _tables(cursor)
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def _assert_provenance_matches_rights():
+    """Every right has provenance, and there is none for rights nobody holds."""
+    conn = db.get_db()
+    try:
+        held = set(rightstore.iter_rights(conn.cursor()))
+        derived = set(conn.execute("SELECT subject_id, object_id, right_type FROM right_provenance").fetchall())
+    finally:
+        conn.close()
+    assert held == derived
+
+
+def _query(sql):
+    conn = db.get_db()
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+
+def _held(rnd):
+    """A random direct right (subject_id, object_id, right_type), or None."""
+    conn = db.get_db()
+    try:
+        held = sorted(rightstore.iter_rights(conn.cursor()))
+    finally:
+        conn.close()
+    return rnd.choice(held) if held else None
+
+
+def _random_step(rnd, state):
+    user_ids, group_ids = state["users"], state["groups"]
+    step = rnd.choices(list(STEPS), list(STEPS.values()))[0]
+    held = _held(rnd)
+    user, group = rnd.choice(user_ids), rnd.choice(group_ids)
+    if step == "grant" and held:
+        rights.grant_right(held[0], user, held[1], held[2])
+    elif step == "take" and held:
+        rights.take_right(user, held[0], held[1], held[2])
+    elif step == "revoke" and held:
+        rights.revoke_right(*held, cascade=rnd.random() < 0.5)
+    elif step == "bulk_grant":
+        items = [_held(rnd) for _ in range(5)]
+        rights.grant_rights_bulk([(s, rnd.choice(user_ids), o, r) for s, o, r in filter(None, items)])
+    elif step == "group_add":
+        groups.add_members(group, rnd.sample(user_ids, 2))
+    elif step == "group_remove":
+        groups.remove_members(group, rnd.sample(user_ids, 2))
+    elif step == "group_grant" and held:
+        groups.grant_group_right(held[0], group, held[1], held[2])
+    elif step == "group_revoke":
+        granted = _query("SELECT g.group_id, g.object_id, t.name FROM group_rights g "
+                         "JOIN right_types t ON g.mask & t.bit != 0 ORDER BY 1, 2, 3")
+        if granted:
+            groups.revoke_group_right(*rnd.choice(granted))
+    elif step == "group_delete":
+        groups.delete_group(group)
+        group_ids.remove(group)
+        group_ids.append(groups.create_group(f"group{rnd.randrange(10 ** 9)}"))
+    elif step == "object_delete":
+        objects.delete_object(rnd.choice(_query("SELECT id FROM objects ORDER BY id"))[0])
+        objects.create_object(f"obj{rnd.randrange(10 ** 9)}", "x", user)
+    elif step == "user_delete" and len(user_ids) > 3:
+        auth.delete_user(user, owned=rnd.choice(("delete", "keep")), transitive=rnd.random() < 0.5)
+        user_ids.remove(user)
+        if len(_query("SELECT id FROM objects")) < 4:
+            objects.create_object(f"obj{rnd.randrange(10 ** 9)}", "x", rnd.choice(user_ids))
+    elif step == "register":
+        name = f"user{rnd.randrange(10 ** 9)}"
+        auth.register_user(name, "pw")
+        user_ids.append(auth.login_user(name, "pw")[0])
+
+
+@pytest.mark.parametrize("storage", [rightstore.ROWS, rightstore.BITMASK])
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_incremental_matches_rebuild(users, storage, seed):
+    rightstore.set_storage_mode(storage)
+    rnd = random.Random(seed)
+    for i in range(6):
+        objects.create_object(f"obj{i}", "x", rnd.choice(users))
+    state = {"users": list(users), "groups": [groups.create_group(f"group{i}") for i in range(3)]}
+    for _ in range(200):
+        _random_step(rnd, state)
+        _assert_matches_rebuild()
+    _assert_provenance_matches_rights()
+    # the walk reached the group paths
+    assert _query("SELECT COUNT(*) FROM group_rights")[0][0] > 0
+
+
+@pytest.mark.parametrize("storage", [rightstore.ROWS, rightstore.BITMASK])
+def test_incremental_matches_rebuild_in_transaction_groups(users, storage):
+    # batch mode: provenance and effective_rights additions wait for the end of the group
+    rightstore.set_storage_mode(storage)
+    rnd = random.Random(4)
+    for i in range(6):
+        objects.create_object(f"obj{i}", "x", rnd.choice(users))
+    state = {"users": list(users), "groups": [groups.create_group(f"group{i}") for i in range(3)]}
+    for _ in range(60):
+        with db.transaction_group():
+            for _ in range(10):
+                _random_step(rnd, state)
+        _assert_matches_rebuild()
+        _assert_provenance_matches_rights()
+    assert _query("SELECT COUNT(*) FROM group_rights")[0][0] > 0
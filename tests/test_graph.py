@@ -0,0 +1,55 @@
+import sqlite3
+
+import pytest
+
+import db
+import graph
+import objects
+import rights
+import rightstore
+
+
+@pytest.fixture
+def doc(users):
+    assert objects.create_object("doc", "x", users[0])
+    conn = db.get_db()
+    try:
+        return conn.execute("SELECT id FROM objects WHERE name = 'doc'").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _other_process(change, *args):
+    """Change the rights through a connection outside the pool, as another process would."""
+    conn = sqlite3.connect(db.DB_NAME)
+    try:
+        change(conn.cursor(), *args)
+        conn.commit()
+    finally:
+        db._pending.pop(conn, None)
+        conn.close()
+
+
+def test_own_changes_need_no_reload(users, doc, monkeypatch):
+    alice, bob, carol, dave = users
+    g = graph.load_graph()
+    monkeypatch.setattr(graph, "GENERATION_CHECK_INTERVAL", 0)
+    monkeypatch.setattr(g, "load", lambda conn=None: pytest.fail("reloaded"))
+    assert rights.grant_right(alice, bob, doc, "read")
+    assert g.refresh().has_right(bob, doc, "read")
+    rights.revoke_right(bob, doc, "read")
+    assert not g.refresh().has_right(bob, doc, "read")
+
+
+def test_external_writes_are_picked_up(users, doc, monkeypatch):
+    alice, bob, carol, dave = users
+    g = graph.load_graph()
+    _other_process(rightstore.add_right, bob, doc, "write")
+    # within GENERATION_CHECK_INTERVAL the graph may still be stale
+    assert not g.refresh().has_right(bob, doc, "write")
+    monkeypatch.setattr(graph, "GENERATION_CHECK_INTERVAL", 0)
+    assert g.refresh().has_right(bob, doc, "write")
+    assert rights.has_access(bob, doc, "write")
+    _other_process(rightstore.remove_right, alice, doc, "read")
+    assert not g.refresh().has_right(alice, doc, "read")
+    assert g.verify() == (set(), set())
@@ -0,0 +1,53 @@
+import pytest
+
+import audit
+import metrics
+import objects
+import rights
+
+
+@pytest.fixture
+def enabled(users):
+    metrics.enable()
+    metrics.reset()
+    yield
+    metrics.disable()
+    metrics.reset()
+
+
+def test_calls_and_statements(users, enabled):
+    alice, bob, carol, dave = users
+    assert objects.create_object("doc", "x", alice)
+    assert rights.grant_right(alice, bob, 1, "read")
+    assert not rights.grant_right(carol, dave, 1, "read")
+    snapshot = metrics.snapshot()
+    grant = snapshot["calls"]["rights.grant_right"]
+    assert grant["count"] == 2 and grant["errors"] == 0 and grant["sql_statements"] > 0
+    assert snapshot["sql"]["INSERT"]["statements"] > 0
+    assert "db.acquire" in snapshot["sections"]
+    assert 'take_grant_call_seconds_count{function="rights.grant_right"} 2' in metrics.prometheus_text()
+
+
+def test_errors_are_counted(enabled):
+    @metrics.instrument
+    def broken():
+        raise ValueError("broken")
+
+    with pytest.raises(ValueError):
+        broken()
+    assert metrics.snapshot()["calls"][f"{__name__}.test_errors_are_counted.<locals>.broken"]["errors"] == 1
+
+
+def test_internal_audit_helpers_are_not_instrumented(enabled):
+    audit.parse_action("grant read obj 1 to user 2")
+    audit.flush()
+    audit.log_event("alice", "other", "success", operation="other")
+    calls = metrics.snapshot()["calls"]
+    assert "audit.log_event" in calls
+    assert not {"audit.parse_action", "audit.flush", "audit.shutdown", "audit.configure_audit"} & set(calls)
+
+
+def test_disabled_records_nothing(users):
+    metrics.reset()
+    assert objects.create_object("doc", "x", users[0])
+    assert metrics.snapshot()["calls"] == {}
@@ -0,0 +1,140 @@
+import pytest
+
+import auth
+import db
+import groups
+import objects
+import rights
+import rightstore
+
+
+def _create(name, owner_id):
+    assert objects.create_object(name, "x", owner_id)
+    conn = db.get_db()
+    try:
+        return conn.execute("SELECT id FROM objects WHERE name = ?", (name,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _has(subject_id, object_id, right_type):
+    conn = db.get_db()
+    try:
+        return rightstore.has_right(conn.cursor(), subject_id, object_id, right_type)
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def chain(users):
+    """alice owns an object and grants read to bob, bob to carol, carol to dave."""
+    alice, bob, carol, dave = users
+    obj = _create("doc", alice)
+    assert rights.grant_right(alice, bob, obj, "read")
+    assert rights.grant_right(bob, carol, obj, "read")
+    assert rights.grant_right(carol, dave, obj, "read")
+    return obj
+
+
+def test_revoke_without_cascade_keeps_derived_rights(users, chain):
+    alice, bob, carol, dave = users
+    assert rights.revoke_right(bob, chain, "read") == [(bob, chain, "read")]
+    assert _has(carol, chain, "read") and _has(dave, chain, "read")
+
+
+def test_cascade_revokes_the_whole_chain(users, chain):
+    alice, bob, carol, dave = users
+    removed = rights.revoke_right(bob, chain, "read", cascade=True)
+    assert sorted(removed) == sorted([(bob, chain, "read"), (carol, chain, "read"), (dave, chain, "read")])
+    assert _has(alice, chain, "read")
+    assert not any(_has(u, chain, "read") for u in (bob, carol, dave))
+
+
+def test_cascade_keeps_rights_with_another_source(users, chain):
+    alice, bob, carol, dave = users
+    # dave also got read from alice, who keeps hers
+    assert rights.grant_right(alice, dave, chain, "read")
+    rights.revoke_right(bob, chain, "read", cascade=True)
+    assert not _has(carol, chain, "read")
+    assert _has(dave, chain, "read")
+
+
+def test_cascade_follows_take(users, chain):
+    alice, bob, carol, dave = users
+    assert rights.grant_right(alice, dave, chain, "take")
+    assert rights.grant_right(alice, bob, chain, "write")
+    assert rights.take_right(dave, bob, chain, "write")
+    rights.revoke_right(bob, chain, "write", cascade=True)
+    assert not _has(dave, chain, "write")
+
+
+def test_transitive_user_deletion(users, chain):
+    alice, bob, carol, dave = users
+    report = auth.delete_user(bob, transitive=True)
+    assert report["deleted"]
+    assert sorted(report["derived_rights"]) == sorted([(carol, chain, "read"), (dave, chain, "read")])
+    assert not _has(carol, chain, "read")
+
+
+def test_user_deletion_without_transitive_keeps_derived_rights(users, chain):
+    alice, bob, carol, dave = users
+    report = auth.delete_user(bob)
+    assert report["deleted"] and report["derived_rights"] == []
+    assert _has(carol, chain, "read")
+
+
+def test_migration_derives_provenance_from_old_audit_records(users):
+    alice, bob, carol, dave = users
+    obj = _create("doc", alice)
+    assert rights.grant_right(alice, bob, obj, "read")
+    conn = db.get_db()
+    try:
+        # a database from before migration 8: no provenance, audit records with the action string only
+        conn.execute("DELETE FROM right_provenance")
+        conn.execute("INSERT INTO audit (user, action, result, target_user_id) VALUES (?, ?, 'success', ?)",
+                     ("alice", f"grant read obj {obj} to user {bob}", bob))
+        conn.execute("PRAGMA user_version = 7")
+        conn.commit()
+        db.migrate(conn)
+        rows = conn.execute("SELECT source_id, operation FROM right_provenance WHERE subject_id = ?",
+                            (bob,)).fetchall()
+    finally:
+        conn.close()
+    assert rows == [(alice, "grant")]
+    rights.revoke_right(alice, obj, "read", cascade=True)
+    assert not _has(bob, obj, "read")
+
+
+def test_cascade_revokes_group_rights_granted_from_it(users, chain):
+    alice, bob, carol, dave = users
+    team = groups.create_group("team")
+    other = groups.create_group("other")
+    groups.add_members(team, [dave])
+    groups.add_members(other, [dave])
+    assert groups.grant_group_right(carol, team, chain, "write") is False  # carol has no write
+    assert groups.grant_group_right(carol, team, chain, "read")
+    assert groups.grant_group_right(carol, other, chain, "read")
+    assert groups.grant_group_right(alice, other, chain, "read")
+    assert rights.revoke_right(dave, chain, "read")
+    rights.revoke_right(bob, chain, "read", cascade=True)
+    conn = db.get_db()
+    try:
+        granted = conn.execute("SELECT group_id FROM group_rights WHERE object_id = ?", (chain,)).fetchall()
+    finally:
+        conn.close()
+    # team had read from carol only, other also from alice
+    assert granted == [(other,)]
+    assert rights.has_access(dave, chain, "read")
+    groups.revoke_group_right(other, chain, "read")
+    assert not rights.has_access(dave, chain, "read")
+
+
+def test_transitive_user_deletion_revokes_group_rights(users, chain):
+    alice, bob, carol, dave = users
+    team = groups.create_group("team")
+    groups.add_members(team, [dave])
+    assert groups.grant_group_right(carol, team, chain, "read")
+    assert rights.revoke_right(dave, chain, "read")
+    report = auth.delete_user(bob, transitive=True)
+    assert report["derived_group_rights"] == [(team, chain, "read")]
+    assert not rights.has_access(dave, chain, "read")
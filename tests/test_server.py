@@ -0,0 +1,75 @@
+import asyncio
+import json
+
+import db
+import server
+
+
+async def _request(reader, writer, **args):
+    writer.write((json.dumps(args) + "\n").encode("utf-8"))
+    await writer.drain()
+    return json.loads(await reader.readline())
+
+
+async def _client(path, name, objects):
+    reader, writer = await asyncio.open_unix_connection(path)
+    try:
+        results = [await _request(reader, writer, cmd="login", username=name, password="pw")]
+        for i in range(objects):
+            results.append(await _request(reader, writer, id=i, cmd="create_obj", name=f"{name}{i}", content="x"))
+        results.append(await _request(reader, writer, cmd="list_obj"))
+        return results
+    finally:
+        writer.close()
+
+
+def _with_server(tmp_path, test):
+    path = str(tmp_path / "server.sock")
+
+    async def run():
+        serving = asyncio.create_task(server.TakeGrantServer().serve(unix_path=path))
+        for _ in range(100):
+            if (tmp_path / "server.sock").exists():
+                break
+            await asyncio.sleep(0.05)
+        try:
+            return await test(path)
+        finally:
+            serving.cancel()
+            await asyncio.gather(serving, return_exceptions=True)
+    return asyncio.run(run())
+
+
+def test_concurrent_clients(users, tmp_path):
+    async def test(path):
+        return await asyncio.gather(*(_client(path, name, 20) for name in ("alice", "bob", "carol", "dave")))
+
+    for results in _with_server(tmp_path, test):
+        assert all(r["ok"] for r in results)
+        assert [r["id"] for r in results[1:-1]] == list(range(20))
+    conn = db.get_db()
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM objects").fetchone() == (80,)
+        assert conn.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+    finally:
+        conn.close()
+
+
+def test_sessions(users, tmp_path):
+    async def test(path):
+        reader, writer = await asyncio.open_unix_connection(path)
+        try:
+            results = [await _request(reader, writer, cmd="show_audit")]
+            login = await _request(reader, writer, cmd="login", username="bob", password="pw")
+            results.append(await _request(reader, writer, cmd="show_audit"))
+            results.append(await _request(reader, writer, cmd="resume", token="nope"))
+            results.append(await _request(reader, writer, cmd="resume", token=login["token"]))
+            return results
+        finally:
+            writer.close()
+
+    not_logged_in, denied, invalid, resumed = _with_server(tmp_path, test)
+    assert not_logged_in == {"cmd": "show_audit", "ok": False, "error": "not logged in"}
+    assert denied == {"cmd": "show_audit", "ok": False, "error": "denied"}
+    assert invalid == {"cmd": "resume", "ok": False, "error": "invalid or expired token"}
+    assert resumed == {"cmd": "resume", "ok": True, "user_id": users[1]}
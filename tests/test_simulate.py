@@ -0,0 +1,24 @@
+import db
+import objects
+import rights
+import simulate
+from graph import analysis_graph
+
+
+def test_attack_steps_take_first(users):
+    alice, bob, carol, dave = users
+    assert objects.create_object("doc", "x", alice)
+    conn = db.get_db()
+    try:
+        doc = conn.execute("SELECT id FROM objects WHERE name = 'doc'").fetchone()[0]
+    finally:
+        conn.close()
+    # bob only holds take, so carol gets everything through bob's trojan
+    assert rights.grant_right(alice, bob, doc, "take")
+    view = simulate.RightsView(analysis_graph())
+    assert simulate.attack(view, carol, [bob]) == {doc: 7}
+    assert simulate.attack_steps(view, carol, [bob]) == [
+        ("trojan_grant", bob, carol, doc, "take"),
+        ("take", carol, alice, doc, "read"),
+        ("take", carol, alice, doc, "write"),
+    ]
@@ -0,0 +1,84 @@
+import gzip
+
+import pytest
+
+import audit
+import db
+import groups
+import objects
+import rights
+import rightstore
+import snapshot
+
+
+def _rows(sql, params=()):
+    conn = db.get_db()
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+def _use(path):
+    """Switch to another (new) database file."""
+    db.configure_pool(db_name=str(path))
+    rightstore.reset_cache()
+    db.init_db()
+
+
+@pytest.fixture
+def state(users, tmp_path):
+    alice, bob, carol, dave = users
+    big = "".join(f"line {i}\n" for i in range(20000))  # several content chunks
+    assert objects.create_object("big", big, alice)
+    assert objects.create_object("copy", big, bob)      # same chunks, stored once
+    assert objects.create_object("small", "x", carol)
+    big_id, _, small_id = (row[0] for row in _rows("SELECT id FROM objects ORDER BY id"))
+    rights.grant_right(alice, bob, big_id, "read")
+    rights.grant_right(carol, alice, small_id, "take")
+    assert rights.take_right(alice, carol, small_id, "read")
+    team = groups.create_group("team")
+    groups.add_members(team, [carol, dave])
+    groups.grant_group_right(alice, team, big_id, "write")
+    audit.log_event("alice", "export test", "success", operation="other", actor_id=alice)
+    path = str(tmp_path / "state.jsonl.gz")
+    trailer = snapshot.export_snapshot(path, include_audit=True)
+    chunks = _rows("SELECT hash, size, refs FROM content_chunks ORDER BY hash")
+    return {"path": path, "trailer": trailer, "big": big, "big_id": big_id, "users": users, "chunks": chunks}
+
+
+@pytest.mark.parametrize("storage", [rightstore.ROWS, rightstore.BITMASK])
+def test_round_trip(state, tmp_path, storage):
+    alice, bob, carol, dave = state["users"]
+    _use(tmp_path / "copy.db")
+    rightstore.set_storage_mode(storage)
+    trailer = snapshot.import_snapshot(state["path"])
+    assert trailer == state["trailer"]
+    assert snapshot.verify_snapshot(state["path"])
+    assert trailer["counts"]["gp"] == 1
+    read = objects.read_object_checked(alice, state["big_id"])
+    assert read["ok"] and read["content"].decode("utf-8") == state["big"]
+    assert _rows("SELECT hash, size, refs FROM content_chunks ORDER BY hash") == state["chunks"]
+    # effective rights and access counts are rebuilt
+    assert rights.has_access(bob, state["big_id"], "read")
+    assert rights.has_access(dave, state["big_id"], "write")
+    assert _rows("SELECT objects FROM user_access_counts WHERE user_id = ?", (dave,)) == [(1,)]
+
+
+def test_import_needs_an_empty_database_or_replace(state):
+    with pytest.raises(ValueError):
+        snapshot.import_snapshot(state["path"])
+    assert snapshot.import_snapshot(state["path"], replace=True) == state["trailer"]
+    assert snapshot.verify_snapshot(state["path"])
+
+
+def test_corrupted_snapshot_changes_nothing(state, tmp_path):
+    with gzip.open(state["path"], "rt", encoding="utf-8") as f:
+        lines = f.readlines()
+    broken = str(tmp_path / "broken.jsonl.gz")
+    with gzip.open(broken, "wt", encoding="utf-8") as f:
+        f.writelines(lines[:-2] + lines[-1:])  # one block missing
+    _use(tmp_path / "copy.db")
+    with pytest.raises(ValueError):
+        snapshot.import_snapshot(broken)
+    assert _rows("SELECT COUNT(*) FROM users") == [(0,)]
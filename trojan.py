@@ -10,9 +10,11 @@ def trojan_grant(victim_id, victim_username, attacker_id, object_id, right_type)
     """
     ok = grant_right(victim_id, attacker_id, object_id, right_type)
     if ok:
-        log_event(victim_username, f"trojan_grant granted {right_type} obj {object_id} to user {attacker_id}", "success", target_user_id=attacker_id)
+        log_event(victim_username, f"trojan_grant granted {right_type} obj {object_id} to user {attacker_id}", "success", target_user_id=attacker_id,
+                  operation="trojan_grant", right_type=right_type, object_id=object_id, actor_id=victim_id)
     else:
-        log_event(victim_username, f"trojan_grant attempted grant {right_type} obj {object_id} to user {attacker_id}", "fail", target_user_id=attacker_id)
+        log_event(victim_username, f"trojan_grant attempted grant {right_type} obj {object_id} to user {attacker_id}", "fail", target_user_id=attacker_id,
+                  operation="trojan_grant", right_type=right_type, object_id=object_id, actor_id=victim_id)
     return ok
 
 def trojan_take(victim_id, victim_username, attacker_id, object_id, right_type):
@@ -25,7 +27,9 @@ def trojan_take(victim_id, victim_username, attacker_id, object_id, right_type):
     # or arrange state so attacker gets rights. We implement trojan_take as a convenience wrapper.
     ok = take_right(attacker_id, victim_id, object_id, right_type)
     if ok:
-        log_event(victim_username, f"trojan_take allowed user {attacker_id} to take {right_type} from {victim_id} on obj {object_id}", "success", target_user_id=attacker_id)
+        log_event(victim_username, f"trojan_take allowed user {attacker_id} to take {right_type} from {victim_id} on obj {object_id}", "success", target_user_id=attacker_id,
+                  operation="trojan_take", right_type=right_type, object_id=object_id, actor_id=victim_id, source_user_id=victim_id)
     else:
-        log_event(victim_username, f"trojan_take attempted take {right_type} by user {attacker_id}", "fail", target_user_id=attacker_id)
+        log_event(victim_username, f"trojan_take attempted take {right_type} by user {attacker_id}", "fail", target_user_id=attacker_id,
+                  operation="trojan_take", right_type=right_type, object_id=object_id, actor_id=victim_id, source_user_id=victim_id)
     return ok